@@ -77,6 +77,17 @@ class ArgumentParser:
             default=False,
             help="do not load from ground truth",
         )
+        nsp_parser.add_argument(
+            "--nsp_parse_cache_size",
+            type=int,
+            default=1024,
+            help="number of model parses of previous chats to keep, 0 to disable the cache",
+        )
+        nsp_parser.add_argument(
+            "--nsp_parse_cache_path",
+            default="",
+            help="if not empty, the parse cache is also kept in this file across restarts",
+        )
         nsp_parser.add_argument(
             "--dev",
             action="store_true",
@@ -125,6 +125,7 @@ class CraftAssistSwarmMaster(CraftAssistAgent):
             "_db_read_one": self.memory._db_read_one,
             "_db_write": self.memory._db_write,
             "db_write": self.memory.db_write,
+            "db_write_many": self.memory.db_write_many,
             "tag": self.memory.tag,
             "untag": self.memory.untag,
             "forget": self.memory.forget,
@@ -132,6 +133,8 @@ class CraftAssistSwarmMaster(CraftAssistAgent):
             "get_triples": self.memory.get_triples,
             "check_memid_exists": self.memory.check_memid_exists,
             "get_mem_by_id": self.memory.get_mem_by_id,
+            "get_node_types_from_memids": self.memory.get_node_types_from_memids,
+            "get_table_columns": self.memory.get_table_columns,
             "basic_search": self.memory.basic_search,
             "get_block_object_by_xyz": self.memory.get_block_object_by_xyz,
             "get_block_object_ids_by_xyz": self.memory.get_block_object_ids_by_xyz,
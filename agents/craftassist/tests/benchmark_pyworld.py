@@ -0,0 +1,88 @@
+"""
+Copyright (c) Facebook, Inc. and its affiliates.
+
+Measure how fast a FakeAgent runs in the pyworld World, and how fast the World
+answers the bulk queries the agent and data generation use.
+
+    python -m agents.craftassist.tests.benchmark_pyworld --steps 500 --sl 32
+"""
+import argparse
+import time
+import numpy as np
+
+from droidlet.shared_data_struct.rotation import look_vec
+from droidlet.lowlevel.minecraft.pyworld.world import World, Opt, flat_ground_generator
+from droidlet.lowlevel.minecraft.pyworld.utils import Player, Pos, Look, Item
+
+
+def make_world(sl, ground_generator=flat_ground_generator, players=[]):
+    spec = {
+        "players": players,
+        "mobs": [],
+        "item_stacks": [],
+        "agent": {"pos": (0, 63, 0)},
+        "coord_shift": (-sl // 2, 63 - sl // 2, -sl // 2),
+    }
+    if ground_generator is not None:
+        spec["ground_generator"] = ground_generator
+    opts = Opt()
+    opts.sl = sl
+    return World(opts, spec)
+
+
+def rate(fn, n):
+    """Calls per second of fn, run n times"""
+    start = time.perf_counter()
+    for _ in range(n):
+        fn()
+    return n / (time.perf_counter() - start)
+
+
+def benchmark_world(sl, num_queries):
+    rng = np.random.default_rng(0)
+    world = make_world(sl, ground_generator=None)
+    locs = [tuple(xyz) for xyz in rng.integers(-sl // 2, sl // 2, (num_queries, 3)) + (0, 63, 0)]
+    positions = rng.uniform(-sl / 2, sl / 2, (num_queries, 3)) + (0, 63, 0)
+    directions = [
+        look_vec(yaw, pitch)
+        for yaw, pitch in rng.uniform((-np.pi, -np.pi / 2), (np.pi, np.pi / 2), (num_queries, 2))
+    ]
+    print("world sl={}".format(sl))
+    print("  build_ground: {:.1f} worlds/s".format(rate(world.build_ground, 10)))
+    r = rate(lambda: world.get_idm_at_locs(locs), 10)
+    print("  get_idm_at_locs: {:.0f} locs/s".format(r * num_queries))
+    r = rate(lambda: world.cast_rays(positions, directions), 10)
+    print("  cast_rays: {:.0f} rays/s".format(r * num_queries))
+
+
+def benchmark_agent(sl, steps):
+    # imported here so the world benchmark runs without the agent's models
+    from agents.craftassist.tests.fake_agent import FakeAgent, FakePlayer
+
+    player = FakePlayer(
+        Player(42, "SPEAKER", Pos(5, 63, 5), Look(270, 0), Item(0, 0)), active=False
+    )
+    world = make_world(sl, players=[player])
+    agent = FakeAgent(world)
+    build = {
+        "action_type": "BUILD",
+        "schematic": {"has_name": "cube", "has_size": "medium"},
+        "location": {"location_type": "SPEAKER_POS"},
+    }
+    lf = {"dialogue_type": "HUMAN_GIVE_COMMAND", "action": build}
+    agent.set_logical_form(lf, "TEST {}".format(lf), player.name)
+    print("agent sl={}".format(sl))
+    print("  step: {:.1f} steps/s".format(rate(agent.step, steps)))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sl", type=int, default=32, help="side length of the world")
+    parser.add_argument("--steps", type=int, default=500, help="agent steps to time")
+    parser.add_argument("--queries", type=int, default=10000, help="locations and rays to time")
+    parser.add_argument("--world_only", action="store_true", help="skip the agent benchmark")
+    args = parser.parse_args()
+
+    benchmark_world(args.sl, args.queries)
+    if not args.world_only:
+        benchmark_agent(args.sl, args.steps)
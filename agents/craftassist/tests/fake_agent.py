@@ -37,7 +37,10 @@ from droidlet.lowlevel.minecraft import craftassist_specs
 from droidlet.perception.semantic_parsing.nsp_querier import NSPQuerier
 from droidlet.lowlevel.minecraft.craftassist_cuberite_utils.block_data import COLOR_BID_MAP
 from droidlet.perception.craftassist import heuristic_perception
-from droidlet.shared_data_struct.craftassist_shared_utils import CraftAssistPerceptionData
+from droidlet.shared_data_struct.craftassist_shared_utils import (
+    CraftAssistPerceptionData,
+    path_planner,
+)
 from droidlet.lowlevel.minecraft.pyworld.physical_interfaces import (
     FakeMCTime,
     init_agent_interfaces,
@@ -318,6 +321,7 @@ class FakeAgent(DroidletAgent):
                 agent_placed,
             ]
             self.world.place_block((abs_xyz, idm))
+            path_planner(self).on_blocks_changed([(abs_xyz, idm)])
         # TODO: to be named to normal update function
         self.memory.update(changes_to_be_updated, self.areas_to_perceive)
 
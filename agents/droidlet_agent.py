@@ -9,7 +9,7 @@ import datetime
 import os
 
 from agents.core import BaseAgent
-from agents.scheduler import EmptyScheduler
+from agents.scheduler import TaskScheduler
 
 from droidlet.event import sio, dispatch
 from droidlet.interpreter import InterpreterBase
@@ -44,7 +44,7 @@ class DroidletAgent(BaseAgent):
         self.areas_to_perceive = []
         self.perceive_on_chat = False
         self.agent_type = None
-        self.scheduler = EmptyScheduler()
+        self.scheduler = TaskScheduler(self.memory)
 
         self.dashboard_memory_dump_time = time.time()
         self.dashboard_memory = {
@@ -135,6 +135,8 @@ class DroidletAgent(BaseAgent):
                 "<dashboard> " + command
             )  # the chat is coming from a player called "dashboard"
             self.dashboard_chat = agent_chat
+            # don't wait out an idle task_step before reading the chat
+            self.scheduler.wake()
             status = "Sent successfully"
             # update server memory
             self.dashboard_memory["chats"].pop(0)
@@ -302,30 +304,9 @@ class DroidletAgent(BaseAgent):
         self.maybe_dump_memory_to_dashboard()
 
     def task_step(self, sleep_time=0.25):
-        query = "SELECT MEMORY FROM Task WHERE prio={}".format(TaskNode.CHECK_PRIO)
-        _, task_mems = self.memory.basic_search(query)
-        for mem in task_mems:
-            if mem.task.init_condition.check():
-                mem.get_update_status({"prio": TaskNode.CHECK_PRIO + 1})
-
-        query = "SELECT MEMORY FROM Task WHERE ((prio>{}) AND (paused <= 0))".format(
-            TaskNode.CHECK_PRIO
-        )
-        _, task_mems = self.memory.basic_search(query)
-        if not task_mems:
-            time.sleep(sleep_time)
-            return
-        task_mems = self.scheduler.filter(task_mems)
-        task_mems.sort(reverse=True, key=lambda x: x.prio)
-        for mem in task_mems:
-            # prio/finished could have been changed by another Task, e.g. a ControlBlock
-            mem.update_node()
-            if mem.prio > TaskNode.CHECK_PRIO:
-                # FIXME set the other ones to running=0.  doesn't matter rn bc scheduler is empty, everything runs
-                mem.get_update_status({"running": 1})
-                mem.task.step()
-                if mem.task.finished:
-                    mem.update_task()
+        """step the runnable tasks; if there are none, wait at most sleep_time
+        for a new (or newly runnable) task"""
+        self.scheduler.step(sleep_time=sleep_time)
 
     def get_time(self):
         # round to 100th of second, return as
@@ -1,7 +1,243 @@
 """
 Copyright (c) Facebook, Inc. and its affiliates.
 """
+import heapq
+import threading
+import time
+
+from droidlet.memory.memory_nodes import TaskNode
+from droidlet.memory.memory_util import chunks
+
+# above this many pending notifications, resync the whole Tasks table instead
+MAX_DIRTY_MEMIDS = 1000
+
 
 class EmptyScheduler:
     def filter(self, task_mems):
         return task_mems
+
+    def get_node(self, memid):
+        """the cached TaskNode of a live task, or None if the scheduler keeps no cache"""
+        return None
+
+
+class TaskScheduler(EmptyScheduler):
+    """
+    Steps the agent's Tasks.  Instead of searching the Tasks table every tick,
+    keeps the TaskNodes of live tasks (prio >= CHECK_PRIO) in memory, and is kept in
+    sync with the table by the memory's write-through hook (AgentMemory.notify_task_update):
+    rows are only re-read after they have been written, and a task is only unpickled
+    again if its pickle was written from some other copy of the task.
+
+    When there is nothing to run the scheduler waits until it is woken by a change
+    to the Tasks table (or by wake()), rather than for a fixed time.
+
+    Args:
+        memory (AgentMemory): the memory holding the Tasks table
+
+    Attributes:
+        nodes (dict): memid -> TaskNode for live tasks
+        children (dict): memid -> set of memids of the live tasks with that _has_parent_task
+        queue_depth (int): the number of runnable tasks at the last step
+        step_latency (dict): memid -> step time statistics of live tasks, see get_metrics()
+    """
+
+    def __init__(self, memory):
+        self.memory = memory
+        self.nodes = {}
+        self.rowids = {}
+        self.parents = {}
+        self.children = {}
+        self._lock = threading.Lock()
+        self._dirty = set()
+        self._stale = set()
+        self._full_sync = True
+        self._wakeup = threading.Event()
+        self.step_latency = {}
+        self.queue_depth = 0
+        self.num_waiting = 0
+        memory.on_task_update_callback = self.on_task_update
+
+    def on_task_update(self, memid=None, task=None):
+        """
+        write-through hook, run by the memory after a write to the Tasks table.
+        memid is None if many rows may have changed; task is the object whose pickle
+        was written, if it was
+        """
+        with self._lock:
+            if memid is None or len(self._dirty) > MAX_DIRTY_MEMIDS:
+                self._full_sync = True
+                self._dirty.clear()
+            else:
+                self._dirty.add(memid)
+            if task is not None:
+                node = self.nodes.get(memid)
+                if node is None or node.task is not task:
+                    self._stale.add(memid)
+        self._wakeup.set()
+
+    def wake(self):
+        """wake the scheduler if it is waiting for something to do"""
+        self._wakeup.set()
+
+    def sync(self):
+        """re-read the rows of the Tasks table that have changed since the last sync"""
+        with self._lock:
+            full_sync, self._full_sync = self._full_sync, False
+            dirty, self._dirty = self._dirty, set()
+            stale, self._stale = self._stale, set()
+        if not full_sync and not dirty:
+            return
+        cols = "rowid, uuid, prio, running, run_count, finished, paused"
+        if full_sync:
+            rows = self.memory._db_read(
+                "SELECT {} FROM Tasks WHERE prio>=?".format(cols), TaskNode.CHECK_PRIO
+            )
+            dirty = set(self.nodes.keys())
+        else:
+            rows = []
+            for chunk in chunks(list(dirty)):
+                rows.extend(
+                    self.memory._db_read(
+                        "SELECT {} FROM Tasks WHERE uuid IN ({})".format(
+                            cols, ",".join(["?"] * len(chunk))
+                        ),
+                        *chunk,
+                    )
+                )
+        for rowid, memid, prio, running, run_count, finished, paused in rows:
+            dirty.discard(memid)
+            if prio < TaskNode.CHECK_PRIO:
+                self.drop(memid)
+                continue
+            node = self.nodes.get(memid)
+            if node is None or memid in stale:
+                node = TaskNode(self.memory, memid)
+                self.nodes[memid] = node
+                self.rowids[memid] = rowid
+            node.prio = prio
+            node.running = running
+            node.run_count = run_count
+            node.finished = finished
+            node.paused = paused
+        # parents are re-read with the rest of the row: add_child_task writes the
+        # triple after it updates the child
+        live = [memid for _, memid, prio, *_ in rows if prio >= TaskNode.CHECK_PRIO]
+        for chunk in chunks(live):
+            for memid, parent in self.memory._db_read(
+                "SELECT subj, obj FROM Triples WHERE pred_text='_has_parent_task' AND subj IN ({})".format(
+                    ",".join(["?"] * len(chunk))
+                ),
+                *chunk,
+            ):
+                self.set_parent(memid, parent)
+        # whatever is left was deleted (or not a Task)
+        for memid in dirty:
+            self.drop(memid)
+
+    def set_parent(self, memid, parent):
+        old_parent = self.parents.get(memid)
+        if old_parent == parent:
+            return
+        if old_parent is not None:
+            self.children[old_parent].discard(memid)
+        self.parents[memid] = parent
+        self.children.setdefault(parent, set()).add(memid)
+
+    def drop(self, memid):
+        self.nodes.pop(memid, None)
+        self.rowids.pop(memid, None)
+        self.step_latency.pop(memid, None)
+        parent = self.parents.pop(memid, None)
+        if parent is not None:
+            self.children[parent].discard(memid)
+            if not self.children[parent]:
+                del self.children[parent]
+
+    def get_node(self, memid):
+        """
+        the cached TaskNode of a task that was live at the last sync, or None.
+        step() syncs before it steps each task
+        """
+        return self.nodes.get(memid)
+
+    def has_active_children(self, memid):
+        """whether any child of the task has prio >= 1, i.e. is going to be stepped"""
+        self.sync()
+        return any(self.nodes[c].prio >= 1 for c in self.children.get(memid, ()))
+
+    def step(self, sleep_time=0.25):
+        """
+        check the init_condition of each task waiting at CHECK_PRIO, then
+        step the runnable tasks (prio > CHECK_PRIO and not paused) in order of prio
+        """
+        self._wakeup.clear()
+        self.sync()
+        waiting = [n for n in self.nodes.values() if n.prio == TaskNode.CHECK_PRIO]
+        self.num_waiting = len(waiting)
+        for mem in waiting:
+            if mem.task.init_condition.check():
+                mem.get_update_status({"prio": TaskNode.CHECK_PRIO + 1})
+        self.sync()
+
+        task_mems = [
+            n for n in self.nodes.values() if n.prio > TaskNode.CHECK_PRIO and n.paused <= 0
+        ]
+        self.queue_depth = len(task_mems)
+        if not task_mems:
+            if sleep_time > 0:
+                self._wakeup.wait(sleep_time)
+            return
+        task_mems = self.filter(task_mems)
+        # highest prio first, ties in order of creation
+        queue = [(-mem.prio, self.rowids[mem.memid], mem) for mem in task_mems]
+        heapq.heapify(queue)
+        while queue:
+            _, _, mem = heapq.heappop(queue)
+            # prio/finished could have been changed by another Task, e.g. a ControlBlock
+            self.sync()
+            mem = self.nodes.get(mem.memid)
+            if mem is None:
+                continue
+            if mem.prio > TaskNode.CHECK_PRIO:
+                # FIXME set the other ones to running=0.  everything runnable runs for now
+                mem.get_update_status({"running": 1})
+                start = time.time()
+                mem.task.step()
+                self.record_step(mem, time.time() - start)
+                if mem.task.finished:
+                    mem.update_task()
+        self.sync()
+
+    def record_step(self, mem, latency):
+        s = self.step_latency.get(mem.memid)
+        if s is None:
+            s = {"action_name": mem.action_name, "steps": 0, "total": 0.0, "max": 0.0}
+            self.step_latency[mem.memid] = s
+        s["steps"] += 1
+        s["total"] += latency
+        s["last"] = latency
+        s["max"] = max(s["max"], latency)
+
+    def get_metrics(self):
+        """
+        returns a dict with
+            "queue_depth": the number of runnable tasks at the last step
+            "waiting": the number of tasks whose init_condition was checked at the last step
+            "step_latency": memid -> {"action_name", "steps", "mean", "last", "max"}
+                 step times in seconds of the live tasks
+        """
+        return {
+            "queue_depth": self.queue_depth,
+            "waiting": self.num_waiting,
+            "step_latency": {
+                memid: {
+                    "action_name": s["action_name"],
+                    "steps": s["steps"],
+                    "mean": s["total"] / s["steps"],
+                    "last": s["last"],
+                    "max": s["max"],
+                }
+                for memid, s in self.step_latency.items()
+            },
+        }
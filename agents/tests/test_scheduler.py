@@ -0,0 +1,122 @@
+"""
+Copyright (c) Facebook, Inc. and its affiliates.
+"""
+import threading
+import time
+import unittest
+
+from agents.scheduler import TaskScheduler
+from droidlet.memory.memory_nodes import TaskNode
+from droidlet.memory.sql_memory import AgentMemory
+from droidlet.task.task import Task
+
+
+class CountingTask(Task):
+    def __init__(self, agent, task_data={}):
+        super().__init__(agent, task_data=task_data)
+        self.num_steps = task_data.get("num_steps", 2)
+        self.steps_taken = 0
+        TaskNode(agent.memory, self.memid).update_task(task=self)
+
+    @Task.step_wrapper
+    def step(self):
+        self.steps_taken += 1
+        if self.steps_taken >= self.num_steps:
+            self.finished = True
+
+
+class FakeAgent:
+    def __init__(self):
+        self.memory = AgentMemory()
+
+
+class SchedulerTest(unittest.TestCase):
+    def setUp(self):
+        self.agent = FakeAgent()
+        self.memory = self.agent.memory
+        self.scheduler = TaskScheduler(self.memory)
+        self.agent.scheduler = self.scheduler
+        self.unpickle_count = 0
+        safe_unpickle = self.memory.safe_unpickle
+
+        def counting_unpickle(bs):
+            self.unpickle_count += 1
+            return safe_unpickle(bs)
+
+        self.memory.safe_unpickle = counting_unpickle
+
+    def test_step_and_finish(self):
+        t = CountingTask(self.agent, {"num_steps": 3})
+        self.scheduler.step(sleep_time=0)
+        assert self.memory.get_mem_by_id(t.memid).prio == TaskNode.CHECK_PRIO + 1
+        self.scheduler.step(sleep_time=0)
+        metrics = self.scheduler.get_metrics()
+        assert metrics["queue_depth"] == 1
+        assert metrics["step_latency"][t.memid]["steps"] == 2
+        assert metrics["step_latency"][t.memid]["action_name"] == "countingtask"
+        self.scheduler.step(sleep_time=0)
+        assert self.scheduler.nodes[t.memid].task.finished
+        # the finished task marks itself finished the next time it is stepped
+        self.scheduler.step(sleep_time=0)
+        assert self.memory.get_mem_by_id(t.memid).prio == TaskNode.FINISHED_PRIO
+        assert t.memid not in self.scheduler.nodes
+        assert self.scheduler.get_metrics()["step_latency"] == {}
+
+    def test_task_is_cached(self):
+        t = CountingTask(self.agent, {"num_steps": 10})
+        self.scheduler.step(sleep_time=0)
+        n = self.unpickle_count
+        for i in range(5):
+            self.scheduler.step(sleep_time=0)
+        # the task is not re-read from the db when only the scheduler's copy writes it
+        cached_task = self.scheduler.nodes[t.memid].task
+        assert cached_task.steps_taken == 6
+        assert self.unpickle_count - n == 0
+
+        # but it is if some other copy writes it
+        TaskNode(self.memory, t.memid).update_task(task=t)
+        self.scheduler.step(sleep_time=0)
+        reloaded_task = self.scheduler.nodes[t.memid].task
+        assert reloaded_task is not cached_task
+        assert reloaded_task.steps_taken == t.steps_taken + 1
+
+    def test_active_children(self):
+        parent = CountingTask(self.agent, {"num_steps": 10})
+        child = CountingTask(self.agent, {"num_steps": 2})
+        self.scheduler.step(sleep_time=0)
+        TaskNode(self.memory, parent.memid).add_child_task(child)
+        n = self.unpickle_count
+        # the parent waits while its child runs, and until the child marks itself finished
+        for i in range(2):
+            self.scheduler.step(sleep_time=0)
+        parent = self.scheduler.nodes[parent.memid].task
+        assert parent.steps_taken == 1
+        assert child.memid not in self.scheduler.nodes
+        assert self.scheduler.children == {}
+        self.scheduler.step(sleep_time=0)
+        assert parent.steps_taken == 2
+        assert self.unpickle_count - n == 0
+
+    def test_pause_and_clear(self):
+        t = CountingTask(self.agent, {"num_steps": 10})
+        self.scheduler.step(sleep_time=0)
+        self.memory.task_stack_pause()
+        self.scheduler.step(sleep_time=0)
+        assert TaskNode(self.memory, t.memid).paused
+        assert self.scheduler.get_metrics()["queue_depth"] == 0
+        self.memory.task_stack_resume()
+        self.scheduler.step(sleep_time=0)
+        assert self.scheduler.get_metrics()["queue_depth"] == 1
+        self.memory.task_stack_clear()
+        self.scheduler.step(sleep_time=0)
+        assert self.scheduler.nodes == {}
+
+    def test_wake(self):
+        start = time.time()
+        threading.Timer(0.1, self.scheduler.wake).start()
+        self.scheduler.step(sleep_time=5)
+        assert time.time() - start < 2
+
+
+if __name__ == "__main__":
+    unittest.main()
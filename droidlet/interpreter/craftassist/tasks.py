@@ -14,7 +14,11 @@ from droidlet.lowlevel.minecraft.craftassist_cuberite_utils.block_data import (
     BUILD_INTERCHANGEABLE_PAIRS,
 )
 from droidlet.base_util import npy_to_blocks_list, blocks_list_to_npy, to_block_pos
-from droidlet.shared_data_struct.craftassist_shared_utils import astar, MOBS_BY_ID
+from droidlet.shared_data_struct.craftassist_shared_utils import (
+    astar,
+    path_planner,
+    MOBS_BY_ID,
+)
 from droidlet.perception.craftassist.heuristic_perception import ground_height
 from droidlet.lowlevel.minecraft.mc_util import manhat_dist, strip_idmeta
 
@@ -216,6 +220,7 @@ class Move(BaseMovementTask):
             agent.set_held_item(idm)
             if agent.place_block(*pos):
                 logging.debug("Move: replaced {}".format((pos, idm)))
+                path_planner(agent).on_blocks_changed([(pos, idm)])
             else:
                 # try again later
                 self.replace.add((pos, idm))
@@ -231,6 +236,10 @@ class Move(BaseMovementTask):
 
         # get path
         if self.path is None or tuple(agent.pos) != self.path[-1]:
+            if self.path is not None:
+                # the last step didn't go where the path said, so the cached
+                # blocks it was planned over are out of date
+                path_planner(agent).invalidate()
             self.path = astar(agent, self.target, self.approx)
             if self.path is None:
                 self.handle_no_path(agent)
@@ -254,7 +263,8 @@ class Move(BaseMovementTask):
                 # dig if necessary
                 for (bp, idm) in npy_to_blocks_list(newpos_blocks, newpos):
                     self.replace.add((bp, idm))
-                    agent.dig(*bp)
+                    if agent.dig(*bp):
+                        path_planner(agent).on_blocks_changed([(bp, (0, 0))])
                 # move
                 step_fn = getattr(agent, step_fn_name)
                 step_fn()
@@ -405,6 +415,7 @@ class Build(Task):
             if manhat_dist(agent.pos, target) <= self.DIG_REACH:
                 success = agent.dig(*target)
                 if success:
+                    path_planner(agent).on_blocks_changed([(target, (0, 0))])
                     agent.memory.maybe_remove_inst_seg(target)
                     if self.is_destroy_schm:
                         agent.memory.maybe_remove_block_from_memory(
@@ -455,7 +466,8 @@ class Build(Task):
                 logging.debug(
                     "removing block {} @ {} from {}".format(current_idm, target, agent.pos)
                 )
-                agent.dig(*target)
+                if agent.dig(*target):
+                    path_planner(agent).on_blocks_changed([(target, (0, 0))])
             if idm[0] > 0:
                 agent.set_held_item(idm)
                 logging.debug("placing block {} @ {} from {}".format(idm, target, agent.pos))
@@ -463,6 +475,7 @@ class Build(Task):
                 if agent.place_block(x, y, z):
                     B = agent.get_blocks(x, x, y, y, z, z)
                     if B[0, 0, 0, 0] == idm[0]:
+                        path_planner(agent).on_blocks_changed([((x, y, z), tuple(idm))])
                         interesting, player_placed, agent_placed = agent.perception_modules[
                             "low_level"
                         ].mark_blocks_with_env_change(
@@ -562,8 +575,9 @@ class Build(Task):
         In order:
         1. don't build over your own body
         2. build ground-up
-        3. try failed blocks again at the end
-        4. build closer blocks first
+        3. build blocks that can be reached first
+        4. try failed blocks again at the end
+        5. build closer blocks first
 
         Args:
         - current: yzxb-ordered current state of the region
@@ -572,8 +586,15 @@ class Build(Task):
         relpos_yzx = (agent.pos - self.origin)[[1, 2, 0]]
 
         diff_yzx = list(np.argwhere(diff))
-        diff_yzx.sort(key=lambda yzx: manhat_dist(yzx, relpos_yzx))  # 4
-        diff_yzx.sort(key=lambda yzx: -self.attempts[tuple(yzx)])  # 3
+        # one reachability query for every candidate, instead of a search each
+        xyzs = np.argwhere(diff)[:, [2, 0, 1]] + self.origin
+        reachable = {
+            tuple(yzx): r
+            for yzx, r in zip(diff_yzx, path_planner(agent).reachable(xyzs, self.PLACE_REACH))
+        }
+        diff_yzx.sort(key=lambda yzx: manhat_dist(yzx, relpos_yzx))  # 5
+        diff_yzx.sort(key=lambda yzx: -self.attempts[tuple(yzx)])  # 4
+        diff_yzx.sort(key=lambda yzx: not reachable[tuple(yzx)])  # 3
         diff_yzx.sort(key=lambda yzx: yzx[0])  # 2
         diff_yzx.sort(
             key=lambda yzx: tuple(yzx) in (tuple(relpos_yzx), tuple(relpos_yzx + [1, 0, 0]))
@@ -582,11 +603,12 @@ class Build(Task):
 
     def get_next_destroy_target(self, agent, xyzs):
         p = agent.pos
-        for i, c in enumerate(sorted(xyzs, key=lambda c: manhat_dist(p, c))):
-            path = astar(agent, c, approx=2)
-            if path is not None:
+        candidates = sorted(xyzs, key=lambda c: manhat_dist(p, c))
+        reachable = path_planner(agent).reachable(candidates, approx=2)
+        for i, c in enumerate(candidates):
+            if reachable[i]:
                 if i > 0:
-                    logging.debug("Destroy get_next_destroy_target wasted {} astars".format(i))
+                    logging.debug("Destroy get_next_destroy_target skipped {} blocks".format(i))
                 return c
 
         # No path to any of the blocks
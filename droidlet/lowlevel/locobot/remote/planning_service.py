@@ -1,8 +1,9 @@
 import os
 import math
+import time
 import numpy as np
 import Pyro4
-from slam_pkg.utils.fmm_planner import FMMPlanner
+from slam_pkg.utils.fmm_planner import FMMPlannerCache
 from rich import print
 
 Pyro4.config.SERIALIZER = "pickle"
@@ -19,12 +20,49 @@ class Planner(object):
     def __init__(self, slam):
         self.slam = slam
         self.map_resolution = self.slam.get_map_resolution()
+        self.map_version = None
+        self.traversable_map = None
+        self.fmm_cache = FMMPlannerCache()
+        self.latency = {"calls": 0, "total": 0.0, "last": 0.0, "max": 0.0}
+
+    def get_traversable_map(self):
+        """fetches the traversable map from slam, only if it changed since the last call"""
+        version = self.slam.get_map_version()
+        if version != self.map_version or self.traversable_map is None:
+            self.traversable_map = self.slam.get_traversable_map()
+            self.map_version = version
+        return self.traversable_map
 
     def get_short_term_goal(self, robot_location, goal, step_size=25):
         """
         robot_location is simply get_base_state
         """
-
+        start = time.time()
+        try:
+            return self._get_short_term_goal(robot_location, goal, step_size=step_size)
+        finally:
+            latency = time.time() - start
+            self.latency["calls"] += 1
+            self.latency["total"] += latency
+            self.latency["last"] = latency
+            self.latency["max"] = max(self.latency["max"], latency)
+
+    def get_latency(self):
+        """
+        returns the latency statistics (in seconds) of get_short_term_goal,
+        and the hits and misses of the distance field cache
+        """
+        calls = self.latency["calls"]
+        return {
+            "calls": calls,
+            "mean": self.latency["total"] / calls if calls else 0.0,
+            "last": self.latency["last"],
+            "max": self.latency["max"],
+            "cache_hits": self.fmm_cache.hits,
+            "cache_misses": self.fmm_cache.misses,
+        }
+
+    def _get_short_term_goal(self, robot_location, goal, step_size):
         # convert real co-ordinates to map co-ordinates
         goal_map_location = self.slam.real2map(goal[:2])
 
@@ -33,17 +71,23 @@ class Planner(object):
         robot_map_location = self.slam.robot2map(robot_location)
 
         # get occupancy map
-        traversable_map = self.slam.get_traversable_map()
+        traversable_map = self.get_traversable_map()
 
         # if the goal is an obstacle, you can't go there. Return
         if not is_traversable(goal_map_location, traversable_map):
             return False
 
-        # construct a planner
-        self.planner = FMMPlanner(traversable_map, step_size=int(step_size / self.map_resolution))
-
-        # set the goal and location in planner, get short-term-goal
-        self.planner.set_goal(goal_map_location)
+        # get a planner with the distance field to the goal set,
+        # reused if neither the goal nor the map around the robot and goal changed
+        self.planner = self.fmm_cache.get_planner(
+            traversable_map,
+            self.map_version,
+            robot_map_location,
+            goal_map_location,
+            int(step_size / self.map_resolution),
+        )
+
+        # get short-term-goal
         stg = self.planner.get_short_term_goal(robot_map_location)
 
         # if the goal is an obstacle, you can't go there. Return
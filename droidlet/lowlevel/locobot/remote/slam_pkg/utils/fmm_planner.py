@@ -1,7 +1,12 @@
+from collections import OrderedDict
+
 import numpy as np
 import skfmm
 from numpy import ma
 
+# distance assigned to cells the goal can't be reached from
+UNREACHABLE = 10000
+
 
 class FMMPlanner(object):
     def __init__(self, traversable, step_size=5):
@@ -17,23 +22,32 @@ class FMMPlanner(object):
         self.traversable = traversable
         self.last_goal = None
 
-    def set_goal(self, goal):
+    def set_goal(self, goal, window=None):
         """
         Helps to set the goal and calculate distance from goal, try to visualize dd to get more intuition
         :param goal: goal points in map space [x_goal_co-ordinate, y_goal_co-ordinate]
+        :param window: if given, (y0, y1, x0, x1): the distance is only computed for
+            paths inside traversable[y0:y1, x0:x1], cells outside it are UNREACHABLE
         :type goal: list
         """
-        traversable_ma = ma.masked_values(self.traversable * 1, 0)
-        # print(f'traversable_ma zeros {np.count_nonzero(traversable_ma == 0)}')
+        h, w = self.traversable.shape
+        y0, y1, x0, x1 = window if window is not None else (0, h, 0, w)
+        traversable_ma = ma.masked_values(self.traversable[y0:y1, x0:x1] * 1, 0)
         goal_x, goal_y = round(goal[0]), round(goal[1])
-        traversable_ma[goal_y, goal_x] = 0
+        traversable_ma[goal_y - y0, goal_x - x0] = 0
         dd = skfmm.distance(traversable_ma, dx=1)
-        dd_mask = np.invert(np.isnan(ma.filled(dd, np.nan)))
-        # dd = ma.filled(dd, np.max(dd) + 1)
-        dd = ma.filled(dd, 10000)
+        dd = ma.filled(dd, UNREACHABLE)
+        if window is not None:
+            full = np.full((h, w), UNREACHABLE, dtype=dd.dtype)
+            full[y0:y1, x0:x1] = dd
+            dd = full
         self.fmm_dist = dd
+        self.last_goal = (goal_x, goal_y)
+        self.window = (y0, y1, x0, x1)
 
-        # print(f'fmm_dist.shape {self.fmm_dist.shape}')
+    def is_reachable(self, state):
+        """whether the goal set can be reached from state (in map space)"""
+        return self.fmm_dist[round(state[1]), round(state[0])] < UNREACHABLE
 
     def get_short_term_goal(self, state):
         """
@@ -68,3 +82,93 @@ class FMMPlanner(object):
         sy = stg_y - self.step_size + state[1]
         # print(f'self.fmm_dist {self.fmm_dist[sy][sx], self.fmm_dist[state[1]][state[0]]}')
         return sx, sy
+
+
+class FMMPlannerCache(object):
+    """
+    Keeps the FMM distance fields of recent goals, so that planning towards the same goal
+    again only solves FMM when the map has changed in a way that matters.
+
+    Distance fields are computed in a window around the robot and the goal, padded by
+    margin cells (the whole map if margin is None), and are reused as long as
+      - the goal cell is the same,
+      - the map is the same version, or no cell inside the window has changed since, and
+      - the robot's step neighborhood is inside the window.
+    If the robot can't reach the goal inside the window, the full map is solved instead.
+
+    :param margin: padding in cells of the window around the robot and goal
+    :param maxsize: number of goals whose distance fields are kept
+    """
+
+    def __init__(self, margin=200, maxsize=8):
+        self.margin = margin
+        self.maxsize = maxsize
+        # goal cell -> (map version, traversable map, FMMPlanner)
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def clear(self):
+        self.entries.clear()
+
+    def get_window(self, shape, robot, goal, step_size):
+        h, w = shape
+        if self.margin is None:
+            return (0, h, 0, w)
+        pad = self.margin + step_size
+        y0 = max(0, min(robot[1], goal[1]) - pad)
+        y1 = min(h, max(robot[1], goal[1]) + pad + 1)
+        x0 = max(0, min(robot[0], goal[0]) - pad)
+        x1 = min(w, max(robot[0], goal[0]) + pad + 1)
+        return (y0, y1, x0, x1)
+
+    def covers(self, window, state, step_size, shape):
+        """whether the step neighborhood of state (clipped to the map) is inside window"""
+        y0, y1, x0, x1 = window
+        h, w = shape
+        return (
+            y0 <= max(0, state[1] - step_size)
+            and min(h, state[1] + step_size + 1) <= y1
+            and x0 <= max(0, state[0] - step_size)
+            and min(w, state[0] + step_size + 1) <= x1
+        )
+
+    def get_planner(self, traversable, version, robot, goal, step_size):
+        """
+        returns an FMMPlanner with the distance field to goal set, for the robot at robot.
+        robot and goal are in map space, version identifies the traversable map: maps
+        with the same version must be the same.
+        """
+        robot = (round(robot[0]), round(robot[1]))
+        goal = (round(goal[0]), round(goal[1]))
+        entry = self.entries.get(goal)
+        if entry is not None:
+            self.entries.move_to_end(goal)
+            old_version, old_traversable, planner = entry
+            if planner.step_size == step_size and self.covers(
+                planner.window, robot, step_size, traversable.shape
+            ):
+                if old_version == version:
+                    self.hits += 1
+                    return planner
+                y0, y1, x0, x1 = planner.window
+                if old_traversable.shape == traversable.shape and np.array_equal(
+                    old_traversable[y0:y1, x0:x1], traversable[y0:y1, x0:x1]
+                ):
+                    # nothing changed inside the window
+                    self.entries[goal] = (version, traversable, planner)
+                    self.hits += 1
+                    return planner
+
+        self.misses += 1
+        planner = FMMPlanner(traversable, step_size=step_size)
+        h, w = traversable.shape
+        window = self.get_window((h, w), robot, goal, step_size)
+        planner.set_goal(goal, window=window)
+        if not planner.is_reachable(robot) and window != (0, h, 0, w):
+            planner.set_goal(goal)
+        self.entries[goal] = (version, traversable, planner)
+        self.entries.move_to_end(goal)
+        if len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+        return planner
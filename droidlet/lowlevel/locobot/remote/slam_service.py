@@ -48,6 +48,9 @@ class SLAM(object):
         # in any meaningful way
         self.init_state = (0.0, 0.0, 0.0)
         self.prev_bot_state = (0.0, 0.0, 0.0)
+        # incremented every time the traversable map is recomputed, so that
+        # clients can cache what they compute from it
+        self.map_version = 0
 
         self.update_map()
         assert self.traversable is not None
@@ -55,6 +58,9 @@ class SLAM(object):
     def get_traversable_map(self):
         return self.traversable
 
+    def get_map_version(self):
+        return self.map_version
+
     def real2map(self, real):
         return self.map_builder.real2map(real)
 
@@ -99,6 +105,7 @@ class SLAM(object):
         selem = disk(self.robot_rad / self.map_builder.resolution)
         traversable = binary_dilation(obstacle, selem) != True
         self.traversable = traversable
+        self.map_version += 1
 
     def get_map_resolution(self):
         return self.map_resolution
@@ -0,0 +1,63 @@
+"""
+Copyright (c) Facebook, Inc. and its affiliates.
+"""
+import unittest
+
+import numpy as np
+
+from droidlet.lowlevel.locobot.remote.slam_pkg.utils.fmm_planner import (
+    FMMPlanner,
+    FMMPlannerCache,
+)
+
+
+class FMMPlannerCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.traversable = np.ones((200, 200), dtype=bool)
+        self.traversable[90:110, 100] = False
+        self.robot = (20, 100)
+        self.goal = (180, 100)
+
+    def test_window_matches_full_map(self):
+        full = FMMPlanner(self.traversable, step_size=5)
+        full.set_goal(self.goal)
+        cache = FMMPlannerCache(margin=60)
+        planner = cache.get_planner(self.traversable, 0, self.robot, self.goal, 5)
+        self.assertEqual(planner.window, (35, 166, 0, 200))
+        self.assertEqual(
+            planner.get_short_term_goal(self.robot), full.get_short_term_goal(self.robot)
+        )
+
+    def test_reuse(self):
+        cache = FMMPlannerCache(margin=20)
+        planner = cache.get_planner(self.traversable, 0, self.robot, self.goal, 5)
+        self.assertIs(cache.get_planner(self.traversable, 0, (22, 100), self.goal, 5), planner)
+
+        # a change outside the window doesn't invalidate the distance field
+        changed = self.traversable.copy()
+        changed[0:10, 0:10] = False
+        self.assertIs(cache.get_planner(changed, 1, self.robot, self.goal, 5), planner)
+
+        # a change inside it does
+        changed = changed.copy()
+        changed[95:105, 60] = False
+        other = cache.get_planner(changed, 2, self.robot, self.goal, 5)
+        self.assertIsNot(other, planner)
+        self.assertEqual(cache.hits, 2)
+        self.assertEqual(cache.misses, 2)
+
+        # so does the robot leaving the window
+        self.assertIsNot(cache.get_planner(changed, 2, (20, 10), self.goal, 5), other)
+
+    def test_unreachable_in_window(self):
+        # a wall that can only be passed far from the robot and goal
+        traversable = np.ones((200, 200), dtype=bool)
+        traversable[5:200, 100] = False
+        cache = FMMPlannerCache(margin=10)
+        planner = cache.get_planner(traversable, 0, self.robot, self.goal, 5)
+        self.assertEqual(planner.window, (0, 200, 0, 200))
+        self.assertTrue(planner.is_reachable(self.robot))
+
+
+if __name__ == "__main__":
+    unittest.main()
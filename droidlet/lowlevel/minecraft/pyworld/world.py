@@ -131,24 +131,19 @@ class World:
             + p[5] * np.cos(g[1]) * np.sin(g[1])
         )
         ground_height = ground_height - ground_height.mean() + avg_ground_height
-        for i in range(self.sl):
-            for j in range(self.sl):
-                height = min(31, max(0, int(ground_height[i, j])))
-                for k in range(int(height)):
-                    self.blocks[i, k, j] = (3, 0)
+        # int() truncates towards zero, as astype does
+        height = np.clip(ground_height.astype("int32"), 0, 31)
+        below = np.arange(self.sl)[None, :, None] < height[:, None, :]
+        self.blocks[below] = (3, 0)
 
-        # FIXME this is broken
         if hasattr(self.opts, "ground_block_probs"):
-            ground_blocks = np.transpose(np.nonzero(self.blocks[:, :, :, 0] == 3))
-            num_ground_blocks = len(ground_blocks)
+            ground_blocks = np.nonzero(self.blocks[:, :, :, 0] == 3)
+            num_ground_blocks = len(ground_blocks[0])
             for idm, val in self.opts.ground_block_probs:
                 if idm != (3, 0):
-                    num = np.random.rand() * val * 2 * num_ground_blocks
-                    for i in range(num):
-                        j = np.random.randint(num_ground_blocks)
-                        self.blocks[
-                            ground_blocks[j][0], ground_blocks[j][1], ground_blocks[j][2], :
-                        ] = idm
+                    num = int(np.random.rand() * val * 2 * num_ground_blocks)
+                    j = np.random.randint(num_ground_blocks, size=num)
+                    self.blocks[tuple(g[j] for g in ground_blocks)] = idm
 
     def place_block(self, block: Block, force=False):
         loc, idm = block
@@ -196,11 +191,21 @@ class World:
 
     def get_idm_at_locs(self, xyzs: Sequence[XYZ]) -> Dict[XYZ, IDM]:
         """Return the ground truth block state"""
-        d = {}
-        for (x, y, z) in xyzs:
-            B = self.get_blocks(x, x, y, y, z, z)
-            d[(x, y, z)] = tuple(B[0, 0, 0, :])
-        return d
+        xyzs = [tuple(xyz) for xyz in xyzs]
+        return dict(zip(xyzs, map(tuple, self.get_idms(xyzs).tolist())))
+
+    def get_idms(self, xyzs: Sequence[XYZ]) -> np.ndarray:
+        """Return the (id, meta) of each location as an N x 2 array.
+
+        Locations outside the world are bedrock, as in get_blocks.
+        """
+        locs = np.asarray(self.to_world_coords(np.reshape(xyzs, (-1, 3)))).astype("int64")
+        idms = np.zeros((len(locs), 2), dtype="uint8")
+        idms[:, 0] = 7
+        inside = ((locs >= 0) & (locs < self.sl)).all(axis=1)
+        x, y, z = locs[inside].T
+        idms[inside] = self.blocks[x, y, z]
+        return idms
 
     def get_mobs(self):
         return [m.get_info() for m in self.mobs]
@@ -252,22 +257,63 @@ class World:
             return pre_B
 
     def get_line_of_sight(self, pos, yaw, pitch):
-        # it is assumed lv is unit normalized
-        pos = tuple(self.to_world_coords(pos))
-        lv = look_vec(yaw, pitch)
-        dt = 1.0
-        for n in range(2 * self.sl):
-            p = tuple(np.round(np.add(pos, n * dt * lv)).astype("int32"))
-            for i in range(-1, 2):
-                for j in range(-1, 2):
-                    for k in range(-1, 2):
-                        sp = tuple(np.add(p, (i, j, k)))
-                        if all([x >= 0 for x in sp]) and all([x < self.sl for x in sp]):
-                            if tuple(self.blocks[sp]) != (0, 0):
-                                # TODO: deal with close blocks artifacts,
-                                # etc
-                                return tuple(self.from_world_coords(sp))
-        return
+        return self.cast_rays([pos], [look_vec(yaw, pitch)])[0]
+
+    def cast_rays(self, positions, directions, max_dist=None):
+        """Return the first block hit by each ray, or None if it hits nothing.
+
+        A 3D DDA (Amanatides and Woo) over all rays at once: every iteration
+        moves each ray into the next voxel it crosses.  Block (x, y, z) is the
+        unit cube centred on (x, y, z), and a ray hits a block whose id or meta
+        is nonzero, including the one it starts in.
+
+        Args:
+        - positions: N ray origins
+        - directions: N ray directions, not necessarily unit normalized
+        - max_dist: how far to follow the rays, default 2 * sl
+
+        Returns: a list of N (x, y, z) or None
+        """
+        if max_dist is None:
+            max_dist = 2 * self.sl
+        # shift by half a block so that voxel v spans [v, v + 1) on each axis
+        o = np.asarray(self.to_world_coords(np.reshape(positions, (-1, 3))), "float64") + 0.5
+        d = np.reshape(directions, (-1, 3)).astype("float64")
+        d = d / np.linalg.norm(d, axis=1, keepdims=True)
+
+        v = np.floor(o).astype("int64")
+        step = np.sign(d).astype("int64")
+        with np.errstate(divide="ignore"):
+            t_delta = 1 / np.abs(d)
+        # distance along the ray to the first voxel boundary on each axis
+        t_max = np.where(step > 0, v + 1 - o, o - v) * np.where(step != 0, t_delta, 0)
+        t_max[step == 0] = np.inf
+
+        hits = [None] * len(o)
+        active = np.arange(len(o))
+        t = np.zeros(len(o))
+        while True:
+            active = active[t[active] <= max_dist]
+            if len(active) == 0:
+                break
+            va = v[active]
+            inside = ((va >= 0) & (va < self.sl)).all(axis=1)
+            hit = np.zeros(len(active), dtype=bool)
+            x, y, z = va[inside].T
+            hit[inside] = self.blocks[x, y, z].any(axis=1)
+            for i, p in zip(active[hit], self.from_world_coords(va[hit]).tolist()):
+                hits[i] = tuple(p)
+
+            # stop rays that hit or left the world for good
+            sa = step[active]
+            leaving = ((va < 0) & (sa <= 0)) | ((va >= self.sl) & (sa >= 0))
+            active = active[~hit & ~leaving.any(axis=1)]
+
+            axis = np.argmin(t_max[active], axis=1)
+            t[active] = t_max[active, axis]
+            v[active, axis] += step[active, axis]
+            t_max[active, axis] += t_delta[active, axis]
+        return hits
 
     def add_incoming_chat(self, chat: str, speaker_name: str):
         """Add a chat to memory as if it was just spoken by SPEAKER"""
@@ -0,0 +1,63 @@
+"""
+Copyright (c) Facebook, Inc. and its affiliates.
+"""
+import unittest
+import numpy as np
+from droidlet.lowlevel.minecraft.pyworld.world import World, Opt, flat_ground_generator
+
+
+class PyWorldTest(unittest.TestCase):
+    def setUp(self):
+        spec = {
+            "players": [],
+            "mobs": [],
+            "item_stacks": [],
+            "ground_generator": flat_ground_generator,
+            "agent": {"pos": (0, 63, 0)},
+            "coord_shift": (-16, 54, -16),
+        }
+        opts = Opt()
+        opts.sl = 32
+        self.world = World(opts, spec)
+        # ground top is at y=62
+        self.world.place_block(((2, 63, 0), (35, 4)))
+        self.world.place_block(((2, 64, 0), (35, 5)))
+
+    def test_build_ground(self):
+        opts = Opt()
+        opts.sl = 16
+        opts.avg_ground_height = 4.0
+        world = World(opts, {"players": [], "mobs": [], "item_stacks": [], "agent": {}})
+        ground = world.blocks[:, :, :, 0] == 3
+        self.assertTrue(ground.any())
+        # columns are filled from the bottom up
+        height = ground.sum(axis=1)
+        filled = np.arange(opts.sl)[None, :, None] < height[:, None, :]
+        self.assertTrue((ground == filled).all())
+
+    def test_get_idm_at_locs(self):
+        locs = [(2, 63, 0), (2, 64, 0), (2, 65, 0), (0, 62, 0), (100, 63, 0)]
+        idms = self.world.get_idm_at_locs(locs)
+        self.assertEqual(list(idms.keys()), locs)
+        self.assertEqual(list(idms.values()), [(35, 4), (35, 5), (0, 0), (3, 0), (7, 0)])
+        for (x, y, z), idm in idms.items():
+            self.assertEqual(tuple(self.world.get_blocks(x, x, y, y, z, z)[0, 0, 0]), idm)
+
+    def test_line_of_sight(self):
+        # looking along +x at head height hits the top wool block
+        self.assertEqual(self.world.get_line_of_sight((0, 64, 0), -np.pi / 2, 0), (2, 64, 0))
+        # looking straight down hits the ground
+        self.assertEqual(self.world.get_line_of_sight((0, 64, 0), 0, -np.pi / 2), (0, 62, 0))
+        # looking up hits nothing
+        self.assertIsNone(self.world.get_line_of_sight((0, 64, 0), 0, np.pi / 2))
+
+    def test_cast_rays(self):
+        positions = [(0, 64, 0), (0, 63.4, 0), (0, 65, 0), (2, 66, 0)]
+        directions = [(1, 0, 0), (1, 0, 0), (2, -1, 0), (0, -1, 0)]
+        hits = self.world.cast_rays(positions, directions)
+        self.assertEqual(hits, [(2, 64, 0), (2, 63, 0), (2, 64, 0), (2, 64, 0)])
+        self.assertEqual(self.world.cast_rays(positions, directions, max_dist=1), [None] * 4)
+
+
+if __name__ == "__main__":
+    unittest.main()
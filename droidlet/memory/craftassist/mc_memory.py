@@ -4,7 +4,8 @@ Copyright (c) Facebook, Inc. and its affiliates.
 import copy
 import os
 import random
-from collections import namedtuple
+import numpy as np
+from collections import Counter, namedtuple
 from typing import Optional, List
 from droidlet.memory.sql_memory import AgentMemory, DEFAULT_PIXELS_PER_UNIT
 from droidlet.base_util import diag_adjacent, IDM, XYZ, Block, npy_to_blocks_list
@@ -126,6 +127,11 @@ class MCAgentMemory(AgentMemory):
         :return:
         updated_areas_to_perceive: list of (xyz, idm) representing the area agent should perceive
         """
+        # all writes from one perception update go in a single transaction
+        with self.batch():
+            return self._update(perception_output, areas_to_perceive)
+
+    def _update(self, perception_output, areas_to_perceive):
         if not perception_output:
             return areas_to_perceive
         output = {}
@@ -232,22 +238,13 @@ class MCAgentMemory(AgentMemory):
 
         # 5. Update the state of the world when a block is changed.
         if perception_output.changed_block_attributes:
-            for (xyz, idm) in perception_output.changed_block_attributes:
-                # 5.1 Update old instance segmentation if needed
-                self.maybe_remove_inst_seg(xyz)
-
-                # 5.2 Update agent's memory with blocks that have been destroyed.
-                updated_areas_to_perceive = self.maybe_remove_block_from_memory(
-                    xyz, idm, areas_to_perceive
-                )
-
-                # 5.3 Update blocks in memory when any change in the environment is caused either by agent or player
-                (
-                    interesting,
-                    player_placed,
-                    agent_placed,
-                ) = perception_output.changed_block_attributes[(xyz, idm)]
-                self.maybe_add_block_to_memory(interesting, player_placed, agent_placed, xyz, idm)
+            changes = perception_output.changed_block_attributes
+            xyzs = [xyz for xyz, _ in changes]
+            idms = [idm for _, idm in changes]
+            interesting, player_placed, agent_placed = zip(*changes.values())
+            updated_areas_to_perceive = self.update_blocks(
+                xyzs, idms, interesting, player_placed, agent_placed, areas_to_perceive
+            )
 
         """Now perform update the memory with input from heuristic perception module"""
         # 1. Process everything in area to attend for perception
@@ -298,6 +295,207 @@ class MCAgentMemory(AgentMemory):
         output["areas_to_perceive"] = updated_areas_to_perceive
         return output
 
+    def update_blocks(
+        self, xyzs, idms, interesting, player_placed, agent_placed, areas_to_perceive=[]
+    ):
+        """Absorb all the block changes from one perception tick.
+
+        Has the effect of running, for each change in order, maybe_remove_inst_seg,
+        maybe_remove_block_from_memory and maybe_add_block_to_memory.  Instead of
+        querying the db for every neighbour of every block, the BlockObjects voxels
+        in the columns around the changes are read once into a voxel -> memid
+        index.  Merges and voxel counts and means are worked out against the index,
+        and the resulting voxel and ReferenceObjects rows are written in one batch.
+
+        Args:
+            xyzs: N x 3 locations of the changed blocks
+            idms: N x 2 (id, meta) of the blocks now at those locations
+            interesting, player_placed, agent_placed: length N flags, as returned by
+                LowLevelMCPerception.mark_blocks_with_env_change
+            areas_to_perceive: list of (xyz, radius) to add the removed blocks to
+
+        Returns:
+            areas_to_perceive with the locations of removed blocks added
+        """
+        areas_to_perceive = copy.deepcopy(areas_to_perceive)
+        xyzs = [tuple(xyz) for xyz in np.asarray(xyzs, dtype="int64").reshape(-1, 3).tolist()]
+        if len(xyzs) == 0:
+            return areas_to_perceive
+        idms = [tuple(idm) for idm in np.asarray(idms, dtype="int64").reshape(-1, 2).tolist()]
+        (mx, _, mz), (Mx, _, Mz) = np.min(xyzs, axis=0), np.max(xyzs, axis=0)
+        xz_bounds = (int(mx) - 1, int(Mx) + 1, int(mz) - 1, int(Mz) + 1)
+        changed = set(xyzs)
+
+        with self.batch():
+            # the old instance segmentation of changed blocks is no longer valid
+            r = self._db_read(
+                'SELECT DISTINCT uuid, x, y, z FROM VoxelObjects WHERE ref_type="inst_seg" AND x BETWEEN ? AND ? AND z BETWEEN ? AND ?',
+                *xz_bounds
+            )
+            for memid in {memid for memid, x, y, z in r if (x, y, z) in changed}:
+                self.forget(memid)
+
+            # whole columns are read, so removals know whether a column empties
+            voxels = {}
+            columns = Counter()
+            for memid, x, y, z, *row in self._db_read(
+                "SELECT uuid, x, y, z, bid, meta, updated, player_placed, agent_placed FROM VoxelObjects WHERE ref_type=? AND x BETWEEN ? AND ? AND z BETWEEN ? AND ?",
+                "BlockObjects",
+                *xz_bounds
+            ):
+                voxels[(x, y, z)] = [memid, *row]
+                columns[(x, z)] += 1
+            memids = {v[0] for v in voxels.values()}
+            counts = {}
+            for memid, count, x, y, z in self._db_read(
+                "SELECT uuid, voxel_count, x, y, z FROM ReferenceObjects WHERE uuid IN ({})".format(
+                    ",".join(["?"] * len(memids))
+                ),
+                *memids
+            ):
+                counts[memid] = [count, (x, y, z)]
+
+            created = []
+            merges = []
+            attended = []
+            map_changes = []
+            dirty = set()
+            touched = set()
+            now = self.get_time()
+
+            def remove(xyz):
+                memid = voxels.pop(xyz)[0]
+                touched.add(memid)
+                counts[memid][0] -= 1
+                if counts[memid][0] > 0:
+                    counts[memid][1] = self._voxel_mean(counts[memid][1], counts[memid][0], xyz)
+                columns[(xyz[0], xyz[2])] -= 1
+                dirty.add(xyz)
+
+            def upsert(xyz, idm, memid, player_placed, agent_placed):
+                touched.add(memid)
+                counts[memid][0] += 1
+                counts[memid][1] = self._voxel_mean(counts[memid][1], counts[memid][0], xyz)
+                # as upsert_block, an existing voxel is removed and re-added, even
+                # when it already belongs to memid
+                if xyz in voxels:
+                    remove(xyz)
+                columns[(xyz[0], xyz[2])] += 1
+                voxels[xyz] = [memid, idm[0], idm[1], now, player_placed, agent_placed]
+                dirty.add(xyz)
+
+            for xyz, idm, i, p, a in zip(xyzs, idms, interesting, player_placed, agent_placed):
+                # blocks that have been destroyed
+                old = voxels.get(xyz)
+                if old and (old[1] == 0) != (idm[0] == 0):
+                    remove(xyz)
+                    if columns[(xyz[0], xyz[2])] == 0:
+                        map_changes.append({"pos": xyz, "is_delete": True})
+                    areas_to_perceive.append((xyz, 3))
+
+                if not i:
+                    continue
+                # objects made of air only join air, and blocks only join blocks
+                adjacent_memids = list(
+                    {
+                        voxels[n][0]
+                        for n in diag_adjacent(xyz)
+                        if n in voxels and (voxels[n][1] == 0) == (idm[0] == 0)
+                    }
+                )
+                if len(adjacent_memids) == 0:
+                    # new block object, unless one is already here (as BlockObjectNode.create)
+                    if xyz in voxels:
+                        memid = voxels[xyz][0]
+                    else:
+                        memid = BlockObjectNode.new(self)
+                        self.db_write(
+                            "INSERT INTO ReferenceObjects (uuid, x, y, z, ref_type, voxel_count) VALUES ( ?, ?, ?, ?, ?, ?)",
+                            memid,
+                            0,
+                            0,
+                            0,
+                            "BlockObjects",
+                            0,
+                        )
+                        counts[memid] = [0, (0, 0, 0)]
+                        upsert(xyz, idm, memid, False, False)
+                        for tag in BlockObjectNode.TAGS:
+                            self.tag(memid, tag)
+                        created.append(memid)
+                    map_changes.append({"pos": xyz, "is_obstacle": True, "memid": memid})
+                elif len(adjacent_memids) == 1:
+                    memid = adjacent_memids[0]
+                    upsert(xyz, idm, memid, p, a)
+                    map_changes.append({"pos": xyz, "is_obstacle": True, "memid": memid})
+                    attended.append(memid)
+                else:
+                    chosen_memid = adjacent_memids[0]
+                    attended.append(chosen_memid)
+                    merges.append((chosen_memid, adjacent_memids))
+                    merged = set(adjacent_memids)
+                    for v in voxels.values():
+                        if v[0] in merged:
+                            v[0] = chosen_memid
+                    upsert(xyz, idm, chosen_memid, p, a)
+
+            # merges move the tags and the voxels outside the index too
+            for chosen_memid, adjacent_memids in merges:
+                where = " OR ".join(["subj=?"] * len(adjacent_memids))
+                self.db_write(
+                    "UPDATE Triples SET subj=? WHERE " + where, chosen_memid, *adjacent_memids
+                )
+                where = " OR ".join(["uuid=?"] * len(adjacent_memids))
+                cmd = "UPDATE VoxelObjects SET uuid=? WHERE "
+                self.db_write(cmd + where, chosen_memid, *adjacent_memids)
+
+            self.db_write_many(
+                "UPDATE ReferenceObjects SET voxel_count=?, x=?, y=?, z=? WHERE uuid=?",
+                [(counts[memid][0], *counts[memid][1], memid) for memid in touched],
+            )
+            # new rows first and removed rows last, so that an object keeping some of
+            # its voxels never has none in between and gets deleted by the db
+            stored = {
+                (x, y, z)
+                for x, y, z in self._db_read(
+                    "SELECT x, y, z FROM VoxelObjects WHERE ref_type=? AND x BETWEEN ? AND ? AND z BETWEEN ? AND ?",
+                    "BlockObjects",
+                    *xz_bounds
+                )
+            }
+            self.db_write_many(
+                "INSERT INTO VoxelObjects (uuid, bid, meta, updated, player_placed, agent_placed, ref_type, x, y, z) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (*voxels[xyz], "BlockObjects", *xyz)
+                    for xyz in dirty
+                    if xyz in voxels and xyz not in stored
+                ],
+            )
+            self.db_write_many(
+                "UPDATE VoxelObjects SET uuid=?, bid=?, meta=?, updated=?, player_placed=?, agent_placed=? WHERE ref_type=? AND x=? AND y=? AND z=?",
+                [
+                    (*voxels[xyz], "BlockObjects", *xyz)
+                    for xyz in dirty
+                    if xyz in voxels and xyz in stored
+                ],
+            )
+            self.db_write_many(
+                "DELETE FROM VoxelObjects WHERE x=? AND y=? AND z=? and ref_type=?",
+                [(*xyz, "BlockObjects") for xyz in dirty if xyz not in voxels and xyz in stored],
+            )
+            # objects created above whose voxels were removed or merged away
+            self.db_write_many(
+                "DELETE FROM Memories WHERE uuid=? AND NOT EXISTS (SELECT 1 FROM VoxelObjects WHERE uuid=?)",
+                [(memid, memid) for memid in created],
+            )
+            self.db_write_many(
+                "UPDATE Memories SET updated_time=?, attended_time=? WHERE uuid=?",
+                [(now, now, memid) for memid in attended],
+            )
+        if map_changes:
+            self.place_field.update_map(map_changes)
+        return areas_to_perceive
+
     def maybe_add_block_to_memory(self, interesting, player_placed, agent_placed, xyz, idm):
         if not interesting:
             return
@@ -448,21 +646,26 @@ class MCAgentMemory(AgentMemory):
         # TODO warn/error if no such memory?
         assert count != 0
         if old_loc:
-            b = 1 / count
-            if count > 0:
-                a = (count - 1) / count
-            else:
-                a = (1 - count) / (-count)
-            new_loc = (
-                old_loc[0] * a + loc[0] * b,
-                old_loc[1] * a + loc[1] * b,
-                old_loc[2] * a + loc[2] * b,
-            )
+            new_loc = self._voxel_mean(old_loc, count, loc)
             self.db_write(
                 "UPDATE ReferenceObjects SET x=?, y=?, z=? WHERE uuid=?", *new_loc, memid
             )
             return new_loc
 
+    @staticmethod
+    def _voxel_mean(old_loc, count, loc):
+        """the mean location after the change described in _update_voxel_mean"""
+        b = 1 / count
+        if count > 0:
+            a = (count - 1) / count
+        else:
+            a = (1 - count) / (-count)
+        return (
+            old_loc[0] * a + loc[0] * b,
+            old_loc[1] * a + loc[1] * b,
+            old_loc[2] * a + loc[2] * b,
+        )
+
     def remove_voxel(self, x, y, z, ref_type):
         """Remove a voxel at (x, y, z) and of a given ref_type,
         and update the voxel count and mean as a result of the change"""
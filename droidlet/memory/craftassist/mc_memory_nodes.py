@@ -73,6 +73,17 @@ class VoxelObjectNode(ReferenceObjectNode):
     def get_pos(self) -> XYZ:
         return cast(XYZ, tuple(int(x) for x in np.mean(self.locs, axis=0)))
 
+    @classmethod
+    def get_positions(cls, agent_memory, memids: List[str]) -> np.ndarray:
+        """the mean of the voxels' locations, truncated to ints as in get_pos()"""
+        return np.trunc(
+            cls._read_positions(
+                agent_memory,
+                "SELECT uuid, AVG(x), AVG(y), AVG(z) FROM VoxelObjects WHERE uuid IN ({}) GROUP BY uuid",
+                memids,
+            )
+        )
+
     def get_point_at_target(self) -> POINT_AT_TARGET:
         point_min = [int(x) for x in np.min(self.locs, axis=0)]
         point_max = [int(x) for x in np.max(self.locs, axis=0)]
@@ -142,6 +153,8 @@ class BlockObjectNode(VoxelObjectNode):
     ]
     TABLE = "ReferenceObjects"
     NODE_TYPE = "BlockObject"
+    # "_not_location" is a hack until memory_filters does "not"
+    TAGS = ["_block_object", "_VOXEL_OBJECT", "_physical_object", "_destructible", "_not_location"]
 
     @classmethod
     def create(cls, memory, blocks: Sequence[Block]) -> str:
@@ -166,12 +179,8 @@ class BlockObjectNode(VoxelObjectNode):
         memory.db_write(cmd, memid, 0, 0, 0, "BlockObjects", 0)
         for block in blocks:
             memory.upsert_block(block, memid, "BlockObjects")
-        memory.tag(memid, "_block_object")
-        memory.tag(memid, "_VOXEL_OBJECT")
-        memory.tag(memid, "_physical_object")
-        memory.tag(memid, "_destructible")
-        # this is a hack until memory_filters does "not"
-        memory.tag(memid, "_not_location")
+        for tag in cls.TAGS:
+            memory.tag(memid, tag)
         logging.debug(
             "Added block object {} with {} blocks, {}".format(
                 memid, len(blocks), Counter([idm for _, idm in blocks])
@@ -138,6 +138,13 @@ class SwarmWorkerMemory:
     def db_write(self, query: str, *args) -> int:
         return self._db_command("db_write", query, *args)
 
+    def db_write_many(self, query: str, args_list) -> int:
+        return self._db_command("db_write_many", query, args_list)
+
+    def notify_task_update(self, memid: str = None, task=None):
+        # the worker's tasks are not scheduled from a cache of the Tasks table
+        pass
+
     def _db_read(self, query: str, *args) -> List[Tuple]:
         return self._db_command("_db_read", query, *args)
 
@@ -182,6 +189,12 @@ class SwarmWorkerMemory:
     def get_mem_by_id(self, memid: str, node_type: str = None):
         return self._db_command("get_mem_by_id", memid, node_type)
 
+    def get_node_types_from_memids(self, memids):
+        return self._db_command("get_node_types_from_memids", memids)
+
+    def get_table_columns(self, table: str) -> List[str]:
+        return self._db_command("get_table_columns", table)
+
     def basic_search(self, query):
         return self._db_command("basic_search", query)
 
@@ -87,6 +87,25 @@ class BasicTest(unittest.TestCase):
         assert self.memory.get_instseg_object_ids_by_xyz((2, 0, 34))[0][0] == inst_seg_memid
         assert self.memory.get_instseg_object_ids_by_xyz((3, 0, 34))[0][0] == inst_seg_memid
 
+    def test_update_blocks(self):
+        self.memory = MCAgentMemory()
+        InstSegNode.create(self.memory, [(0, 0, 0), (1, 0, 0)], ["shiny"])
+        # two separate objects, then a block bridging them
+        xyzs = [(0, 0, 0), (1, 0, 0), (3, 0, 0), (2, 0, 0)]
+        idms = [(1, 0)] * 4
+        self.memory.update_blocks(xyzs, idms, [True] * 4, [False] * 4, [False] * 4)
+        assert len(self.memory.get_instseg_object_ids_by_xyz((0, 0, 0))) == 0
+        memid = self.memory.get_block_object_ids_by_xyz((0, 0, 0))[0]
+        assert len(self.memory.get_mem_by_id(memid).blocks) == 4
+        assert self.memory.get_block_object_ids_by_xyz((3, 0, 0))[0] == memid
+        assert len(self.memory.get_triples(subj=memid, obj_text="_block_object")) > 0
+
+        # destroy a block: it leaves the object and its area is returned for perception
+        areas = self.memory.update_blocks([(3, 0, 0)], [(0, 0)], [False], [False], [False])
+        assert areas == [((3, 0, 0), 3)]
+        assert len(self.memory.get_mem_by_id(memid).blocks) == 3
+        assert self.memory.get_block_object_ids_by_xyz((3, 0, 0)) == []
+
     def test_schematic_apis(self):
         self.memory = MCAgentMemory()
         schematic_memid = SchematicNode.create(
@@ -2,13 +2,13 @@
 Copyright (c) Facebook, Inc. and its affiliates.
 """
 import numpy as np
-from .memory_filters import get_property_value, Attribute
+from .memory_filters import get_property_values, get_positions, Attribute
 
 
 class TableColumn(Attribute):
     """
     for each input memory, the call returns a column value or a triple obj_text via
-    get_property_value
+    get_property_values
 
     Args:
          memory (droidlet memory):  the memory that will be queried
@@ -24,10 +24,7 @@ class TableColumn(Attribute):
         self.get_all = get_all
 
     def __call__(self, mems):
-        return [
-            get_property_value(self.memory, mem, self.attribute, get_all=self.get_all)
-            for mem in mems
-        ]
+        return get_property_values(self.memory, mems, self.attribute, get_all=self.get_all)
 
     def __repr__(self):
         return "Attribute: " + self.attribute
@@ -213,7 +210,8 @@ class LinearExtentAttribute(Attribute):
             raise Exception("Bad linear attribute data, no memory and no searcher specified")
 
     def extent(self, source, destination):
-        # source and destination are arrays in this function
+        # source and destination are arrays in this function; either can also be
+        # an (N, 3) array of positions, in which case N extents are returned
         # arrow goes from source to destination:
         diff = np.subtract(destination, source)
         if self.location_data["relative_direction"] in ["INSIDE", "OUTSIDE"]:
@@ -236,11 +234,11 @@ class LinearExtentAttribute(Attribute):
             if self.normalized:
                 return diff @ dir_vec
             else:
-                return diff @ dir_vec / np.linalg.norm(diff)
+                return diff @ dir_vec / np.linalg.norm(diff, axis=-1)
         else:  # AWAY
-            return np.linalg.norm(diff)
+            return np.linalg.norm(diff, axis=-1)
 
-    def __call__(self, mems):
+    def get_fixed_pos(self):
         if not self.mem:
             fixed_mem, _ = self.searcher()
             fixed_mem = self.memory.get_mem_by_id(fixed_mem[0])
@@ -248,13 +246,25 @@ class LinearExtentAttribute(Attribute):
             # FIXME!!! handle mem not found, more than one, etc.
         else:
             fixed_mem = self.mem
-        fixed_pos = fixed_mem.get_pos()
+        return fixed_mem.get_pos()
+
+    def __call__(self, mems):
+        fixed_pos = self.get_fixed_pos()
         # FIXME TODO store and use an arxiv if we don't want position to track!
         if self.fixed_role == "source":
             return [self.extent(fixed_pos, mem.get_pos()) for mem in mems]
         else:
             return [self.extent(mem.get_pos(), fixed_pos) for mem in mems]
 
+    def from_memids(self, memids):
+        """the extents for all memids at once, from their positions read in bulk"""
+        positions = get_positions(self.memory, memids)
+        fixed_pos = np.array(self.get_fixed_pos(), dtype=float)
+        if self.fixed_role == "source":
+            return self.extent(fixed_pos, positions)
+        else:
+            return self.extent(positions, fixed_pos)
+
     def __repr__(self):
         return "Attribute: " + str(self.location_data)
 
@@ -281,7 +291,7 @@ class LookRayDistance(Attribute):
         # TODO: currently stores look vecs/orientations at creation,
         try:
             x, y, z, yaw, pitch = memory._db_read(
-                "SELECT x, y, z yaw, pitch FROM ReferenceObjects WHERE eid=?", eid
+                "SELECT x, y, z, yaw, pitch FROM ReferenceObjects WHERE eid=?", eid
             )[0]
         except:
             # TODO handle this better
@@ -294,25 +304,29 @@ class LookRayDistance(Attribute):
         self.coordinate_transforms = memory.coordinate_transforms
         self.mode = mode
 
+    def distances(self, positions):
+        """positions is an (N, 3) array, returns an array of N distances from the ray"""
+        # transform rotates column vectors
+        rotated_coords = self.coordinate_transforms.transform(
+            (positions - self.pos).T, self.yaw, self.pitch
+        ).T
+        LEFT = self.coordinate_transforms.DIRECTIONS["LEFT"]
+        UP = self.coordinate_transforms.DIRECTIONS["UP"]
+        d = ((rotated_coords @ LEFT) ** 2 + (rotated_coords @ UP) ** 2) ** 0.5
+        if self.mode == "raw":
+            return d
+        else:
+            return d / np.linalg.norm(rotated_coords, axis=1)
+
     def __call__(self, mems):
         try:
             positions = [mem.get_pos() for mem in mems]
         except:
             raise Exception("a memory input to LookRayDistance does not .get_pos() properly")
+        return list(self.distances(np.array(positions, dtype=float).reshape(-1, 3)))
 
-        rotated_coords = [
-            self.coordinate_transforms.transform(np.array(p) - self.pos, self.yaw, self.pitch)
-            for p in positions
-        ]
-        LEFT = self.coordinate_transforms.DIRECTIONS["LEFT"]
-        UP = self.coordinate_transforms.DIRECTIONS["UP"]
-        if self.mode == "raw":
-            return [((c @ LEFT) ** 2 + (c @ UP) ** 2) ** 0.5 for c in rotated_coords]
-        else:
-            return [
-                (((c @ LEFT) ** 2 + (c @ UP) ** 2) ** 0.5) / np.linalg.norm(c)
-                for c in rotated_coords
-            ]
+    def from_memids(self, memids):
+        return self.distances(get_positions(self.memory, memids))
 
     def __repr__(self):
         return "LookRayDistance"
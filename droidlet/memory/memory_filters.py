@@ -2,8 +2,12 @@
 Copyright (c) Facebook, Inc. and its affiliates.
 """
 from typing import List
+import operator
+import numpy as np
 import torch
 from droidlet.memory.filters_conversions import get_inequality_symbol, sqly_to_new_filters
+from droidlet.memory.memory_nodes import MemoryNode
+from droidlet.memory.memory_util import chunks, MAX_SQL_VARIABLES
 
 ####################################################################################
 ### This file is split between the basic memory searcher, and memory filters objects
@@ -13,6 +17,9 @@ from droidlet.memory.filters_conversions import get_inequality_symbol, sqly_to_n
 ####################################################################################
 
 # attribute has function signature list(mems) --> list(value)
+# an attribute that can be computed directly from memids (e.g. from columns read in a
+# single query) may also define from_memids(memids) --> np.ndarray of values (nan where
+# undefined); search_by_attribute and ApplyAttribute then use it instead of building nodes
 class Attribute:
     def __init__(self, memory):
         self.memory = memory
@@ -21,6 +28,36 @@ class Attribute:
         raise NotImplementedError("Implemented by subclass")
 
 
+def apply_attribute(agent_memory, attribute, memids):
+    """
+    returns the values of attribute for memids; via attribute.from_memids if
+    the attribute has it, otherwise by calling it on the MemoryNodes
+    """
+    from_memids = getattr(attribute, "from_memids", None)
+    if from_memids is not None:
+        return from_memids(memids)
+    return attribute([agent_memory.get_mem_by_id(m) for m in memids])
+
+
+def get_positions(agent_memory, memids):
+    """
+    returns a (len(memids), 3) float array of the positions of the ReferenceObjects
+    with the given memids, read in bulk (one query per node type).
+    rows of memids that are not ReferenceObjects (or not found) are nan
+    """
+    out = np.full((len(memids), 3), np.nan)
+    node_types = agent_memory.get_node_types_from_memids(memids)
+    idxs_by_type = {}
+    for i, m in enumerate(memids):
+        idxs_by_type.setdefault(node_types.get(m), []).append(i)
+    for node_type, idxs in idxs_by_type.items():
+        node = agent_memory.nodes.get(node_type)
+        if node is None or not hasattr(node, "get_positions"):
+            continue
+        out[idxs] = node.get_positions(agent_memory, [memids[i] for i in idxs])
+    return out
+
+
 def check_well_formed_triple(clause):
     # TODO search by pred?
     assert any(
@@ -36,7 +73,7 @@ def check_well_formed_triple(clause):
 
 def check_value_comparison_match(value, comparison_symbol):
     try:
-        if comparison_symbol != "%" or comparison_symbol != "<>":
+        if comparison_symbol not in ["%", "<>"]:
             assert len(value) == 1
         else:
             assert len(value) == 2
@@ -50,7 +87,7 @@ def check_value_comparison_match(value, comparison_symbol):
 
 def get_all_memids_of_node_type(agent_memory, memtype, allow_archives=False):
     # FIXME memtype might be a union of node types
-    memtypes = agent_memory.node_children[memtype]
+    memtypes = list(agent_memory.node_children[memtype])
     node_type_clause = "(" + (" OR node_type=? " * len(memtypes))[3:-1] + ")"
     cmd = "SELECT uuid FROM Memories WHERE " + node_type_clause
     # FIXME deal with this better with node types:
@@ -61,14 +98,19 @@ def get_all_memids_of_node_type(agent_memory, memtype, allow_archives=False):
     return [m[0] for m in all_memids]
 
 
-# TODO do this faster?
 def filter_memids_by_nodetype(agent_memory, memids, nodetype):
     """
     filters the list memids by corresponding MemoryNode's nodetype;
     outputs a (sub) list of memids
     """
     node_children = agent_memory.node_children[nodetype]
-    return [m for m in memids if agent_memory.get_node_from_memid(m) in node_children]
+    ok_memids = set()
+    for c in chunks(list(set(memids)), MAX_SQL_VARIABLES - len(node_children)):
+        cmd = "SELECT uuid FROM Memories WHERE uuid IN ({}) AND node_type IN ({})".format(
+            ",".join(["?"] * len(c)), ",".join(["?"] * len(node_children))
+        )
+        ok_memids.update(m for (m,) in agent_memory._db_read(cmd, *c, *node_children))
+    return [m for m in memids if m in ok_memids]
 
 
 # FIXME! refactor get_property_value, search_by_property, search_by_attribute
@@ -95,15 +137,13 @@ def get_property_value(agent_memory, mem, prop, get_all=False):
         mem = agent_memory.get_mem_by_id(mem)
 
     # is it in the main memory table?
-    cols = [c[1] for c in agent_memory._db_read("PRAGMA table_info(Memories)")]
-    if prop in cols:
+    if prop in agent_memory.get_table_columns("Memories"):
         cmd = "SELECT " + prop + " FROM Memories WHERE uuid=?"
         r = agent_memory._db_read(cmd, mem.memid)
         return r[0][0]
     # is it in the mem.TABLE?
     T = mem.TABLE
-    cols = [c[1] for c in agent_memory._db_read("PRAGMA table_info({})".format(T))]
-    if prop in cols:
+    if prop in agent_memory.get_table_columns(T):
         cmd = "SELECT " + prop + " FROM " + T + " WHERE uuid=?"
         r = agent_memory._db_read(cmd, mem.memid)
         return r[0][0]
@@ -118,6 +158,69 @@ def get_property_value(agent_memory, mem, prop, get_all=False):
     return None
 
 
+def get_property_values(agent_memory, mems, prop, get_all=False):
+    """
+    Batched get_property_value: gets the property value for each memory in mems,
+    with one query per table (instead of several queries per memory).
+
+    Args:
+        agent_memory: an AgentMemory object
+        mems: a list of MemoryNode objects or memids (str)
+        prop: a string with the name of the property
+        get_all: if the property is a triple, return the list of all obj_texts
+            instead of the first one
+
+    returns a list with the value for each entry of mems, None if not found.
+    same order of precedence as get_property_value
+    """
+    memids = [m if type(m) is str else m.memid for m in mems]
+    values = {}
+    if prop in agent_memory.get_table_columns("Memories"):
+        values = read_column_by_memids(agent_memory, "Memories", prop, memids)
+        return [values.get(m) for m in memids]
+
+    # group the memids by the table of their node:
+    node_types = agent_memory.get_node_types_from_memids([m for m in mems if type(m) is str])
+    table_memids = {}
+    for mem, memid in zip(mems, memids):
+        if type(mem) is str:
+            node = agent_memory.nodes.get(node_types.get(memid), MemoryNode)
+        else:
+            node = mem
+        table_memids.setdefault(getattr(node, "TABLE", None), set()).add(memid)
+    triple_memids = []
+    for T, tmemids in table_memids.items():
+        if T is not None and prop in agent_memory.get_table_columns(T):
+            values.update(read_column_by_memids(agent_memory, T, prop, list(tmemids)))
+        else:
+            triple_memids.extend(tmemids)
+
+    # the rest might be triples:
+    obj_texts = {}
+    for c in chunks(triple_memids):
+        cmd = (
+            "SELECT Triples.subj, Triples.obj_text FROM Triples INNER JOIN Memories as M "
+            "ON Triples.subj=M.uuid WHERE M.is_snapshot=0 AND Triples.pred_text=? "
+            "AND Triples.subj IN ({})".format(",".join(["?"] * len(c)))
+        )
+        for subj, obj_text in agent_memory._db_read(cmd, prop, *c):
+            obj_texts.setdefault(subj, []).append(obj_text)
+    for subj, texts in obj_texts.items():
+        values[subj] = texts if get_all else texts[0]
+    return [values.get(m) for m in memids]
+
+
+def read_column_by_memids(agent_memory, table, column, memids):
+    """returns a dict from memid to the value of column in table, for memids in table"""
+    values = {}
+    for c in chunks(list(set(memids))):
+        cmd = "SELECT uuid, {} FROM {} WHERE uuid IN ({})".format(
+            column, table, ",".join(["?"] * len(c))
+        )
+        values.update(agent_memory._db_read(cmd, *c))
+    return values
+
+
 def search_by_property(agent_memory, prop, value, comparison_symbol, memtype):
     """
     Tries to find memories with a property value
@@ -152,16 +255,14 @@ def search_by_property(agent_memory, prop, value, comparison_symbol, memtype):
         v = value
 
     # is it in the main memory table?
-    cols = [c[1] for c in agent_memory._db_read("PRAGMA table_info(Memories)")]
-    if prop in cols:
+    if prop in agent_memory.get_table_columns("Memories"):
         cmd = "SELECT uuid FROM Memories " + where
         memids = [m[0] for m in agent_memory._db_read(cmd, *v)]
         return filter_memids_by_nodetype(agent_memory, memids, memtype)
 
     # is it in the node table?
     T = agent_memory.nodes[memtype].TABLE
-    cols = [c[1] for c in agent_memory._db_read("PRAGMA table_info({})".format(T))]
-    if prop in cols:
+    if prop in agent_memory.get_table_columns(T):
         cmd = "SELECT uuid FROM " + T + " " + where
         memids = [m[0] for m in agent_memory._db_read(cmd, *v)]
         return filter_memids_by_nodetype(agent_memory, memids, memtype)
@@ -205,7 +306,12 @@ def search_by_attribute(agent_memory, attribute, value, comparison_symbol, memty
     """
     check_value_comparison_match(value, comparison_symbol)
     memids = get_all_memids_of_node_type(agent_memory, memtype)
-    values = attribute([agent_memory.get_mem_by_id(m) for m in memids])
+    values = apply_attribute(agent_memory, attribute, memids)
+    if isinstance(values, np.ndarray) and values.dtype.kind in "biuf":
+        mask = compare_values(values, value, comparison_symbol)
+        filtered_memids = [memids[i] for i in np.flatnonzero(mask)]
+        return filter_memids_by_nodetype(agent_memory, filtered_memids, memtype)
+
     pairs = zip(memids, values)
 
     v = value
@@ -214,18 +320,36 @@ def search_by_attribute(agent_memory, attribute, value, comparison_symbol, memty
     elif comparison_symbol == "<>":
         filtered_memids = [p[0] for p in pairs if (p[1] and value[0] <= p[1] and p[1] <= value[1])]
     else:
-        s = {
-            "=": lambda x, y: x == y,
-            "<": lambda x, y: x < y,
-            "<=": lambda x, y: x <= y,
-            ">": lambda x, y: x > y,
-            ">=": lambda x, y: x >= y,
-        }
-        filtered_memids = [p[0] for p in pairs if (p[1] and s[comparison_symbol](p[1], value[0]))]
+        f = COMPARISON_OPS[comparison_symbol]
+        filtered_memids = [p[0] for p in pairs if (p[1] and f(p[1], value[0]))]
 
     return filter_memids_by_nodetype(agent_memory, filtered_memids, memtype)
 
 
+COMPARISON_OPS = {
+    "=": operator.eq,
+    "<": operator.lt,
+    "<=": operator.le,
+    ">": operator.gt,
+    ">=": operator.ge,
+}
+
+
+def compare_values(values, value, comparison_symbol):
+    """
+    the array version of the comparisons in search_by_attribute: returns a boolean
+    mask over the numeric array values.  as there, 0 values never match, and neither
+    do nan (undefined) values.
+    """
+    mask = (values != 0) & ~np.isnan(values)
+    if comparison_symbol == "%":
+        return mask & (np.mod(values, value[0]) == value[1])
+    elif comparison_symbol == "<>":
+        return mask & (value[0] <= values) & (values <= value[1])
+    else:
+        return mask & COMPARISON_OPS[comparison_symbol](values, value[0])
+
+
 def try_float(value, where_clause):
     try:
         return float(value)
@@ -237,8 +361,17 @@ def argval_subsample_idx(values, n, polarity="MAX"):
     """values is a list, n an int, polarity is MAX or MIN"""
     assert n > 0
     descending = {"MAX": True, "MIN": False}[polarity]
-    _, idxs = torch.sort(torch.Tensor(values), descending=descending)
-    return idxs.tolist()[:n]
+    # None values become nan, and are sorted last for either polarity
+    keys = np.asarray(values, dtype=float)
+    if descending:
+        keys = -keys
+    if n < len(keys):
+        # only the n best need to be sorted
+        idxs = np.argpartition(keys, n - 1)[:n]
+        idxs = idxs[np.argsort(keys[idxs], kind="stable")]
+    else:
+        idxs = np.argsort(keys, kind="stable")
+    return idxs.tolist()
 
 
 def random_subsample_idx(num_mems, n, same="DISALLOWED"):
@@ -371,8 +504,7 @@ class MemorySearcher:
             memids = [t[0] for t in triples]
 
         # TODO move checking if it is proper node type to main body or to a "handle_from"
-        node_children = agent_memory.node_children[memtype]
-        return [m for m in memids if agent_memory.get_node_from_memid(m) in node_children]
+        return filter_memids_by_nodetype(agent_memory, memids, memtype)
 
     def handle_where(self, agent_memory, where_clause, memtype):
         """
@@ -437,7 +569,7 @@ class MemorySearcher:
                             attribute_name
                         )
                     )
-                vals = [get_property_value(agent_memory, m, attribute_name) for m in memids]
+                vals = get_property_values(agent_memory, memids, attribute_name)
                 idxs = argval_subsample_idx(
                     vals, ordinal, polarity=return_q["argval"].get("polarity", "MAX")
                 )
@@ -462,17 +594,22 @@ class MemorySearcher:
                     attribute_name_list = [a["attribute"] for a in output]
                 except:
                     raise Exception("malformed output clause: {}".format(query))
+            for aname in attribute_name_list:
+                if type(aname) is not str:
+                    raise Exception(
+                        "output attribute in basic search should be (list of) simple properties, instead got: {}".format(
+                            attribute_name_list
+                        )
+                    )
+            # one batched fetch per attribute
+            all_prop_vals = [
+                get_property_values(agent_memory, memids, aname, get_all)
+                for aname in attribute_name_list
+            ]
             values_dict = {m: [] for m in memids}
-            for m in memids:
+            for i, m in enumerate(memids):
                 attributes = []
-                for aname in attribute_name_list:
-                    if type(aname) is not str:
-                        raise Exception(
-                            "output attribute in basic search should be (list of) simple properties, instead got: {}".format(
-                                attribute_name_list
-                            )
-                        )
-                    prop_vals = get_property_value(agent_memory, m, aname, get_all)
+                for prop_vals in [pv[i] for pv in all_prop_vals]:
                     if type(prop_vals) is list:
                         for prop_val in prop_vals:
                             attributes.append(prop_val)
@@ -493,10 +630,19 @@ class MemorySearcher:
         query = query or self.query
         if not query:
             return [], []
-        query = self.maybe_convert_query(query)
+        compiled = None
+        compiler = getattr(agent_memory, "query_compiler", None)
+        if compiler is not None:
+            # if possible, the where clause is run as a single (cached) sql statement
+            query, compiled = compiler.prepare(agent_memory, query, default_memtype)
+        else:
+            query = self.maybe_convert_query(query)
         # TODO/FIXME memtype ALL
         memtype = query.get("memory_type", default_memtype)
-        if query.get("where_clause"):
+        if compiled is not None:
+            plan, params = compiled
+            memids = plan.run(agent_memory, params)
+        elif query.get("where_clause"):
             memids = self.handle_where(agent_memory, query["where_clause"], memtype)
         else:
             node_types = agent_memory.node_children.get(memtype, [])
@@ -657,10 +803,10 @@ class ApplyAttribute(MemoryFilter):
 
     def search(self):
         all_memids = self.all_table_memids()
-        return all_memids, self.attribute([self.memory.get_mem_by_id(m) for m in all_memids])
+        return all_memids, list(apply_attribute(self.memory, self.attribute, all_memids))
 
     def filter(self, memids, vals):
-        return memids, self.attribute([self.memory.get_mem_by_id(m) for m in memids])
+        return memids, list(apply_attribute(self.memory, self.attribute, memids))
 
     def _selfstr(self):
         return "Apply " + str(self.attribute)
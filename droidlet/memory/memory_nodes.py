@@ -3,8 +3,10 @@ Copyright (c) Facebook, Inc. and its affiliates.
 """
 import uuid
 import json
+import numpy as np
 from typing import Optional, List, Dict, cast
 from droidlet.base_util import XYZ, POINT_AT_TARGET, to_player_struct
+from droidlet.memory.memory_util import chunks
 
 
 class MemoryNode:
@@ -444,6 +446,38 @@ class ReferenceObjectNode(MemoryNode):
     def get_pos(self) -> XYZ:
         raise NotImplementedError("must be implemented in subclass")
 
+    @classmethod
+    def get_positions(cls, agent_memory, memids: List[str]) -> np.ndarray:
+        """Reads the positions of many nodes of this type at once, without building
+        the nodes.  By default these are the x, y, z columns of the ReferenceObjects
+        table; subclasses whose get_pos() computes the position some other way
+        should override this.
+
+        Returns:
+            np.ndarray: (len(memids), 3) float array, row i is the position of memids[i],
+                nan if the memid was not found
+
+        Examples::
+            >>> PlayerNode.get_positions(agent_memory, [memid_1, memid_2])
+        """
+        return cls._read_positions(
+            agent_memory, "SELECT uuid, x, y, z FROM ReferenceObjects WHERE uuid IN ({})", memids
+        )
+
+    @staticmethod
+    def _read_positions(agent_memory, query, memids):
+        # query returns rows of (uuid, x, y, z), and has one "{}" for the "?,?,..." placeholders
+        rows = {}
+        for chunk in chunks(memids):
+            r = agent_memory._db_read(query.format(",".join(["?"] * len(chunk))), *chunk)
+            rows.update((m, (x, y, z)) for m, x, y, z in r)
+        out = np.full((len(memids), 3), np.nan)
+        for i, m in enumerate(memids):
+            pos = rows.get(m)
+            if pos is not None:
+                out[i] = pos
+        return out
+
     def get_point_at_target(self) -> POINT_AT_TARGET:
         raise NotImplementedError("must be implemented in subclass")
 
@@ -937,6 +971,7 @@ class TaskNode(MemoryNode):
             run_count,
             memory.get_time(),
         )
+        memory.notify_task_update(memid, task)
         return memid
 
     def step(self, agent):
@@ -951,6 +986,7 @@ class TaskNode(MemoryNode):
             self.memory.safe_pickle(task),
             self.memid,
         )
+        self.memory.notify_task_update(self.memid, task)
 
     def update_condition(self, conditions):
         """
@@ -1010,6 +1046,7 @@ class TaskNode(MemoryNode):
             if (status.get(k) is not None) or (force_db_update and status_out[k]):
                 cmd = "UPDATE Tasks SET " + k + "=? WHERE uuid=?"
                 self.agent_memory.db_write(cmd, status_out[k], self.memid)
+        self.agent_memory.notify_task_update(self.memid)
         return status_out
 
     # FIXME! or torch me
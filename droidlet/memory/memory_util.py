@@ -2,6 +2,15 @@
 Copyright (c) Facebook, Inc. and its affiliates.
 """
 
+# keep "IN (?,?,...)" queries below SQLITE_MAX_VARIABLE_NUMBER (999 in older sqlite builds)
+MAX_SQL_VARIABLES = 900
+
+
+def chunks(l, n=MAX_SQL_VARIABLES):
+    """Yield successive slices of the list l of length at most n"""
+    for i in range(0, len(l), n):
+        yield l[i : i + n]
+
 
 def parse_sql(query):
     query = query.split()
@@ -2,17 +2,165 @@
 Copyright (c) Facebook, Inc. and its affiliates.
 """
 
+import math
 import numpy as np
 
-MAX_MAP_SIZE = 8193
-MAP_INIT_SIZE = 1025
-BIG_I = MAX_MAP_SIZE
-BIG_J = MAX_MAP_SIZE
+# side length (in cells) of the square tiles the map is stored in
+TILE_SIZE = 64
+# fill values of the layers of a newly allocated tile
+LAYERS = {
+    "map": (np.uint8, 0),
+    "updated": (np.int32, -1),
+    "memids": (np.int32, 0),
+}
 
 
-def no_y_l1(self, xyz, k):
+# examined points closer than this (in no_y_l1) to a candidate are the same region
+EXAMINED_RADIUS = 1.5
+
+
+def no_y_l1(xyz, k):
     """returns the l1 distance between two standard coordinates"""
-    return np.linalg.norm(np.asarray([xyz[0], xyz[2]]) - np.asarray([k[0], k[2]]), ord=1)
+    return abs(xyz[0] - k[0]) + abs(xyz[2] - k[2])
+
+
+class GridIndex:
+    """
+    a uniform hash grid over the x, z coordinates of a set of points, for radius and
+    nearest-neighbor queries in no_y_l1 distance.  points are added incrementally;
+    a query only looks at the cells that can hold points within its radius, so its cost
+    does not grow with the number of points (as long as they are spread out).
+
+    Args:
+        cell_size (float): side length of the grid cells, best about the query radius
+    """
+
+    def __init__(self, cell_size=EXAMINED_RADIUS):
+        self.cell_size = cell_size
+        self.cells = {}
+        # point -> insertion order, to break ties as a scan in insertion order would
+        self.order = {}
+
+    def cell(self, xyz):
+        return (math.floor(xyz[0] / self.cell_size), math.floor(xyz[2] / self.cell_size))
+
+    def add(self, xyz):
+        if xyz in self.order:
+            return
+        self.order[xyz] = len(self.order)
+        self.cells.setdefault(self.cell(xyz), []).append(xyz)
+
+    def within(self, xyz, radius):
+        """returns a list of (distance, point) for the points closer than radius to xyz"""
+        ci, cj = self.cell(xyz)
+        r = math.ceil(radius / self.cell_size)
+        out = []
+        for a in range(ci - r, ci + r + 1):
+            for b in range(cj - r, cj + r + 1):
+                for p in self.cells.get((a, b), ()):
+                    d = no_y_l1(p, xyz)
+                    if d < radius:
+                        out.append((d, p))
+        return out
+
+    def nearest(self, xyz, radius):
+        """returns the closest point to xyz closer than radius, or None"""
+        best = None
+        for d, p in self.within(xyz, radius):
+            if best is None or (d, self.order[p]) < (best[0], self.order[best[1]]):
+                best = (d, p)
+        return best[1] if best is not None else None
+
+    def __len__(self):
+        return len(self.order)
+
+
+class TiledMap:
+    """
+    a horizontal slice of a PlaceField: an unbounded 2d grid stored as fixed-size square
+    tiles, allocated only when a cell in them is written.  each tile is a dict with an
+    array for each of the LAYERS; cells in unallocated tiles read as the fill values.
+
+    Args:
+        tile_size (int): side length of the tiles in cells
+    """
+
+    def __init__(self, tile_size=TILE_SIZE):
+        self.tile_size = tile_size
+        # (ti, tj) -> {"map": ..., "updated": ..., "memids": ...}
+        self.tiles = {}
+
+    def get_tile(self, ti, tj, create=False):
+        tile = self.tiles.get((ti, tj))
+        if tile is None and create:
+            tile = {
+                layer: np.full((self.tile_size, self.tile_size), v, dtype=dtype)
+                for layer, (dtype, v) in LAYERS.items()
+            }
+            self.tiles[(ti, tj)] = tile
+        return tile
+
+    def get(self, i, j, layer="map"):
+        ti, ii = divmod(i, self.tile_size)
+        tj, jj = divmod(j, self.tile_size)
+        tile = self.tiles.get((ti, tj))
+        if tile is None:
+            return LAYERS[layer][1]
+        return tile[layer][ii, jj]
+
+    def set(self, i, j, **values):
+        """sets the layers given as keyword args at cell i, j"""
+        ti, ii = divmod(i, self.tile_size)
+        tj, jj = divmod(j, self.tile_size)
+        tile = self.get_tile(ti, tj, create=True)
+        for layer, v in values.items():
+            tile[layer][ii, jj] = v
+
+    def set_many(self, i, j, **values):
+        """
+        vectorized set: i and j are int arrays of cells, each keyword arg is a layer
+        and a scalar or an array of values (one per cell).
+        if a cell is repeated, the last value is the one kept
+        """
+        i = np.asarray(i, dtype=np.int64)
+        j = np.asarray(j, dtype=np.int64)
+        if i.size == 0:
+            return
+        values = {layer: np.broadcast_to(v, i.shape) for layer, v in values.items()}
+        ti, ii = np.divmod(i, self.tile_size)
+        tj, jj = np.divmod(j, self.tile_size)
+        tile_keys, inverse = np.unique(np.stack([ti, tj], axis=1), axis=0, return_inverse=True)
+        # group the cells by tile, keeping their order within each tile
+        order = np.argsort(inverse.reshape(-1), kind="stable")
+        bounds = np.cumsum(np.bincount(inverse.reshape(-1), minlength=len(tile_keys)))
+        start = 0
+        for (a, b), end in zip(tile_keys.tolist(), bounds.tolist()):
+            sel = order[start:end]
+            start = end
+            tile = self.get_tile(a, b, create=True)
+            for layer, v in values.items():
+                tile[layer][ii[sel], jj[sel]] = v[sel]
+
+    def fill(self, layer, value):
+        """sets a layer to value in all allocated tiles"""
+        for tile in self.tiles.values():
+            tile[layer][:] = value
+
+    def nonzero(self, layer="map"):
+        """returns arrays i, j of the cells where layer is nonzero"""
+        I = [np.zeros(0, dtype=np.int64)]
+        J = [np.zeros(0, dtype=np.int64)]
+        for (ti, tj), tile in self.tiles.items():
+            ii, jj = tile[layer].nonzero()
+            I.append(ii + ti * self.tile_size)
+            J.append(jj + tj * self.tile_size)
+        return np.concatenate(I), np.concatenate(J)
+
+    def sum(self, layer="map"):
+        return sum(int(tile[layer].sum()) for tile in self.tiles.values())
+
+    def nbytes(self):
+        return sum(a.nbytes for tile in self.tiles.values() for a in tile.values())
 
 
 # TODO tighter integration with reference objects table, main memory update
@@ -27,17 +175,21 @@ class PlaceField:
     maintains a grid-based map of some slice(s) of the world, and
     the state representations needed to track active exploration.
 
-    the .place_fields attribute is a dict with keys corresponding to heights,
-    and values {"map": 2d numpy array, "updated": 2d numpy array, "memids": 2d numpy array}
-    place_fields[h]["map"] is an occupany map at the the height h (in agent coordinates)
-                           a location is 0 if it is traversible or it is unseen, 1 if occupied
-                           by a non-traversible obstacle
-    place_fields[h]["memids"] gives a memid index for the ReferenceObject at that location,
-                              if there is a ReferenceObject linked to that spatial location.
-                              the PlaceField keeps a mappping from the indices to memids in
-                              self.index2memid and self.memid2index
-    place_fields[h]["updated"] gives the last update time of that location (in agent's internal time)
-                               if -1, it has neer been updated
+    the .maps attribute is a dict with keys corresponding to heights, and TiledMap values,
+    each with the layers "map" (uint8), "updated" (int32) and "memids" (int32):
+    maps[h] "map" is an occupany map at the the height h (in agent coordinates)
+                  a location is 0 if it is traversible or it is unseen, 1 if occupied
+                  by a non-traversible obstacle
+    maps[h] "memids" gives a memid index for the ReferenceObject at that location,
+                     if there is a ReferenceObject linked to that spatial location.
+                     the PlaceField keeps a mappping from the indices to memids in
+                     self.index2memid and self.memid2index
+    maps[h] "updated" gives the last update time of that location (in agent's internal time)
+                      if -1, it has neer been updated
+    the maps are unbounded, and only the tiles that have been written are stored.
+
+    heights are slices of slice_height (in agent coordinates); if slice_height is None,
+    everything is in the slice h=0.
 
     the .map2real method converts a location from a map to world coords
     the .real2map method converts a location from the world to the map coords
@@ -52,60 +204,63 @@ class PlaceField:
     it is not explored, since a 'close-enough' region in space has already been explored.
     """
 
-    def __init__(self, memory, pixels_per_unit=1):
+    def __init__(self, memory, pixels_per_unit=1, slice_height=None, tile_size=TILE_SIZE):
         self.get_time = memory.get_time
 
         self.index2memid = []
         self.memid2index = {}
 
         self.examined = {}
+        self.examined_index = GridIndex()
         self.examined_id = set()
         self.last = None
 
+        self.tile_size = tile_size
         self.maps = {}
         self.maybe_add_memid("NULL")
         self.maybe_add_memid(memory.self_memid)
-        # FIXME, want slices, esp for mc... init after first perception
-        # with h=y2slice(y) instead of using 0
-        self.map_size = self.extend_map(h=0)
+        self.get_slice(0)
 
         self.pixels_per_unit = pixels_per_unit
+        self.slice_height = slice_height
 
         # gives an index allowing quick lookup by memid
         # each entry is keyed by a memid and is a dict
-        # {str(h*BIG_I*BIG_J + i*BIG_J + j) : Traversible}
+        # {(i, j, h) : Traversible}
         # for each placed h, i ,j
         self.memid2locs = {}
 
+    def get_slice(self, h):
+        if h not in self.maps:
+            self.maps[h] = TiledMap(tile_size=self.tile_size)
+        return self.maps[h]
+
     def ijh2idx(self, i, j, h):
-        return str(h * BIG_I * BIG_J + i * BIG_J + j)
+        return (i, j, h)
 
     def idx2ijh(self, idx):
-        idx = int(idx)
-        j = idx % BIG_J
-        idx = (idx - j) // BIG_J
-        i = idx % BIG_I
-        h = (idx - i) // BIG_I
-        return i, j, h
+        return idx
+
+    def add_memid_loc(self, memid, i, j, h, is_obstacle):
+        if not self.memid2locs.get(memid):
+            self.memid2locs[memid] = {}
+        self.memid2locs[memid][(i, j, h)] = is_obstacle
 
     def pop_memid_loc(self, memid, i, j, h):
-        idx = self.hij2idx(h, i, j)
-        del self.memid2locs[memid][idx]
+        del self.memid2locs[memid][(i, j, h)]
 
     def maybe_delete_loc(self, i, j, h, t, memid="NULL"):
         """
         remove a loc from the maps and from memid2loc index.
         if memid is set, only removes the loc if the memid matches
         """
-        current_memid = self.index2memid[int(self.maps[h]["memids"][i, j])]
+        M = self.get_slice(h)
+        current_memid = self.index2memid[int(M.get(i, j, "memids"))]
         if memid == "NULL" or current_memid == memid:
-            self.maps[h]["memids"][i, j] = self.memid2index["NULL"]
-            self.maps[h]["map"][i, j] = 0
-            self.maps[h]["updated"][i, j] = t
-            idx = self.ijh2idx(i, j, h)
+            M.set(i, j, memids=self.memid2index["NULL"], map=0, updated=t)
             # maybe error/warn if its not there?
             if self.memid2locs.get(memid):
-                self.memid2locs[memid].pop(idx, None)
+                self.memid2locs[memid].pop((i, j, h), None)
                 if len(self.memid2locs[memid]) == 0:
                     self.memid2locs.pop(memid, None)
 
@@ -114,29 +269,30 @@ class PlaceField:
     # as obstacles (e.g. self_memid)
     def sync_traversible(self, locs, h=0):
         # overwrite traversibility map from slam service
-        self.maps[h]["map"][:] = 0
-        self.maps[h]["updated"][:] = self.get_time()
-        for (x, z) in locs:
-            i, j = self.real2map(x, z, h)
-            s = max(i - self.map_size + 1, j - self.map_size + 1, -i, -j)
-            if s > 0:
-                self.extend_map(h=h, extension=s)
-                i, j = self.real2map(x, z, h)
-            self.maps[h]["map"][i, j] = 1
+        M = self.get_slice(h)
+        M.fill("map", 0)
+        M.fill("updated", self.get_time())
+        locs = np.asarray(locs, dtype=np.float64).reshape(-1, 2)
+        i, j = self.real2map(locs[:, 0], locs[:, 1], h)
+        M.set_many(i, j, map=1)
         # replace memids that are obstacles if they were clobbered from map
-        for k, v in self.memid2locs.items():
-            for idx, t in v.items():
-                i, j, height = self.idx2ijh(idx)
-                if height == h and t > 0:
-                    self.maps[h]["map"][i, j] = 1
-
-    def get_obstacle_list(self):
+        ijs = [
+            (loc[0], loc[1])
+            for v in self.memid2locs.values()
+            for loc, t in v.items()
+            if loc[2] == h and t > 0
+        ]
+        if ijs:
+            I, J = zip(*ijs)
+            M.set_many(I, J, map=1)
+
+    def get_obstacle_list(self, h=0):
         """
         outputs a list of all impassable locations in agent coordinates.
         """
-        # FIXME! do other h
-        ijs = list(zip(*self.maps[0]["map"].nonzero()))
-        return [self.map2real(i, j, 0) for i, j in ijs]
+        i, j = self.get_slice(h).nonzero("map")
+        x, z = self.map2real(i, j, h)
+        return list(zip(x.tolist(), z.tolist()))
 
     def delete_loc_by_memid(self, memid, t, is_move=False):
         """
@@ -149,10 +305,8 @@ class PlaceField:
         count = 0
         for idx in self.memid2locs.get(memid, []):
             i, j, h = self.idx2ijh(idx)
-            self.maps[h]["memids"][i, j] = 0
             # FIXME: maybe this loc is still not traversible...
-            self.maps[h]["map"][i, j] = 0
-            self.maps[h]["updated"][i, j] = t
+            self.get_slice(h).set(i, j, memids=0, map=0, updated=t)
             count = count + 1
             if is_move and count > 1:
                 # eventually allow moving "large" objects
@@ -183,13 +337,23 @@ class PlaceField:
             if a memid is set, the remove will occur only if the memid matches.
 
         the "is_obstacle" status can be changed without changing memid etc.
+
+        runs of consecutive changes that are neither deletes nor moves are applied
+        together with add_locs
         """
         t = self.get_time()
+        run = []
         for c in changes:
             is_delete = c.get("is_delete", False)
             is_move = c.get("is_move", False)
             memid = c.get("memid", "NULL")
             p = c.get("pos")
+            if p is not None and not is_delete and not is_move:
+                run.append(c)
+                continue
+            if run:
+                self._add_changes(run, t)
+                run = []
             if p is None:
                 assert is_delete
                 # if the change is a remove, and is specified by memid:
@@ -201,55 +365,84 @@ class PlaceField:
                 x, y, z = p
                 h = self.y2slice(y)
                 i, j = self.real2map(x, z, h)
-                s = max(i - self.map_size + 1, j - self.map_size + 1, -i, -j)
-                if s > 0:
-                    self.extend_map(extension=s)
-                i, j = self.real2map(x, z, h)
-                s = max(i - self.map_size + 1, j - self.map_size + 1, -i, -j)
-                if s > 0:
-                    # the map can not been extended enough to handle these bc MAX_MAP_SIZE
-                    # FIXME appropriate warning or error?
-                    continue
                 if is_delete:
                     self.maybe_delete_loc(i, j, h, t, memid=memid)
                 else:
-                    if is_move:
-                        assert memid != "NULL"
-                        self.delete_loc_by_memid(memid, t, is_move=True)
-                    self.maps[h]["memids"][i, j] = self.memid2index.get(
-                        memid, self.maybe_add_memid(memid)
-                    )
-                    self.maps[h]["map"][i, j] = c.get("is_obstacle", 1)
-                    self.maps[h]["updated"][i, j] = t
-                    if not self.memid2locs.get(memid):
-                        self.memid2locs[memid] = {}
-                    self.memid2locs[memid][self.ijh2idx(i, j, h)] = c.get("is_obstacle", 1)
-
-    # FIXME, want slices, esp for mc
+                    assert memid != "NULL"
+                    self.delete_loc_by_memid(memid, t, is_move=True)
+                    self.add_locs([p], memids=[memid], is_obstacle=[c.get("is_obstacle", 1)], t=t)
+        if run:
+            self._add_changes(run, t)
+
+    def _add_changes(self, changes, t):
+        self.add_locs(
+            [c["pos"] for c in changes],
+            memids=[c.get("memid", "NULL") for c in changes],
+            is_obstacle=[c.get("is_obstacle", 1) for c in changes],
+            t=t,
+        )
+
+    def add_locs(self, xyz, memids=None, is_obstacle=1, t=None):
+        """
+        vectorized version of update_map for changes that are neither deletes
+        nor moves.
+
+        Args:
+            xyz: (N, 3) array or list of positions
+            memids: list of N memids, or None for all "NULL"
+            is_obstacle: scalar or list of N values for the "map" layer
+            t: update time, defaults to now
+        """
+        xyz = np.asarray(xyz, dtype=np.float64).reshape(-1, 3)
+        n = xyz.shape[0]
+        if n == 0:
+            return
+        t = self.get_time() if t is None else t
+        if memids is None:
+            memids = ["NULL"] * n
+        obstacle = np.broadcast_to(np.asarray(is_obstacle, dtype=np.uint8), (n,))
+        memid_idxs = np.array([self.maybe_add_memid(m) for m in memids], dtype=np.int32)
+        hs = self.y2slice(xyz[:, 1])
+        I, J = self.real2map(xyz[:, 0], xyz[:, 2], hs)
+        for h in np.unique(hs).tolist():
+            sel = hs == h
+            self.get_slice(h).set_many(
+                I[sel], J[sel], memids=memid_idxs[sel], map=obstacle[sel], updated=t
+            )
+        for i, j, h, memid, o in zip(
+            I.tolist(), J.tolist(), hs.tolist(), memids, obstacle.tolist()
+        ):
+            self.add_memid_loc(memid, i, j, h, o)
+
     def y2slice(self, y):
-        return 0
+        """
+        the height index of the slice containing y.  y can be a number or an array;
+        if slice_height is None, everything is in slice 0
+        """
+        if self.slice_height is None:
+            return 0 if np.isscalar(y) else np.zeros(np.shape(y), dtype=np.int64)
+        h = np.floor(np.asarray(y) / self.slice_height).astype(np.int64)
+        return int(h) if np.isscalar(y) else h
 
     def real2map(self, x, z, h):
         """
-        convert an x, z coordinate in agent space to a pixel on the map
+        convert an x, z coordinate in agent space to a pixel on the map.
+        x and z can be numbers or arrays
         """
-        n = self.maps[h]["map"].shape[0]
-        i = x * self.pixels_per_unit
-        j = z * self.pixels_per_unit
-        i = i + n // 2
-        j = j + n // 2
-        return round(i), round(j)
+        if np.isscalar(x) and np.isscalar(z):
+            return round(x * self.pixels_per_unit), round(z * self.pixels_per_unit)
+        i = np.rint(np.asarray(x) * self.pixels_per_unit).astype(np.int64)
+        j = np.rint(np.asarray(z) * self.pixels_per_unit).astype(np.int64)
+        return i, j
 
     def map2real(self, i, j, h):
         """
-        convert an i, j pixel coordinate in the map to agent space
+        convert an i, j pixel coordinate in the map to agent space.
+        i and j can be numbers or arrays
         """
-        n = self.maps[h]["map"].shape[0]
-        i = i - n // 2
-        j = j - n // 2
-        x = i / self.pixels_per_unit
-        z = j / self.pixels_per_unit
-        return x, z
+        if np.isscalar(i) and np.isscalar(j):
+            return i / self.pixels_per_unit, j / self.pixels_per_unit
+        return np.asarray(i) / self.pixels_per_unit, np.asarray(j) / self.pixels_per_unit
 
     def maybe_add_memid(self, memid):
         """
@@ -263,34 +456,15 @@ class PlaceField:
             self.memid2index[memid] = idx
         return idx
 
-    def extend_map(self, h=None, extension=1):
-        assert extension >= 0
-        if not h and len(self.maps) == 1:
-            h = list(self.maps.keys())[0]
-        if not self.maps.get(h):
-            self.maps[h] = {}
-            for m, v in {"updated": -1, "map": 0, "memids": 0}.items():
-                self.maps[h][m] = v * np.ones((MAP_INIT_SIZE, MAP_INIT_SIZE))
-        w = self.maps[h]["map"].shape[0]
-        new_w = w + 2 * extension
-        if new_w > MAX_MAP_SIZE:
-            return -1
-        for m, v in {"updated": -1, "map": 0, "memids": 0}.items():
-            new_map = v * np.ones((new_w, new_w))
-            new_map[extension:-extension, extension:-extension] = self.maps[h][m]
-            self.maps[h][m] = new_map
-        return new_w
-
     def get_closest(self, xyz):
-        """returns closest examined point to xyz"""
-        c = None
-        dist = 1.5
-        for k, v in self.examined.items():
-            if no_y_l1(k, xyz) < dist:
-                dist = no_y_l1(k, xyz)
-                c = k
+        """
+        returns closest examined point to xyz, if there is one within EXAMINED_RADIUS.
+        otherwise xyz is added to the examined points (with count 0) and returned
+        """
+        c = self.examined_index.nearest(xyz, EXAMINED_RADIUS)
         if c is None:
             self.examined[xyz] = 0
+            self.examined_index.add(xyz)
             return xyz
         return c
 
@@ -302,17 +476,16 @@ class PlaceField:
 
     def clear_examined(self):
         self.examined = {}
+        self.examined_index = GridIndex()
         self.examined_id = set()
         self.last = None
 
     def can_examine(self, x):
         """decides whether to examine x or not."""
-        loc = x["xyz"]
         k = self.get_closest(x["xyz"])
-        val = True
-        if self.last is not None and self.l1(cls.last, k) < 1:
-            val = False
         val = self.examined[k] < 2
+        if self.last is not None and no_y_l1(self.last, k) < 1:
+            val = False
         print(
             f"can_examine {x['eid'], x['label'], x['xyz'][:2]}, closest {k[:2]}, can_examine {val}"
         )
@@ -331,10 +504,13 @@ class EmptyPlaceField:
     def update_map(self, changes):
         pass
 
+    def add_locs(self, xyz, memids=None, is_obstacle=1, t=None):
+        pass
+
     def get_closest(self):
         return None
 
-    def get_obstacle_list(self):
+    def get_obstacle_list(self, h=0):
         return []
 
 
@@ -0,0 +1,310 @@
+"""
+Copyright (c) Facebook, Inc. and its affiliates.
+"""
+from collections import OrderedDict
+from droidlet.memory.filters_conversions import get_inequality_symbol, sqly_to_new_filters
+
+####################################################################################
+### compiles the where_clause of a basic search (a FILTERS dict or sqly string)
+### into a single parameterized SQL statement.
+### a query is first normalized into a "skeleton" where every literal value is replaced
+### by a placeholder; the values are collected separately and bound when the plan is run.
+### compiled plans are kept in an LRU keyed by (memory_type, skeleton), so queries that
+### differ only in their values (e.g. "WHERE prio=-1" vs "WHERE prio=0") share a plan.
+### clauses that can't be expressed in SQL (Attributes, subqueries, ...) raise
+### NotCompilable and the MemorySearcher falls back to its python implementation.
+####################################################################################
+
+DEFAULT_PLAN_CACHE_SIZE = 256
+TRIPLE_KEYS = ["obj", "obj_text", "pred_text", "subj", "subj_text"]
+
+
+class NotCompilable(Exception):
+    pass
+
+
+class LRUCache:
+    """A small least-recently-used cache.  get() returns None on a miss."""
+
+    def __init__(self, maxsize=DEFAULT_PLAN_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.data = OrderedDict()
+
+    def get(self, key):
+        try:
+            self.data.move_to_end(key)
+        except KeyError:
+            return None
+        return self.data[key]
+
+    def put(self, key, value):
+        self.data[key] = value
+        self.data.move_to_end(key)
+        if len(self.data) > self.maxsize:
+            self.data.popitem(last=False)
+
+    def clear(self):
+        self.data.clear()
+
+    def __len__(self):
+        return len(self.data)
+
+
+def normalize_comparator(where_clause, params):
+    """
+    returns the skeleton of a comparator leaf, appending its (converted)
+    values to params.  the value conversions follow
+    MemorySearcher.handle_comparator_where_leaf
+    """
+    v = where_clause["input_left"]
+    if type(v) is not dict:
+        raise NotCompilable()
+    input_left = v.get("attribute")
+    input_right = where_clause["input_right"]
+    if type(input_left) is not str or type(input_right) is dict:
+        raise NotCompilable()
+    ctype = where_clause.get("comparison_type", "EQUAL")
+    try:
+        comparison_symbol = get_inequality_symbol(ctype)
+        if type(ctype) is dict and ctype.get("close_tolerance"):
+            comparison_symbol = "<>"
+            x = float(input_right)
+            params.extend([x - ctype["close_tolerance"], x + ctype["close_tolerance"]])
+        elif comparison_symbol[0] == "<" or comparison_symbol[0] == ">":
+            params.append(float(input_right))
+        elif type(ctype) is dict and ctype.get("modulus"):
+            comparison_symbol = "%"
+            params.extend([ctype["modulus"], input_right])
+        else:
+            params.append(input_right)
+    except:
+        # let the python path raise the informative error
+        raise NotCompilable()
+    return ("comparator", input_left, comparison_symbol)
+
+
+def normalize_where(where_clause, params):
+    """
+    returns a hashable skeleton of where_clause, appending the literal values
+    to params in the order they will be bound.
+    """
+    for conj in ["AND", "OR"]:
+        if where_clause.get(conj):
+            return (conj, tuple(normalize_where(c, params) for c in where_clause[conj]))
+    if where_clause.get("NOT"):
+        return ("NOT", normalize_where(where_clause["NOT"][0], params))
+    if where_clause.get("input_left"):
+        return normalize_comparator(where_clause, params)
+
+    # a triple
+    if any(k not in TRIPLE_KEYS or callable(v) for k, v in where_clause.items()):
+        raise NotCompilable()
+    # as in AgentMemory.get_triples, None values are not searched on
+    keys = sorted(k for k, v in where_clause.items() if v is not None)
+    if "subj" in keys and "subj_text" in keys or "obj" in keys and "obj_text" in keys:
+        raise NotCompilable()
+    if not any(k in keys for k in ["subj", "subj_text", "pred_text", "obj", "obj_text"]):
+        raise NotCompilable()
+    params.extend(where_clause[k] for k in keys)
+    return ("triple", tuple(keys))
+
+
+class Const:
+    """a fixed (not late-bound) argument of a compiled plan"""
+
+    def __init__(self, value):
+        self.value = value
+
+
+class CompiledPlan:
+    """
+    a SQL statement returning the memids satisfying a where_clause, and an
+    argument template.  entries in the template are either Const, or ints
+    indexing into the list of late-bound params.
+    """
+
+    def __init__(self, sql, arg_template):
+        self.sql = sql
+        self.arg_template = arg_template
+
+    def bind(self, params):
+        return [a.value if type(a) is Const else params[a] for a in self.arg_template]
+
+    def run(self, agent_memory, params):
+        return [m for (m,) in agent_memory._db_read(self.sql, *self.bind(params))]
+
+
+class PlanBuilder:
+    """compiles a skeleton (from normalize_where) against a memory's schema"""
+
+    def __init__(self, agent_memory, memtype):
+        self.memory = agent_memory
+        self.memtype = memtype
+        self.node_types = list(agent_memory.node_children[memtype])
+        self.args = []
+        self.param_idx = 0
+
+    def next_params(self, n):
+        self.args.extend(range(self.param_idx, self.param_idx + n))
+        self.param_idx += n
+
+    def node_type_clause(self, col):
+        self.args.extend(Const(nt) for nt in self.node_types)
+        return col + " IN (" + ",".join(["?"] * len(self.node_types)) + ")"
+
+    def columns(self, table):
+        return self.memory.get_table_columns(table)
+
+    def build(self, skeleton):
+        sql = self.compile_node(skeleton)
+        return CompiledPlan(sql, self.args)
+
+    def compile_node(self, skeleton):
+        kind = skeleton[0]
+        if kind == "AND" or kind == "OR":
+            children = [self.compile_node(c) for c in skeleton[1]]
+            if len(children) == 1:
+                return "SELECT DISTINCT uuid FROM ({})".format(children[0])
+            op = {"AND": " INTERSECT ", "OR": " UNION "}[kind]
+            return op.join("SELECT uuid FROM ({})".format(c) for c in children)
+        if kind == "NOT":
+            universe = "SELECT uuid FROM Memories WHERE {} AND is_snapshot=0".format(
+                self.node_type_clause("node_type")
+            )
+            return universe + " EXCEPT SELECT uuid FROM ({})".format(
+                self.compile_node(skeleton[1])
+            )
+        if kind == "comparator":
+            return self.compile_comparator(skeleton[1], skeleton[2])
+        return self.compile_triple(skeleton[1])
+
+    def compile_comparator(self, prop, comparison_symbol):
+        """mirrors search_by_property: the Memories table, then the node's table, then triples"""
+        node = self.memory.nodes.get(self.memtype)
+        table = getattr(node, "TABLE", None)
+        if prop in self.columns("Memories"):
+            table = "Memories"
+        elif table is None or prop not in self.columns(table):
+            table = None
+
+        if table is None:
+            # the property is a triple
+            if comparison_symbol == "=":
+                return self.compile_triple(("obj_text", "pred_text"), pred_text=prop)
+            elif comparison_symbol == "=#=":
+                return self.compile_triple(("obj", "pred_text"), pred_text=prop)
+            raise NotCompilable()
+
+        col = table + "." + prop
+        if comparison_symbol == "%":
+            where = col + " % ? = ?"
+        elif comparison_symbol == "<>":
+            where = col + ">? AND " + col + "<?"
+        elif comparison_symbol in ["=", "!=", "<", "<=", ">", ">="]:
+            where = col + comparison_symbol + "?"
+        else:
+            raise NotCompilable()
+        if table == "Memories":
+            sql = "SELECT uuid FROM Memories WHERE {} AND ".format(
+                self.node_type_clause("node_type")
+            )
+        else:
+            sql = (
+                "SELECT {0}.uuid AS uuid FROM {0} INNER JOIN Memories ON {0}.uuid=Memories.uuid "
+                "WHERE {1} AND ".format(table, self.node_type_clause("Memories.node_type"))
+            )
+        self.next_params(2 if comparison_symbol in ["%", "<>"] else 1)
+        return sql + where
+
+    def compile_triple(self, keys, pred_text=None):
+        """
+        mirrors MemorySearcher.handle_triple_where_leaf (and AgentMemory.get_triples):
+        returns the obj memids if subj is fixed, otherwise the subj memids,
+        restricted to the searched node types.
+        if pred_text is given it is a Const, and the other keys are late-bound params
+        """
+        if "subj" in keys:
+            sql = (
+                "SELECT Triples.obj AS uuid FROM Triples "
+                "INNER JOIN Memories as M ON Triples.subj=M.uuid "
+                "INNER JOIN Memories as N ON Triples.obj=N.uuid "
+                "WHERE {} AND M.is_snapshot=0".format(self.node_type_clause("N.node_type"))
+            )
+        else:
+            sql = (
+                "SELECT Triples.subj AS uuid FROM Triples "
+                "INNER JOIN Memories as M ON Triples.subj=M.uuid "
+                "WHERE {} AND M.is_snapshot=0".format(self.node_type_clause("M.node_type"))
+            )
+        for k in keys:
+            sql += " AND Triples." + k + "=?"
+            if k == "pred_text" and pred_text is not None:
+                self.args.append(Const(pred_text))
+            else:
+                self.next_params(1)
+        return sql
+
+
+class QueryCompiler:
+    """
+    compiles and caches basic search queries for an agent_memory.
+    the cache should be cleared whenever the memory's schema changes.
+
+    Args:
+        maxsize (int): maximum number of cached plans (and of cached parsed sqly strings)
+    """
+
+    def __init__(self, maxsize=DEFAULT_PLAN_CACHE_SIZE):
+        self.plans = LRUCache(maxsize)
+        self.parsed = LRUCache(maxsize)
+
+    def clear(self):
+        self.plans.clear()
+        self.parsed.clear()
+
+    def prepare(self, agent_memory, query, default_memtype="ReferenceObject"):
+        """
+        returns the query in dict form, and a (CompiledPlan, params) pair for its
+        where_clause, or None for the pair if the where_clause can't be compiled
+        (or there is no where_clause).  sqly strings are parsed and normalized once per
+        default_memtype; the dict returned for a sqly string is shared and should not
+        be modified.
+        """
+        if type(query) is str:
+            prepared = self.parsed.get((query, default_memtype))
+            if prepared is None:
+                query_dict = sqly_to_new_filters(query)
+                prepared = (query_dict, self.normalize(query_dict, default_memtype))
+                self.parsed.put((query, default_memtype), prepared)
+            query_dict, normalized = prepared
+        else:
+            query_dict = query
+            normalized = self.normalize(query_dict, default_memtype)
+        if normalized is None:
+            return query_dict, None
+        key, params = normalized
+        plan = self.plans.get(key)
+        if plan is None:
+            try:
+                plan = PlanBuilder(agent_memory, key[0]).build(key[1])
+            except Exception:
+                # NotCompilable, or e.g. an unknown memory_type:
+                # the python path handles (or reports) it
+                plan = False
+            self.plans.put(key, plan)
+        if not plan:
+            return query_dict, None
+        return query_dict, (plan, params)
+
+    def normalize(self, query_dict, default_memtype):
+        """returns ((memtype, skeleton), params), or None if not compilable"""
+        where_clause = query_dict.get("where_clause")
+        if not where_clause:
+            return None
+        params = []
+        try:
+            skeleton = normalize_where(where_clause, params)
+        except Exception:
+            # malformed or not compilable, the python path handles (or reports) it
+            return None
+        return (query_dict.get("memory_type", default_memtype), skeleton), params
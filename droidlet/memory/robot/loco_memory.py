@@ -52,6 +52,11 @@ class LocoAgentMemory(AgentMemory):
                 updated_objects: List of detections with updates
                 humans: List of humans detected
         """
+        # all writes from one perception update go in a single transaction
+        with self.batch():
+            self._update(perception_output)
+
+    def _update(self, perception_output):
         if not perception_output:
             return
 
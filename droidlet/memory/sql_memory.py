@@ -11,13 +11,15 @@ import pickle
 import sqlite3
 import uuid
 import datetime
+from contextlib import contextmanager
 from itertools import zip_longest
-from typing import cast, Optional, List, Tuple, Sequence, Union
+from typing import cast, Optional, List, Tuple, Sequence, Union, Dict
 from droidlet.base_util import XYZ
 from droidlet.shared_data_structs import Time
 from droidlet.memory.memory_filters import MemorySearcher
+from droidlet.memory.query_compiler import QueryCompiler
 from droidlet.event import dispatch
-from droidlet.memory.memory_util import parse_sql, format_query
+from droidlet.memory.memory_util import parse_sql, format_query, chunks
 from droidlet.memory.place_field import PlaceField, EmptyPlaceField
 
 from droidlet.memory.memory_nodes import (  # noqa
@@ -64,6 +66,8 @@ class AgentMemory:
         agent_time (Time object): object with a .get_time(), get_world_hour, and add_tick()
                                    methods
         on_delete_callback (callable): callable to be run when a memory is deleted from Memories table
+        place_field_pixels_per_unit (int): resolution of the place_field, 0 for no place_field
+        place_field_slice_height (float): height of the place_field's slices, None for a single slice
 
     Attributes:
         _db_log_file (FileHandler): File handler for writing database logs
@@ -74,6 +78,7 @@ class AgentMemory:
         nodes (dict): Mapping of node name to table name
         self_memid (str): MemoryID for the AgentMemory
         searcher (MemorySearcher): A class to process searches through memory
+        query_compiler (QueryCompiler): compiles and caches search queries as sql statements
         time (int): The time of the agent
     """
 
@@ -87,6 +92,7 @@ class AgentMemory:
         agent_time=None,
         on_delete_callback=None,
         place_field_pixels_per_unit=DEFAULT_PIXELS_PER_UNIT,
+        place_field_slice_height=None,
     ):
         if db_log_path:
             self._db_log_file = gzip.open(db_log_path + ".gz", "w")
@@ -94,16 +100,25 @@ class AgentMemory:
         if os.path.isfile(db_file):
             os.remove(db_file)
         self.db = sqlite3.connect(db_file, check_same_thread=False)
+        # >0 while inside a batch() block; writes are not committed until the
+        # outermost block exits
+        self._batch_depth = 0
+        self._batch_hook_data = []
         self.task_db = {}
         self._safe_pickle_saved_attrs = {}
 
         self.on_delete_callback = on_delete_callback
+        # set by a task scheduler that caches the Tasks table, see notify_task_update
+        self.on_task_update_callback = None
 
         self.init_time_interface(agent_time)
 
         # FIXME agent : should this be here?  where to put?
         self.coordinate_transforms = coordinate_transforms
 
+        # compiled basic_search plans and table columns, cleared when a schema script is run
+        self.query_compiler = QueryCompiler()
+        self._table_columns = {}
         for schema_path in schema_paths:
             with open(schema_path, "r") as f:
                 self._db_script(f.read())
@@ -128,7 +143,11 @@ class AgentMemory:
 
         self.searcher = MemorySearcher()
         if place_field_pixels_per_unit > 0:
-            self.place_field = PlaceField(self, pixels_per_unit=place_field_pixels_per_unit)
+            self.place_field = PlaceField(
+                self,
+                pixels_per_unit=place_field_pixels_per_unit,
+                slice_height=place_field_slice_height,
+            )
         else:
             self.place_field = EmptyPlaceField()
 
@@ -279,6 +298,48 @@ class AgentMemory:
         (r,) = self._db_read_one("SELECT node_type FROM Memories WHERE uuid=?", memid)
         return r
 
+    def get_node_types_from_memids(self, memids: Sequence[str]) -> Dict[str, str]:
+        """Given a list of memids, return a dict mapping each of them to its node type.
+        memids that are not in memory are omitted from the dict.
+
+        Args:
+            memids (list[string]): Memory IDs
+
+        Returns:
+            dict[string, string]: memid to node type of the memory node
+
+        Examples::
+            >>> memids = ['10517cc584844659907ccfa6161e9d32',
+                          '3493128492859dfksdfhs34839458934']
+            >>> get_node_types_from_memids(memids)
+        """
+        node_types = {}
+        for c in chunks(list(set(memids))):
+            q = "SELECT uuid, node_type FROM Memories WHERE uuid IN ({})".format(
+                ",".join(["?"] * len(c))
+            )
+            node_types.update(self._db_read(q, *c))
+        return node_types
+
+    def get_table_columns(self, table: str) -> List[str]:
+        """Return the column names of a table.  These are cached until
+        the next schema script is run.
+
+        Args:
+            table (string): Name of table
+
+        Returns:
+            list[string]: the column names, empty if the table does not exist
+
+        Examples::
+            >>> get_table_columns("ReferenceObjects")
+        """
+        cols = self._table_columns.get(table)
+        if cols is None:
+            cols = [c[1] for c in self._db_read("PRAGMA table_info({})".format(table))]
+            self._table_columns[table] = cols
+        return cols
+
     def get_mem_by_id(self, memid: str, node_type: str = None) -> "MemoryNode":
         """Given the memid and an optional node_type,
         return the memory node
@@ -335,6 +396,8 @@ class AgentMemory:
             >>> forget(memid)
         """
         self.db_write("DELETE FROM Memories WHERE uuid=?", memid)
+        # the memid might have been a Task
+        self.notify_task_update(memid)
         # TRIGGERs in the db clean up triples referencing the memid.
         # TODO this less brutally.  might want to remember some
         # triples where the subject or object has been removed
@@ -353,8 +416,9 @@ class AgentMemory:
         assert qsplit[0].lower() == "select"
         assert qsplit[1].lower() == "uuid"
         uuids = self._db_read(query)
-        for u in uuids:
-            self.forget(u[0])
+        with self.batch():
+            for u in uuids:
+                self.forget(u[0])
 
     def basic_search(self, query, get_all=False):
         """Perform a basic search using the query
@@ -794,6 +858,19 @@ class AgentMemory:
         # Return newly created object
         return TaskNode(self, memid)
 
+    def notify_task_update(self, memid: str = None, task=None):
+        """Write-through hook for the Tasks table: TaskNode and the task_stack_*
+        methods call this after writing to it, so that a scheduler caching the
+        table (set as on_task_update_callback) can stay in sync without re-reading it.
+
+        Args:
+            memid (string): Memory ID of the task whose row was written, or None
+                if (possibly) many rows were
+            task (Task): the task object, if its pickle was written
+        """
+        if self.on_task_update_callback is not None:
+            self.on_task_update_callback(memid, task)
+
     # TORCH this
     def task_stack_update_task(self, memid: str, task):
         """Update task in memory
@@ -811,6 +888,7 @@ class AgentMemory:
             >>> task_stack_update_task(task, memid)
         """
         self.db_write("UPDATE Tasks SET pickled=? WHERE uuid=?", self.safe_pickle(task), memid)
+        self.notify_task_update(memid, task)
 
     # TORCH this
     def task_stack_peek(self) -> Optional["TaskNode"]:
@@ -851,6 +929,7 @@ class AgentMemory:
         if mem is None:
             raise ValueError("Called task_stack_pop with empty stack")
         self.db_write("UPDATE Tasks SET finished=? WHERE uuid=?", self.get_time(), mem.memid)
+        self.notify_task_update(mem.memid)
         return mem
 
     def task_stack_pause(self) -> bool:
@@ -859,7 +938,9 @@ class AgentMemory:
         Returns:
             int: Number of rows affected
         """
-        return self.db_write("UPDATE Tasks SET paused=1 WHERE finished < 0") > 0
+        r = self.db_write("UPDATE Tasks SET paused=1 WHERE finished < 0")
+        self.notify_task_update()
+        return r > 0
 
     def task_stack_clear(self):
         """Clear the task stack
@@ -869,6 +950,7 @@ class AgentMemory:
         """
         # FIXME use forget; fix this when tasks become MemoryNodes
         self.db_write("DELETE FROM Tasks WHERE finished < 0")
+        self.notify_task_update()
 
     def task_stack_resume(self) -> bool:
         """Resume stopped tasks. Return True if there was something to resume.
@@ -876,7 +958,9 @@ class AgentMemory:
         Returns:
             int: Number of rows affected
         """
-        return self.db_write("UPDATE Tasks SET paused=0") > 0
+        r = self.db_write("UPDATE Tasks SET paused=0")
+        self.notify_task_update()
+        return r > 0
 
     def task_stack_find_lowest_instance(
         self, cls_names: Union[str, Sequence[str]]
@@ -1014,7 +1098,9 @@ class AgentMemory:
         """Return the number of rows affected.  As a side effect,
            sets the updated_time entry for each affected memory,
            and applies self.on_delete_callback to the list of deleted memids
-           if there are any and on_delete_callback is not None
+           if there are any and on_delete_callback is not None.
+           Inside a batch() block the side effects are deferred until the
+           batch is committed.
 
         Args:
             query (string): The query to be run against the database
@@ -1029,17 +1115,125 @@ class AgentMemory:
         """
         start_time = datetime.datetime.now()
         r = self._db_write(query, *args)
+        self._after_write(start_time, query, args, r)
+        return r
+
+    def db_write_many(self, query: str, args_list: Sequence[Sequence]) -> int:
+        """Run the same write query once for each set of arguments in args_list,
+           in a single transaction.  The Updates table and the dashboard hook
+           are processed once for the whole set rather than once per row.
+
+        Args:
+            query (string): The query to be run against the database
+            args_list (list[tuple]): one tuple of query arguments per row
+
+        Returns:
+            int: Number of rows affected
+
+        Examples ::
+            >>> query = "UPDATE ReferenceObjects SET x=?, y=?, z=? WHERE uuid=?"
+            >>> args_list = [(0, 0, 0, '10517cc584844659907ccfa6161e9d32'),
+                             (1, 2, 3, '3493128492859dfksdfhs34839458934')]
+            >>> db_write_many(query, args_list)
+        """
+        start_time = datetime.datetime.now()
+        args_list = [
+            tuple(a.item() if isinstance(a, np.number) else a for a in args) for args in args_list
+        ]
+        if len(args_list) == 0:
+            return 0
+        try:
+            c = self.db.cursor()
+            c.executemany(query, args_list)
+            if self._batch_depth == 0:
+                self.db.commit()
+            c.close()
+        except:
+            logging.error("Bad write: {} : {} rows".format(query, len(args_list)))
+            # don't leave the rows before the bad one for the next commit;
+            # inside a batch() the whole batch is rolled back when it exits
+            if self._batch_depth == 0:
+                self.db.rollback()
+            raise
+        for args in args_list:
+            self._write_to_db_log(query, *args)
+        r = c.rowcount
+        self._after_write(start_time, query, args_list[0], r)
+        return r
+
+    @contextmanager
+    def batch(self):
+        """Context manager running all writes inside the block in one
+        transaction.  The Updates table (updated_time bookkeeping and
+        on_delete_callback) and the dashboard "memory" hook are processed once,
+        when the outermost block exits.  If the block raises, the transaction
+        is rolled back.  Nested blocks are folded into the outermost one.
+
+        Examples ::
+            >>> with memory.batch():
+            >>>     memory.tag(memid, "red")
+            >>>     memory.tag(memid, "cube")
+        """
+        self._batch_depth += 1
+        try:
+            yield self
+        except:
+            self._batch_depth -= 1
+            if self._batch_depth == 0:
+                self.db.rollback()
+                self._batch_hook_data = []
+            raise
+        self._batch_depth -= 1
+        if self._batch_depth == 0:
+            start_time = datetime.datetime.now()
+            self._process_updates()
+            self.db.commit()
+            hook_data, self._batch_hook_data = self._batch_hook_data, []
+            if hook_data:
+                end_time = datetime.datetime.now()
+                dispatch.send(
+                    "memory",
+                    data={
+                        "name": "memory",
+                        "start_time": hook_data[0]["start_time"],
+                        "end_time": end_time,
+                        "elapsed_time": (end_time - start_time).total_seconds()
+                        + sum(h["elapsed_time"] for h in hook_data),
+                        "agent_time": self.get_time(),
+                        "table_name": ",".join(sorted(set(h["table_name"] for h in hook_data))),
+                        "operation": "BATCH",
+                        "arguments": [h["arguments"] for h in hook_data],
+                        "result": sum(h["result"] for h in hook_data),
+                    },
+                )
+
+    def _process_updates(self):
+        """Read and clear the Updates table filled by the db TRIGGERs: sets the
+        updated_time of each updated memory and runs on_delete_callback on the
+        deleted ones.
+        """
         # some of this can be implemented with TRIGGERS and a python sqlite fn
         # but its a bit of a pain bc we want the agent's time in the update
         # not system time
-        updated_memids = self._db_read("SELECT * FROM Updates")
-        updated = [mem[0] for mem in updated_memids if mem[1] == "update"]
-        deleted = [mem[0] for mem in updated_memids if mem[1] == "delete"]
-        for u in set(updated):
-            self.set_memory_updated_time(u)
-        if self.on_delete_callback is not None and deleted:
+        deleted = []
+        if self.on_delete_callback is not None:
+            deleted = [
+                m for (m,) in self._db_read("SELECT uuid FROM Updates WHERE update_type='delete'")
+            ]
+        self._db_write(
+            """UPDATE Memories SET updated_time=? WHERE uuid IN
+            (SELECT uuid FROM Updates WHERE update_type='update')""",
+            self.get_time(),
+        )
+        if deleted:
             self.on_delete_callback(deleted)
         self._db_write("DELETE FROM Updates")
+
+    def _after_write(self, start_time, query, args, r):
+        """Updates bookkeeping and dashboard hook for a write, deferred if
+        inside a batch()"""
+        if self._batch_depth == 0:
+            self._process_updates()
         # format the data to send to dashboard timeline
         query_table, query_operation = parse_sql(query[: query.find("(") - 1])
         query_dict = format_query(query, *args)
@@ -1056,15 +1250,18 @@ class AgentMemory:
             "arguments": query_dict,
             "result": r,
         }
-        dispatch.send("memory", data=hook_data)
-        return r
+        if self._batch_depth > 0:
+            self._batch_hook_data.append(hook_data)
+        else:
+            dispatch.send("memory", data=hook_data)
 
     def _db_write(self, query: str, *args) -> int:
         args = tuple(a.item() if isinstance(a, np.number) else a for a in args)
         try:
             c = self.db.cursor()
             c.execute(query, args)
-            self.db.commit()
+            if self._batch_depth == 0:
+                self.db.commit()
             c.close()
             self._write_to_db_log(query, *args)
             return c.rowcount
@@ -1082,6 +1279,8 @@ class AgentMemory:
         c.executescript(script)
         self.db.commit()
         c.close()
+        self.query_compiler.clear()
+        self._table_columns = {}
         self._write_to_db_log(script, no_format=True)
 
     ####################
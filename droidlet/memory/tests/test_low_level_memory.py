@@ -1,6 +1,7 @@
 """
 Copyright (c) Facebook, Inc. and its affiliates.
 """
+import sqlite3
 import unittest
 import numpy as np
 from droidlet.memory.memory_nodes import (
@@ -13,7 +14,17 @@ from droidlet.memory.memory_nodes import (
 )
 from droidlet.memory.sql_memory import AgentMemory
 from droidlet.base_util import Pos, Look, Player
-from droidlet.memory.memory_filters import MemorySearcher
+from droidlet.shared_data_struct import rotation
+from droidlet.memory.memory_filters import (
+    MemorySearcher,
+    filter_memids_by_nodetype,
+    get_property_value,
+    get_property_values,
+    get_positions,
+    search_by_attribute,
+    argval_subsample_idx,
+)
+from droidlet.memory.memory_attributes import LinearExtentAttribute, LookRayDistance
 
 
 class IncrementTime:
@@ -232,6 +243,92 @@ class BasicTest(unittest.TestCase):
         assert triple_memid in memids
         assert robert_memid not in memids
 
+    def test_compiled_search(self):
+        self.memory = AgentMemory()
+        SelfNode.create(
+            self.memory, Player(1, "robot", Pos(0, 0, 0), Look(0, 0)), memid=self.memory.self_memid
+        )
+        rachel_memid = PlayerNode.create(
+            self.memory, Player(10, "rachel", Pos(1, 0, 1), Look(0, 0))
+        )
+        robert_memid = PlayerNode.create(
+            self.memory, Player(11, "robert", Pos(4, 0, 5), Look(0, 0))
+        )
+        sam_memid = PlayerNode.create(self.memory, Player(12, "sam", Pos(-2, 0, 5), Look(0, 0)))
+        self.memory.tag(subj_memid=rachel_memid, tag_text="girl")
+        self.memory.tag(subj_memid=sam_memid, tag_text="girl")
+        self.memory.tag(subj_memid=sam_memid, tag_text="plays_volleyball")
+        TripleNode.create(self.memory, subj=sam_memid, pred_text="mother_of", obj=robert_memid)
+
+        queries = [
+            "SELECT MEMORY FROM ReferenceObject WHERE (NOT has_tag=girl)",
+            "SELECT MEMORY FROM ReferenceObject WHERE ((has_tag=plays_volleyball) OR (NOT has_tag=girl))",
+            "SELECT (x, y) FROM ReferenceObject WHERE ((has_tag=plays_volleyball) AND (x<0))",
+            "SELECT MEMORY FROM ReferenceObject WHERE <<#{}, mother_of, ?>>".format(sam_memid),
+            "SELECT MEMORY FROM ReferenceObject WHERE <<?, mother_of, #{}>>".format(robert_memid),
+            "SELECT MEMORY FROM Triple WHERE create_time > -100",
+            "SELECT COUNT FROM ReferenceObject WHERE name=sam",
+            # None values are not searched on
+            {
+                "output": "MEMORY",
+                "memory_type": "ReferenceObject",
+                "where_clause": {"pred_text": "has_tag", "obj_text": "girl", "subj": None},
+            },
+        ]
+        m = MemorySearcher()
+        compiler = self.memory.query_compiler
+        for query in queries:
+            memids, vals = m.search(self.memory, query=query)
+            self.memory.query_compiler = None
+            python_memids, python_vals = m.search(self.memory, query=query)
+            self.memory.query_compiler = compiler
+            assert set(memids) == set(python_memids)
+            assert len(memids) == len(python_memids)
+        memids, _ = m.search(self.memory, query=queries[-1])
+        assert set(memids) == set([rachel_memid, sam_memid])
+
+        # queries differing only in values share a plan
+        num_plans = len(compiler.plans)
+        memids, _ = m.search(self.memory, query="SELECT MEMORY FROM ReferenceObject WHERE x<2")
+        assert set(memids) == set([rachel_memid, sam_memid, self.memory.self_memid])
+        memids, _ = m.search(self.memory, query="SELECT MEMORY FROM ReferenceObject WHERE x<0")
+        assert memids == [sam_memid]
+        assert len(compiler.plans) == num_plans + 1
+
+        # a query without a memory_type is planned for each default_memtype
+        query = "SELECT MEMORY WHERE create_time > -100"
+        memids, _ = m.search(self.memory, query=query, default_memtype="ReferenceObject")
+        assert rachel_memid in memids
+        memids, _ = m.search(self.memory, query=query, default_memtype="Triple")
+        assert all([type(self.memory.get_mem_by_id(m)) is TripleNode for m in memids])
+        assert rachel_memid not in memids
+
+    def test_batched_property_values(self):
+        self.memory = AgentMemory()
+        joe_memid = PlayerNode.create(self.memory, Player(10, "joe", Pos(1, 0, 1), Look(0, 0)))
+        jane_memid = PlayerNode.create(self.memory, Player(11, "jane", Pos(-1, 0, 1), Look(0, 0)))
+        loc_memid = LocationNode.create(self.memory, (0, 2, 0))
+        chat_memid = ChatNode.create(self.memory, speaker=joe_memid, chat="hi there!")
+        self.memory.tag(joe_memid, "tall")
+        self.memory.tag(joe_memid, "happy")
+        memids = [joe_memid, chat_memid, jane_memid, loc_memid, joe_memid]
+
+        assert filter_memids_by_nodetype(self.memory, memids, "ReferenceObject") == [
+            joe_memid,
+            jane_memid,
+            loc_memid,
+            joe_memid,
+        ]
+        for prop in ["node_type", "x", "chat", "has_tag"]:
+            for get_all in [False, True]:
+                vals = get_property_values(self.memory, memids, prop, get_all=get_all)
+                assert vals == [
+                    get_property_value(self.memory, m, prop, get_all=get_all) for m in memids
+                ]
+        tags = get_property_values(self.memory, [joe_memid], "has_tag", get_all=True)[0]
+        assert "tall" in tags and "happy" in tags
+        assert self.memory.get_table_columns("Chats") == ["uuid", "speaker", "chat", "time"]
+
     def test_chat_apis_memory(self):
         self.memory = AgentMemory()
         # Test add_chat
@@ -316,6 +413,111 @@ class BasicTest(unittest.TestCase):
         triples = self.memory.get_triples(subj=jane_memid, pred_text="sister_of")
         assert len(triples) == 0
 
+    def test_batch(self):
+        deleted = []
+        self.memory = AgentMemory(agent_time=self.time, on_delete_callback=deleted.extend)
+        joe_memid = PlayerNode.create(self.memory, Player(10, "joe", Pos(1, 0, 1), Look(0, 0)))
+        jane_memid = PlayerNode.create(self.memory, Player(11, "jane", Pos(-1, 0, 1), Look(0, 0)))
+        cmd = "SELECT updated_time FROM Memories WHERE uuid=?"
+
+        self.time.add_tick()
+        with self.memory.batch():
+            self.memory.db_write("UPDATE ReferenceObjects SET x=? WHERE uuid=?", 2, joe_memid)
+            with self.memory.batch():
+                self.memory.tag(jane_memid, "tall")
+            # writes are visible inside the batch, bookkeeping is deferred
+            assert self.memory._db_read("SELECT x FROM ReferenceObjects WHERE uuid=?", joe_memid)
+            assert self.memory._db_read(cmd, joe_memid)[0][0] == 0
+            assert len(self.memory._db_read("SELECT * FROM Updates")) > 0
+            self.memory.forget(jane_memid)
+            assert deleted == []
+        assert self.memory._db_read(cmd, joe_memid)[0][0] == 1
+        assert jane_memid in deleted
+        assert len(self.memory._db_read("SELECT * FROM Updates")) == 0
+
+        # a failing batch is rolled back
+        try:
+            with self.memory.batch():
+                self.memory.db_write("UPDATE ReferenceObjects SET x=? WHERE uuid=?", 5, joe_memid)
+                raise ValueError
+        except ValueError:
+            pass
+        x = self.memory._db_read_one("SELECT x FROM ReferenceObjects WHERE uuid=?", joe_memid)
+        assert x[0] == 2
+
+    def test_db_write_many(self):
+        self.memory = AgentMemory(agent_time=self.time)
+        joe_memid = PlayerNode.create(self.memory, Player(10, "joe", Pos(1, 0, 1), Look(0, 0)))
+        jane_memid = PlayerNode.create(self.memory, Player(11, "jane", Pos(-1, 0, 1), Look(0, 0)))
+        self.time.add_tick()
+        n = self.memory.db_write_many(
+            "UPDATE ReferenceObjects SET x=? WHERE uuid=?", [(3, joe_memid), (4, jane_memid)]
+        )
+        assert n == 2
+        cmd = "SELECT x, updated_time FROM ReferenceObjects INNER JOIN Memories ON ReferenceObjects.uuid=Memories.uuid WHERE ReferenceObjects.uuid=?"
+        assert self.memory._db_read_one(cmd, joe_memid) == (3, 1)
+        assert self.memory._db_read_one(cmd, jane_memid) == (4, 1)
+
+        # a failing row rolls back the rows before it
+        cmd = (
+            "INSERT INTO Memories (uuid, node_type, create_time, updated_time) VALUES (?, ?, ?, ?)"
+        )
+        try:
+            self.memory.db_write_many(cmd, [("new", "Player", 1, 1), (joe_memid, "Player", 1, 1)])
+        except sqlite3.IntegrityError:
+            pass
+        self.memory.tag(jane_memid, "tall")
+        assert not self.memory._db_read("SELECT uuid FROM Memories WHERE uuid=?", "new")
+
+    def test_vectorized_attributes(self):
+        self.memory = AgentMemory(agent_time=self.time, coordinate_transforms=rotation)
+        self.memory.db_write(
+            "INSERT INTO ReferenceObjects(uuid, eid, x, y, z, yaw, pitch, ref_type) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            self.memory.self_memid,
+            1,
+            0,
+            0,
+            0,
+            0.3,
+            0.1,
+            "self",
+        )
+        xs = [3, -2, 5, 0, 1]
+        memids = [
+            PlayerNode.create(self.memory, Player(10 + i, str(i), Pos(x, 1, 2 * x), Look(0, 0)))
+            for i, x in enumerate(xs)
+        ]
+        memids.append(LocationNode.create(self.memory, (4, 0, -4)))
+        positions = get_positions(self.memory, memids + ["not_a_memid"])
+        assert positions[1].tolist() == [-2, 1, -4]
+        assert positions[5].tolist() == [4, 0, -4]
+        assert np.isnan(positions[6]).all()
+
+        mems = [self.memory.get_mem_by_id(m) for m in memids]
+        for reldir in ["AWAY", "LEFT", "UP"]:
+            a = LinearExtentAttribute(
+                self.memory,
+                {"relative_direction": reldir},
+                mem=self.memory.get_mem_by_id(memids[3]),
+            )
+            assert np.allclose(a.from_memids(memids), a(mems), equal_nan=True)
+        a = LookRayDistance(self.memory, 1)
+        assert np.allclose(a.from_memids(memids), a(mems))
+
+        # the array and python comparisons agree
+        a = LinearExtentAttribute(self.memory, {"relative_direction": "AWAY"}, mem=mems[3])
+        python_a = lambda mems: a(mems)
+        for value, symbol in [((5.0,), "<"), ((5.0,), ">="), ((2.0, 7.0), "<>")]:
+            fast = search_by_attribute(self.memory, a, value, symbol, "ReferenceObject")
+            slow = search_by_attribute(self.memory, python_a, value, symbol, "ReferenceObject")
+            assert set(fast) == set(slow)
+            assert len(fast) > 0
+
+        values = [3.0, None, -1.0, 7.0, 3.0]
+        assert argval_subsample_idx(values, 2, polarity="MAX") == [3, 0]
+        assert argval_subsample_idx(values, 1, polarity="MIN") == [2]
+        assert argval_subsample_idx(values, 10, polarity="MIN") == [2, 0, 4, 3, 1]
+
 
 class PlaceFieldTest(unittest.TestCase):
     def test_place_field(self):
@@ -331,7 +533,7 @@ class PlaceFieldTest(unittest.TestCase):
         changes = [{"pos": joe_loc, "memid": joe_memid}, {"pos": jane_loc, "memid": jane_memid}]
         changes.extend(wall_locs)
         PF.update_map(changes)
-        assert PF.maps[0]["map"].sum() == 7
+        assert PF.maps[0].sum("map") == 7
         jl = PF.memid2locs[joe_memid]
         assert len(jl) == 1
         recovered_pos = tuple(int(i) for i in PF.map2real(*PF.idx2ijh(list(jl.keys())[0])))
@@ -348,7 +550,61 @@ class PlaceFieldTest(unittest.TestCase):
         assert len(jl) == 1
         recovered_pos = tuple(int(i) for i in PF.map2real(*PF.idx2ijh(list(jl.keys())[0])))
         assert recovered_pos == (new_jane_x, new_jane_z)
-        assert PF.maps[0]["map"].sum() == 6
+        assert PF.maps[0].sum("map") == 6
+
+    def test_tiles_and_slices(self):
+        memory = AgentMemory(place_field_slice_height=1.0)
+        PF = memory.place_field
+        # far apart points only allocate the tiles they are in
+        xyz = np.array([(-500.0, 0.2, 300.0), (0.0, 0.5, 0.0), (400.0, 2.5, -700.0)])
+        PF.add_locs(xyz, memids=["NULL", memory.self_memid, "NULL"])
+        assert sorted(PF.maps.keys()) == [0, 2]
+        assert len(PF.maps[0].tiles) == 2
+        assert PF.maps[0].nbytes() < 100000
+        assert PF.maps[0].sum("map") == 2 and PF.maps[2].sum("map") == 1
+        assert set(PF.get_obstacle_list(h=2)) == {(400.0, -700.0)}
+        i, j = PF.real2map(0.0, 0.0, 0)
+        assert PF.index2memid[PF.maps[0].get(i, j, "memids")] == memory.self_memid
+
+        # bulk changes match one-at-a-time changes
+        memory2 = AgentMemory(place_field_slice_height=1.0)
+        PF2 = memory2.place_field
+        PF2.add_locs(xyz, memids=["NULL", memory2.self_memid, "NULL"])
+        changes = [{"pos": tuple(p), "is_obstacle": k % 2} for k, p in enumerate(xyz)]
+        changes.append({"pos": (0.0, 0.5, 0.0), "is_delete": True})
+        PF.update_map(changes)
+        for c in changes:
+            PF2.update_map([c])
+        for h in PF.maps:
+            for k, tile in PF.maps[h].tiles.items():
+                for layer in ["map", "memids"]:
+                    assert (tile[layer] == PF2.maps[h].tiles[k][layer]).all()
+        assert PF.memid2locs["NULL"] == PF2.memid2locs["NULL"]
+
+    def test_examined_index(self):
+        PF = AgentMemory().place_field
+        rng = np.random.RandomState(0)
+        points = [tuple(p) for p in np.round(rng.uniform(-30, 30, (2000, 3)), 1).tolist()]
+        for p in points:
+            PF.get_closest(p)
+        examined = list(PF.examined.keys())
+        for p in points[:200]:
+            # same answer as a scan in insertion order
+            best, dist = None, 1.5
+            for k in examined:
+                d = abs(k[0] - p[0]) + abs(k[2] - p[2])
+                if d < dist:
+                    best, dist = k, d
+            assert PF.get_closest(p) == best
+        assert len(PF.examined) == len(examined)
+
+        x = {"xyz": points[0], "eid": 0, "label": "chair"}
+        assert PF.can_examine(x)
+        PF.update(x)
+        # just examined
+        assert not PF.can_examine(x)
+        PF.clear_examined()
+        assert PF.can_examine(x)
 
 
 if __name__ == "__main__":
@@ -2,30 +2,78 @@
 Copyright (c) Facebook, Inc. and its affiliates.
 """
 
-import heapq
 import math
 import numpy as np
+from collections import OrderedDict
+from scipy import ndimage
 from scipy.ndimage.filters import median_filter
-from scipy.optimize import linprog
+from scipy.spatial import Delaunay
 from copy import deepcopy
 import logging
-from droidlet.base_util import depth_first_search, to_block_pos, manhat_dist, euclid_dist
+from droidlet.base_util import to_block_pos, manhat_dist, euclid_dist
 from droidlet.shared_data_struct.craftassist_shared_utils import CraftAssistPerceptionData
 
 GROUND_BLOCKS = [1, 2, 3, 7, 8, 9, 12, 79, 80]
 MAX_RADIUS = 20
+MOBILE_BLOCK_ID = 383  # agents, speakers and mobs
+HOLE_CACHE_SIZE = 64
+HOLE_RIM_STRUCTURE = ndimage.generate_binary_structure(2, 1)
+CONNECTIVITY_STRUCTURES = {
+    6: ndimage.generate_binary_structure(3, 1),
+    26: ndimage.generate_binary_structure(3, 3),
+}
+
+
+class HullContainment:
+    """Tests points for containment in the convex hull of a point set.
+
+    The hull is triangulated once, so any number of points can be tested in one
+    vectorized call.  If the point set is degenerate (e.g. coplanar or collinear), the
+    check is done in the plane, line or point the set spans.
+
+    Args:
+        points (array): an (n, d) array of points
+        tol (float): distance below which a point counts as on the hull
+    """
+
+    def __init__(self, points, tol=1e-8):
+        points = np.asarray(points, dtype="float64")
+        self.tol = tol
+        self.origin = points.mean(axis=0)
+        centered = points - self.origin
+        # the basis of the affine subspace spanned by the points
+        _, sv, vt = np.linalg.svd(centered, full_matrices=False)
+        rank = int((sv > tol * max(1.0, sv[0] if len(sv) else 0.0)).sum())
+        self.basis = vt[:rank]
+        projected = centered @ self.basis.T
+        self.delaunay = None
+        if rank >= 2:
+            self.delaunay = Delaunay(projected)
+        elif rank == 1:
+            self.interval = (projected.min(), projected.max())
+
+    def contains(self, xs):
+        """returns a bool array, True for the rows of xs in the hull"""
+        centered = np.atleast_2d(np.asarray(xs, dtype="float64")) - self.origin
+        projected = centered @ self.basis.T
+        # distance off the subspace spanned by the points
+        residual = np.linalg.norm(centered - projected @ self.basis, axis=1)
+        inside = residual <= self.tol
+        if self.delaunay is not None:
+            inside &= self.delaunay.find_simplex(projected, tol=self.tol) >= 0
+        elif len(self.basis) == 1:
+            lo, hi = self.interval
+            inside &= (projected[:, 0] >= lo - self.tol) & (projected[:, 0] <= hi + self.tol)
+        return inside
 
 
-# Taken from : stackoverflow.com/questions/16750618/
-# whats-an-efficient-way-to-find-if-a-point-lies-in-the-convex-hull-of-a-point-cl
 def in_hull(points, x):
-    """Check if x is in the convex hull of points"""
-    n_points = len(points)
-    c = np.zeros(n_points)
-    A = np.r_[points.T, np.ones((1, n_points))]
-    b = np.r_[x, np.ones(1)]
-    lp = linprog(c, A_eq=A, b_eq=b)
-    return lp.success
+    """Check if x is in the convex hull of points.  If x is an (n, d) array of points,
+    returns an array with the check for each of them"""
+    inside = HullContainment(points).contains(x)
+    if np.ndim(x) == 1:
+        return bool(inside[0])
+    return inside
 
 
 def all_nearby_objects(get_blocks, pos, boring_blocks, passable_blocks, max_radius=MAX_RADIUS):
@@ -39,12 +87,13 @@ def all_nearby_objects(get_blocks, pos, boring_blocks, passable_blocks, max_radi
     mask, off, blocks = all_close_interesting_blocks(
         get_blocks, pos, boring_blocks, passable_blocks, max_radius
     )
-    components = connected_components(mask)
+    _, _, _, components = segment(mask)
     logging.debug("all_nearby_objects found {} objects near {}".format(len(components), pos))
-    xyzbms = [
-        [((c[2] + off[2], c[0] + off[0], c[1] + off[1]), tuple(blocks[c])) for c in component_yzxs]
-        for component_yzxs in components
-    ]
+    xyzbms = []
+    for yzxs in components:
+        xyzs = (yzxs[:, [2, 0, 1]] + [off[2], off[0], off[1]]).tolist()
+        idms = blocks[yzxs[:, 0], yzxs[:, 1], yzxs[:, 2]].tolist()
+        xyzbms.append([(tuple(xyz), tuple(idm)) for xyz, idm in zip(xyzs, idms)])
     return xyzbms
 
 
@@ -84,16 +133,11 @@ def accessible_interesting_blocks(blocks, pos, boring_blocks, passable_blocks):
     passable = np.isin(blocks, passable_blocks)
     interesting = np.isin(blocks, boring_blocks, invert=True)
     passable_or_interesting = passable | interesting
-    X = np.zeros_like(passable)
-
-    def _fn(p):
-        if passable_or_interesting[p]:
-            X[p] = True
-            return True
-        return False
-
-    depth_first_search(blocks.shape[:3], pos, _fn)
-    return X & interesting
+    labels, _ = ndimage.label(passable_or_interesting, CONNECTIVITY_STRUCTURES[6])
+    label = labels[tuple(pos)]
+    if label == 0:
+        return np.zeros_like(passable)
+    return (labels == label) & interesting
 
 
 def find_closest_component(mask, relpos):
@@ -113,99 +157,155 @@ def find_closest_component(mask, relpos):
     return components[np.argmin(dists)]
 
 
-def connected_components(X, unique_idm=False):
-    """Find all connected nonzero components in a array X.
+def label_components(X, unique_idm=False, connectivity=26):
+    """Label the connected nonzero components of an array X in one pass.
     X is either rank 3 (volume) or rank 4 (volume-idm)
     If unique_idm == True, different block types are different
     components
+    connectivity is 6 (faces) or 26 (faces, edges and corners)
 
-    Returns a list of lists of indices of connected components
+    Returns (labels, num): an int array with X's volume shape, 0 where X is air and
+    1...num on the components, numbered in order of their first voxel
     """
-    visited = np.zeros((X.shape[0], X.shape[1], X.shape[2]), dtype="bool")
-    components = []
-    current_component = set()
-    diag_adj = build_safe_diag_adjacent([0, X.shape[0], 0, X.shape[1], 0, X.shape[2]])
-
+    if connectivity not in CONNECTIVITY_STRUCTURES:
+        raise ValueError("connectivity should be 6 or 26, got {}".format(connectivity))
+    structure = CONNECTIVITY_STRUCTURES[connectivity]
     if len(X.shape) == 3:
         X = np.expand_dims(X, axis=3)
+    nonzero = X[:, :, :, 0] != 0
+    if not unique_idm or not nonzero.any():
+        return ndimage.label(nonzero, structure)
+
+    # label each block type within its bounding box
+    idms = X[nonzero].astype("int64")
+    keys = idms[:, 0]
+    for c in range(1, idms.shape[1]):
+        keys = keys * (idms[:, c].max() + 1) + idms[:, c]
+    _, types = np.unique(keys, return_inverse=True)
+    type_map = np.zeros(nonzero.shape, dtype="int32")
+    type_map[nonzero] = types.reshape(-1) + 1
+    labels = np.zeros(nonzero.shape, dtype="int32")
+    num = 0
+    for t, box in enumerate(ndimage.find_objects(type_map), start=1):
+        if box is None:
+            continue
+        type_labels, n = ndimage.label(type_map[box] == t, structure)
+        in_type = type_labels > 0
+        labels[box][in_type] = type_labels[in_type] + num
+        num += n
 
-    def is_air(X, i, j, k):
-        return X[i, j, k, 0] == 0
-
-    if not unique_idm:
-
-        def _build_fn(X, current_component, idm):
-            def _fn(p):
-                if X[p[0], p[1], p[2], 0]:
-                    current_component.add(p)
-                    return True
+    # renumber in order of first voxel, as ndimage.label does
+    flat = labels.reshape(-1)
+    _, first = np.unique(flat[np.flatnonzero(flat)], return_index=True)
+    order = np.zeros(num + 1, dtype="int32")
+    order[np.argsort(first) + 1] = np.arange(1, num + 1)
+    return order[labels], num
 
-            return _fn
 
-    else:
+def segment(X, unique_idm=False, connectivity=26):
+    """Segment an array X into its connected nonzero components, see label_components.
 
-        def _build_fn(X, current_component, idm):
-            def _fn(p):
-                if tuple(X[p]) == idm:
-                    current_component.add(p)
-                    return True
+    Returns (labels, sizes, bounds, voxels), where for the component labeled i + 1
+    sizes[i] is its number of voxels, bounds[i] a tuple of slices of its bounding box,
+    and voxels[i] an (n, 3) int array of its indices.
+    """
+    labels, num = label_components(X, unique_idm, connectivity)
+    flat = labels.reshape(-1)
+    idx = np.flatnonzero(flat)
+    idx = idx[np.argsort(flat[idx], kind="stable")]
+    sizes = np.bincount(flat[idx], minlength=num + 1)[1:]
+    voxels = np.split(np.stack(np.unravel_index(idx, labels.shape), axis=1), np.cumsum(sizes)[:-1])
+    if num == 0:
+        voxels = []
+    bounds = ndimage.find_objects(labels, num)
+    return labels, sizes, bounds, voxels
+
+
+def connected_components(X, unique_idm=False, connectivity=26):
+    """Find all connected nonzero components in a array X.
+    X is either rank 3 (volume) or rank 4 (volume-idm)
+    If unique_idm == True, different block types are different
+    components
 
-            return _fn
+    Returns a list of lists of indices of connected components
+    """
+    _, _, _, voxels = segment(X, unique_idm, connectivity)
+    return [list(map(tuple, v.tolist())) for v in voxels]
 
-    for i in range(visited.shape[0]):
-        for j in range(visited.shape[1]):
-            for k in range(visited.shape[2]):
-                if visited[i, j, k]:
-                    continue
-                visited[i, j, k] = True
-                if is_air(X, i, j, k):
-                    continue
-                # found a new component
-                pos = (i, j, k)
-                _fn = _build_fn(X, current_component, tuple(X[i, j, k, :]))
-                visited |= depth_first_search(X.shape[:3], pos, _fn, diag_adj)
-                components.append(list(current_component))
-                current_component.clear()
 
-    return components
+def fat_bounding_locs(l, fat):
+    """the max and min cardinal points of locs l, pushed out by fat"""
+    if len(l) <= 1:
+        return np.array(l)
+    bl = []
+    idx = np.argmax(l, axis=0)
+    for i in range(3):
+        bl.append(np.array(l[idx[i]]) + fat)
+    idx = np.argmin(l, axis=0)
+    for i in range(3):
+        bl.append(np.array(l[idx[i]]) - fat)
+    return np.vstack(bl)
 
 
 def check_between(entities, get_locs_from_entity, fat_scale=0.2):
     """Heuristic check if entities[0] is between entities[1] and entities[2]
     by checking if the locs of enitity[0] are in the convex hull of
     union of the max cardinal points of entity[1] and entity[2]"""
-    locs = []
-    means = []
-    for e in entities:
-        l = get_locs_from_entity(e)
-        if l is not None:
-            locs.append(l)
-            means.append(np.mean(l, axis=0))
-        else:
-            # this is not a thing we know how to assign 'between' to
-            return False
-    mean_separation = euclid_dist(means[1], means[2])
+    return find_between(entities[:1], entities[1:], get_locs_from_entity, fat_scale)[0]
+
+
+def find_between(candidates, entities, get_locs_from_entity, fat_scale=0.2):
+    """Heuristic check of which of the candidates are between entities[0] and entities[1],
+    see check_between.  The hull of the two entities is built once for all the candidates.
+
+    Returns a list of bools, one for each candidate
+    """
+    end_locs = [get_locs_from_entity(e) for e in entities]
+    if any(l is None for l in end_locs):
+        # this is not a thing we know how to assign 'between' to
+        return [False] * len(candidates)
+    mean_separation = euclid_dist(np.mean(end_locs[0], axis=0), np.mean(end_locs[1], axis=0))
     fat = fat_scale * mean_separation
-    bounding_locs = []
-    for l in locs:
-        if len(l) > 1:
-            bl = []
-            idx = np.argmax(l, axis=0)
-            for i in range(3):
-                f = np.zeros(3)
-                f[i] = fat
-                bl.append(np.array(l[idx[i]]) + fat)
-            idx = np.argmin(l, axis=0)
-            for i in range(3):
-                f = np.zeros(3)
-                f[i] = fat
-                bl.append(np.array(l[idx[i]]) - fat)
-            bounding_locs.append(np.vstack(bl))
-        else:
-            bounding_locs.append(np.array(l))
-    x = np.mean(bounding_locs[0], axis=0)
-    points = np.vstack([bounding_locs[1], bounding_locs[2]])
-    return in_hull(points, x)
+    points = np.vstack([fat_bounding_locs(l, fat) for l in end_locs])
+
+    centers = []
+    for c in candidates:
+        l = get_locs_from_entity(c)
+        centers.append(None if l is None else np.mean(fat_bounding_locs(l, fat), axis=0))
+    known = [i for i, x in enumerate(centers) if x is not None]
+    between = [False] * len(candidates)
+    if known:
+        inside = HullContainment(points).contains(np.vstack([centers[i] for i in known]))
+        for i, b in zip(known, inside):
+            between[i] = bool(b)
+    return between
+
+
+def strictly_between_on_line(points, locs, axis):
+    """For each of points, whether there are locs on both sides of it along the line
+    through it parallel to axis"""
+    other = [a for a in range(3) if a != axis]
+    _, line = np.unique(np.vstack([locs[:, other], points[:, other]]), axis=0, return_inverse=True)
+    line = line.reshape(-1)
+    num_lines = line.max() + 1
+    lo = np.full(num_lines, np.inf)
+    hi = np.full(num_lines, -np.inf)
+    np.minimum.at(lo, line[: len(locs)], locs[:, axis])
+    np.maximum.at(hi, line[: len(locs)], locs[:, axis])
+    point_line = line[len(locs) :]
+    return (lo[point_line] < points[:, axis]) & (points[:, axis] < hi[point_line])
+
+
+def inside_mask(points, locs):
+    """Vectorized check_inside: for each of points, whether it is inside the locs.
+    A point is inside if in one of the 3 axis-aligned planes through it, the locs
+    are on both sides of it along both axes of the plane"""
+    points = np.asarray(points, dtype="float64").reshape(-1, 3)
+    locs = np.asarray(locs, dtype="float64").reshape(-1, 3)
+    if len(points) == 0 or len(locs) == 0:
+        return np.zeros(len(points), dtype="bool")
+    between = [strictly_between_on_line(points, locs, axis) for axis in range(3)]
+    return (between[0] & between[1]) | (between[1] & between[2]) | (between[2] & between[0])
 
 
 def check_inside(entities, get_locs_from_entity):
@@ -223,28 +323,12 @@ def check_inside(entities, get_locs_from_entity):
         else:
             # this is not a thing we know how to assign 'inside' to
             return False
-    for b in locs[0]:
-        for i in range(3):
-            inside = True
-            coplanar = [c for c in locs[1] if c[i] == b[i]]
-            for j in range(2):
-                fixed = (i + 2 * j - 1) % 3
-                to_check = (i + 1 - 2 * j) % 3
-                colin = [c[to_check] for c in coplanar if c[fixed] == b[fixed]]
-                if len(colin) == 0:
-                    inside = False
-                else:
-                    if max(colin) <= b[to_check] or min(colin) >= b[to_check]:
-                        inside = False
-            if inside:
-                return True
-    return False
+    return bool(inside_mask(locs[0], locs[1]).any())
 
 
 def find_inside(entity, get_locs_from_entity):
     """Return a point inside the entity if it can find one.
-    TODO: heuristic quick check to find that there aren't any,
-    and maybe make this not d^3"""
+    TODO: heuristic quick check to find that there aren't any"""
 
     # is this a negative object? if yes, just return its mean:
     if hasattr(entity, "blocks"):
@@ -257,12 +341,10 @@ def find_inside(entity, get_locs_from_entity):
     m = np.round(np.mean(l, axis=0))
     maxes = np.max(l, axis=0)
     mins = np.min(l, axis=0)
-    inside = []
-    for x in range(mins[0], maxes[0] + 1):
-        for y in range(mins[1], maxes[1] + 1):
-            for z in range(mins[2], maxes[2] + 1):
-                if check_inside([(x, y, z), entity], get_locs_from_entity):
-                    inside.append((x, y, z))
+    grid = np.stack(
+        np.meshgrid(*[np.arange(mins[i], maxes[i] + 1) for i in range(3)], indexing="ij"), axis=-1
+    ).reshape(-1, 3)
+    inside = [tuple(p) for p in grid[inside_mask(grid, l)].tolist()]
     return sorted(inside, key=lambda x: euclid_dist(x, m))
 
 
@@ -382,104 +464,117 @@ def get_nearby_airtouching_blocks(
     return blocktypes, all_components, all_tags
 
 
+class HoleCache:
+    """Holes found by get_all_nearby_holes, keyed by the query and the blocks of the
+    window the holes were found in, so they are only recomputed after a block in the
+    window changes.  Keeps the most recently used maxsize windows."""
+
+    def __init__(self, maxsize=HOLE_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.data = OrderedDict()
+
+    def get(self, key, blocks):
+        entry = self.data.get(key)
+        if entry is None or entry[0] != blocks.shape or entry[1] != blocks.tobytes():
+            return None
+        self.data.move_to_end(key)
+        return deepcopy(entry[2])
+
+    def put(self, key, blocks, holes):
+        self.data[key] = (blocks.shape, blocks.tobytes(), deepcopy(holes))
+        self.data.move_to_end(key)
+        if len(self.data) > self.maxsize:
+            self.data.popitem(last=False)
+
+
+HOLE_CACHE = HoleCache()
+
+
+def find_holes(yzxb, origin, max_height, ignore_positions=()):
+    """Find the holes in a window of blocks yzxb whose lowest corner is at origin.
+
+    The ground height of each column is its highest block, not counting mobile blocks
+    (agents, speakers, mobs) or any of ignore_positions.  A hole is a 4-connected set of
+    columns that would hold water: its water level is the lowest height a path to the
+    edge of the window has to climb over, capped at max_height.
+
+    Returns a list of (list of air (x, y, z) below the water level, idm of the most
+    common block on the rim of the hole)
+    """
+    ox, oy, oz = origin
+    ny = yzxb.shape[0]
+    solid = (yzxb[:, :, :, 0] != 0) & (yzxb[:, :, :, 0] != MOBILE_BLOCK_ID)
+    for x, y, z in ignore_positions:
+        y, z, x = int(y) - oy, int(z) - oz, int(x) - ox
+        if 0 <= y < ny and 0 <= z < solid.shape[1] and 0 <= x < solid.shape[2]:
+            solid[y, z, x] = False
+
+    # ground height map, in xz order.  an empty column is taken as a deep one
+    top = ny - 1 - np.argmax(solid[::-1], axis=0)
+    has_ground = solid.any(axis=0)
+    heights = np.where(has_ground, top + oy, oy - 1).T
+    zs, xs = np.indices(top.shape)
+    idms = np.where(has_ground[:, :, None], yzxb[top, zs, xs], 0).transpose([1, 0, 2])
+
+    # water level, by relaxing from the cap down: level = max(height, min(neighbour levels)),
+    # with the edge columns draining the window
+    level = np.maximum(heights, max_height)
+    level[[0, -1], :] = heights[[0, -1], :]
+    level[:, [0, -1]] = heights[:, [0, -1]]
+    while True:
+        lowest = level.copy()
+        np.minimum(lowest[1:, :], level[:-1, :], out=lowest[1:, :])
+        np.minimum(lowest[:-1, :], level[1:, :], out=lowest[:-1, :])
+        np.minimum(lowest[:, 1:], level[:, :-1], out=lowest[:, 1:])
+        np.minimum(lowest[:, :-1], level[:, 1:], out=lowest[:, :-1])
+        new_level = np.maximum(heights, lowest)
+        if (new_level == level).all():
+            break
+        level = new_level
+
+    wet = level > heights
+    labels, _ = ndimage.label(wet)
+    holes = []
+    for i, box in enumerate(ndimage.find_objects(labels), start=1):
+        # the rim is the columns next to the hole
+        box = tuple(slice(max(b.start - 1, 0), b.stop + 1) for b in box)
+        hole = labels[box] == i
+        rim = ndimage.binary_dilation(hole, HOLE_RIM_STRUCTURE) & ~hole
+        rim_idms, counts = np.unique(idms[box][rim], axis=0, return_counts=True)
+        idm = tuple(rim_idms[np.argmax(counts)].tolist()) if len(counts) > 0 else (2, 0)
+
+        xyzs = []
+        for x, z in np.argwhere(hole):
+            x, z = x + box[0].start, z + box[1].start
+            for y in range(heights[x, z] + 1, level[x, z] + 1):
+                # only air is filled
+                if yzxb[y - oy, z, x, 0] == 0:
+                    xyzs.append((int(x + ox), int(y), int(z + oz)))
+        if xyzs:
+            holes.append((xyzs, idm))
+    return holes
+
+
 def get_all_nearby_holes(agent, location, block_data, fill_idmeta, radius=15, store_inst_seg=True):
     """Returns:
-    a list of holes. Each hole is an InstSegNode"""
-    sx, sy, sz = location
+    a list of holes. Each hole is a (list of (x, y, z), idm) pair, of the air blocks
+    in the hole and the block type to fill it with.
+
+    The blocks around location are fetched once, from radius below location to 5 above;
+    results are reused (see HoleCache) until a block in that window changes
+    """
+    sx, sy, sz = (int(c) for c in location)
     max_height = sy + 5
-    map_size = radius * 2 + 1
-    height_map = [[sz] * map_size for i in range(map_size)]
-    hid_map = [[-1] * map_size for i in range(map_size)]
-    idm_map = [[(0, 0)] * map_size for i in range(map_size)]
-    visited = set([])
-    global current_connected_comp, current_idm
-    current_connected_comp = []
-    current_idm = (2, 0)
-
-    # utility functions
-    def get_block_info(x, z):  # fudge factor 5
-        height = max_height
-        while True:
-            B = agent.get_blocks(x, x, height, height, z, z)
-            if (
-                (B[0, 0, 0, 0] != 0)
-                and (x != sx or z != sz or height != sy)
-                and (x != agent.pos[0] or z != agent.pos[2] or height != agent.pos[1])
-                and (B[0, 0, 0, 0] != 383)
-            ):  # if it's not a mobile block (agent, speaker, mobs)
-                return height, tuple(B[0, 0, 0])
-            height -= 1
-
-    gx = [0, 0, -1, 1]
-    gz = [1, -1, 0, 0]
-
-    def dfs(x, y, z):
-        """Traverse current connected component and return minimum
-        height of all surrounding blocks"""
-        build_height = 100000
-        if (x, y, z) in visited:
-            return build_height
-        global current_connected_comp, current_idm
-        current_connected_comp.append((x - radius + sx, y, z - radius + sz))  # absolute positions
-        visited.add((x, y, z))
-        for d in range(4):
-            nx = x + gx[d]
-            nz = z + gz[d]
-            if nx >= 0 and nz >= 0 and nx < map_size and nz < map_size:
-                if height_map[x][z] == height_map[nx][nz]:
-                    build_height = min(build_height, dfs(nx, y, nz))
-                else:
-                    build_height = min(build_height, height_map[nx][nz])
-                    current_idm = idm_map[nx][nz]
-            else:
-                # bad ... hole is not within defined radius
-                return -100000
-        return build_height
-
-    # find all holes
-    blocks_queue = []
-    for i in range(map_size):
-        for j in range(map_size):
-            height_map[i][j], idm_map[i][j] = get_block_info(i - radius + sx, j - radius + sz)
-            heapq.heappush(blocks_queue, (height_map[i][j] + 1, (i, height_map[i][j] + 1, j)))
-    holes = []
-    while len(blocks_queue) > 0:
-        hxyz = heapq.heappop(blocks_queue)
-        h, (x, y, z) = hxyz  # NB: relative positions
-        if (x, y, z) in visited or y > max_height:
-            continue
-        assert h == height_map[x][z] + 1, " h=%d heightmap=%d, x,z=%d,%d" % (
-            h,
-            height_map[x][z],
-            x,
-            z,
-        )  # sanity check
-        current_connected_comp = []
-        current_idm = (2, 0)
-        build_height = dfs(x, y, z)
-        if build_height >= h:
-            holes.append((current_connected_comp.copy(), current_idm))
-            cur_hid = len(holes) - 1
-            for n, xyz in enumerate(current_connected_comp):
-                x, y, z = xyz
-                rx, ry, rz = x - sx + radius, y + 1, z - sz + radius
-                heapq.heappush(blocks_queue, (ry, (rx, ry, rz)))
-                height_map[rx][rz] += 1
-                if hid_map[rx][rz] != -1:
-                    holes[cur_hid][0].extend(holes[hid_map[rx][rz]][0])
-                    holes[hid_map[rx][rz]] = ([], (0, 0))
-                hid_map[rx][rz] = cur_hid
-
-    # A bug in the algorithm above produces holes that include non-air blocks.
-    # Just patch the problem here, since this function will eventually be
-    # performed by an ML model
-    for i, (xyzs, idm) in enumerate(holes):
-        blocks = fill_idmeta(agent, xyzs)
-        xyzs = [xyz for xyz, (d, _) in blocks if d == 0]  # remove non-air blocks
-        holes[i] = (xyzs, idm)
-
-    # remove 0-length holes
-    holes = [h for h in holes if len(h[0]) > 0]
+    origin = (sx - radius, sy - radius, sz - radius)
+    yzxb = agent.get_blocks(
+        sx - radius, sx + radius, sy - radius, max_height, sz - radius, sz + radius
+    )
+    agent_pos = tuple(int(c) for c in agent.pos)
+    key = ((sx, sy, sz), radius, agent_pos)
+    holes = HOLE_CACHE.get(key, yzxb)
+    if holes is None:
+        holes = find_holes(yzxb, origin, max_height, ignore_positions=[(sx, sy, sz), agent_pos])
+        HOLE_CACHE.put(key, yzxb, holes)
     return holes
 
 
@@ -4,7 +4,10 @@ Copyright (c) Facebook, Inc. and its affiliates.
 import numpy as np
 from typing import Tuple, List
 from droidlet.base_util import to_block_pos, XYZ, IDM, pos_to_np, euclid_dist
-from droidlet.shared_data_struct.craftassist_shared_utils import CraftAssistPerceptionData
+from droidlet.shared_data_struct.craftassist_shared_utils import (
+    CraftAssistPerceptionData,
+    path_planner,
+)
 
 
 def capped_line_of_sight(agent, player_struct, cap=20):
@@ -105,7 +108,9 @@ class LowLevelMCPerception:
         )
         # Changed blocks and their attributes
         perceive_info["changed_block_attributes"] = {}
-        for (xyz, idm) in self.agent.safe_get_changed_blocks():
+        changed_blocks = self.agent.safe_get_changed_blocks()
+        path_planner(self.agent).on_blocks_changed(changed_blocks)
+        for (xyz, idm) in changed_blocks:
             interesting, player_placed, agent_placed = self.on_block_changed(
                 xyz, idm, boring_blocks
             )
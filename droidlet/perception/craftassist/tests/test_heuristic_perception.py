@@ -0,0 +1,156 @@
+"""
+Copyright (c) Facebook, Inc. and its affiliates.
+"""
+import unittest
+import numpy as np
+from droidlet.perception.craftassist import heuristic_perception as hp
+
+
+class TestConnectedComponents(unittest.TestCase):
+    def setUp(self):
+        X = np.zeros((6, 6, 6, 2), dtype="int32")
+        # a 2x2x1 slab of stone, and a single block touching its corner
+        X[0:2, 0:2, 0] = (1, 0)
+        X[2, 2, 1] = (1, 0)
+        # a wool tower of two colours
+        X[4, 4, 0:2] = (35, 1)
+        X[4, 4, 2:4] = (35, 2)
+        self.X = X
+
+    def sorted_components(self, components):
+        return sorted(sorted(c) for c in components)
+
+    def test_connectivity(self):
+        components = hp.connected_components(self.X)
+        self.assertEqual(len(components), 2)
+        components = hp.connected_components(self.X, connectivity=6)
+        self.assertEqual(len(components), 3)
+        with self.assertRaises(ValueError):
+            hp.connected_components(self.X, connectivity=18)
+
+    def test_unique_idm(self):
+        components = self.sorted_components(hp.connected_components(self.X, unique_idm=True))
+        self.assertEqual(len(components), 3)
+        self.assertIn([(4, 4, 0), (4, 4, 1)], components)
+        self.assertIn([(4, 4, 2), (4, 4, 3)], components)
+
+    def test_segment(self):
+        labels, sizes, bounds, voxels = hp.segment(self.X)
+        self.assertEqual(labels.shape, (6, 6, 6))
+        self.assertEqual(sizes.tolist(), [5, 4])
+        self.assertEqual(bounds[0], (slice(0, 3), slice(0, 3), slice(0, 2)))
+        self.assertEqual(sorted(map(tuple, voxels[1].tolist())), [(4, 4, z) for z in range(4)])
+        self.assertTrue((labels[tuple(voxels[0].T)] == 1).all())
+
+    def test_empty(self):
+        labels, sizes, bounds, voxels = hp.segment(np.zeros((3, 3, 3), dtype="int32"))
+        self.assertEqual((len(sizes), len(bounds), len(voxels)), (0, 0, 0))
+        self.assertEqual(hp.connected_components(np.zeros((3, 3, 3, 2))), [])
+        self.assertEqual(hp.connected_components(np.zeros((3, 3, 3, 2)), unique_idm=True), [])
+
+    def test_accessible_interesting_blocks(self):
+        blocks = np.zeros((5, 5, 5), dtype="int32")
+        # an interesting block walled in by boring ones is not accessible
+        blocks[1:4, 1:4, 1:4] = 1
+        blocks[2, 2, 2] = 5
+        blocks[0, 0, 4] = 5
+        mask = hp.accessible_interesting_blocks(blocks, (0, 0, 0), [0, 1], [0])
+        self.assertEqual(np.argwhere(mask).tolist(), [[0, 0, 4]])
+
+
+class FakeAgent:
+    """a flat world of dirt with its surface at y=4, and counts its get_blocks calls"""
+
+    def __init__(self):
+        self.pos = (0, 5, 0)
+        self.world = {}
+        self.num_get_blocks = 0
+
+    def get_blocks(self, x, X, y, Y, z, Z):
+        self.num_get_blocks += 1
+        B = np.zeros((Y - y + 1, Z - z + 1, X - x + 1, 2), dtype="int32")
+        B[: max(0, 5 - y), :, :, 0] = 3
+        for (bx, by, bz), idm in self.world.items():
+            if x <= bx <= X and y <= by <= Y and z <= bz <= Z:
+                B[by - y, bz - z, bx - x] = idm
+        return B
+
+
+class TestHoles(unittest.TestCase):
+    def setUp(self):
+        self.agent = FakeAgent()
+        # a 2x1 pit, 2 deep
+        for x in [3, 4]:
+            for y in [3, 4]:
+                self.agent.world[(x, y, 2)] = (0, 0)
+        hp.HOLE_CACHE.data.clear()
+
+    def get_holes(self):
+        return hp.get_all_nearby_holes(self.agent, (0, 5, 0), None, None, radius=6)
+
+    def test_holes(self):
+        holes = self.get_holes()
+        self.assertEqual(self.agent.num_get_blocks, 1)
+        self.assertEqual(len(holes), 1)
+        xyzs, idm = holes[0]
+        self.assertEqual(sorted(xyzs), [(3, 3, 2), (3, 4, 2), (4, 3, 2), (4, 4, 2)])
+        self.assertEqual(idm, (3, 0))
+
+    def test_overflowing_hole(self):
+        # a trench to the edge of the window drains the pit
+        for x in range(4, 8):
+            self.agent.world[(x, 4, 2)] = (0, 0)
+        xyzs, _ = self.get_holes()[0]
+        self.assertEqual(sorted(xyzs), [(3, 3, 2), (4, 3, 2)])
+
+    def test_cache(self):
+        holes = self.get_holes()
+        self.assertEqual(self.get_holes(), holes)
+        self.assertEqual(len(hp.HOLE_CACHE.data), 1)
+        # filling the pit invalidates the cached holes
+        for x in [3, 4]:
+            for y in [3, 4]:
+                self.agent.world[(x, y, 2)] = (3, 0)
+        self.assertEqual(self.get_holes(), [])
+
+
+def locs_from_list(e):
+    return e
+
+
+class TestSpatialChecks(unittest.TestCase):
+    def test_in_hull(self):
+        cube = np.array([[x, y, z] for x in [0, 2] for y in [0, 2] for z in [0, 2]])
+        self.assertTrue(hp.in_hull(cube, np.array([1, 1, 1])))
+        self.assertFalse(hp.in_hull(cube, np.array([1, 1, 3])))
+        xs = np.array([[1, 1, 1], [2, 2, 2], [3, 1, 1]])
+        self.assertEqual(hp.in_hull(cube, xs).tolist(), [True, True, False])
+
+    def test_in_hull_degenerate(self):
+        square = np.array([[0, 0, 1], [2, 0, 1], [0, 2, 1], [2, 2, 1]])
+        xs = np.array([[1, 1, 1], [1, 1, 2], [3, 1, 1]])
+        self.assertEqual(hp.in_hull(square, xs).tolist(), [True, False, False])
+        segment = np.array([[0, 0, 0], [2, 2, 0]])
+        xs = np.array([[1, 1, 0], [1, 0, 0], [3, 3, 0]])
+        self.assertEqual(hp.in_hull(segment, xs).tolist(), [True, False, False])
+        self.assertTrue(hp.in_hull(np.array([[1, 1, 1]]), np.array([1, 1, 1])))
+
+    def test_find_between(self):
+        left = [(0, y, 0) for y in range(3)]
+        right = [(10, y, 0) for y in range(3)]
+        candidates = [[(5, 1, 0)], [(5, 1, 8)], [(5, 1, 0), (6, 1, 0)], None]
+        between = hp.find_between(candidates, [left, right], locs_from_list)
+        self.assertEqual(between, [True, False, True, False])
+        self.assertTrue(hp.check_between([[(5, 1, 0)], left, right], locs_from_list))
+
+    def test_inside(self):
+        ring = [(x, 0, z) for x in range(5) for z in range(5) if x in [0, 4] or z in [0, 4]]
+        self.assertTrue(hp.check_inside([[(2, 0, 2)], ring], locs_from_list))
+        self.assertFalse(hp.check_inside([[(2, 1, 2)], ring], locs_from_list))
+        inside = hp.find_inside(ring, locs_from_list)
+        self.assertEqual(inside[0], (2, 0, 2))
+        self.assertEqual(len(inside), 9)
+
+
+if __name__ == "__main__":
+    unittest.main()
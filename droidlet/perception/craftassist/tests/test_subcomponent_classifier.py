@@ -0,0 +1,78 @@
+"""
+Copyright (c) Facebook, Inc. and its affiliates.
+"""
+import time
+import unittest
+import torch
+from droidlet.perception.craftassist.voxel_models.semantic_segmentation.semseg_models import (
+    Opt,
+    SemSegNet,
+    SemSegWrapper,
+)
+from droidlet.perception.craftassist.voxel_models.subcomponent_classifier import (
+    SubComponentClassifierPool,
+    pack_block_objects,
+)
+
+
+def make_model():
+    torch.manual_seed(0)
+    opts = Opt()
+    opts.load = False
+    opts.num_words = 256
+    opts.num_layers = 1
+    opts.hidden_dim = 4
+    opts.num_classes = 3
+    names = ["none", "roof", "wall"]
+    classes = {
+        "idx2name": names,
+        "name2idx": {n: i for i, n in enumerate(names)},
+        "name2count": {n: 1 for n in names},
+    }
+    return SemSegNet(opts, classes=classes)
+
+
+def make_objects():
+    tower = [((5, 63 + y, 5), (1, 0)) for y in range(4)]
+    slab = [((x, 63, z), (35, x % 2)) for x in range(10, 13) for z in range(-2, 0)]
+    return [tower, slab, [((0, 70, 0), (2, 0))]]
+
+
+class TestSubComponentClassifier(unittest.TestCase):
+    def test_pack_block_objects(self):
+        blocks, shapes, offsets = pack_block_objects(make_objects())
+        self.assertEqual(list(blocks.shape), [3, 3, 4, 2, 2])
+        self.assertTrue(blocks.is_shared())
+        self.assertEqual(shapes.tolist(), [[1, 4, 1], [3, 1, 2], [1, 1, 1]])
+        self.assertEqual(offsets.tolist(), [[5, 63, 5], [10, 63, -2], [0, 70, 0]])
+        self.assertEqual(blocks[1, 2, 0, 1].tolist(), [35, 0])
+
+    def test_batched_segmentation(self):
+        wrapper = SemSegWrapper(make_model())
+        blocks, shapes, offsets = pack_block_objects(make_objects())
+        np_blocks = [b[:x, :y, :z].numpy() for b, (x, y, z) in zip(blocks, shapes.tolist())]
+        single = [wrapper.segment_object(b) for b in np_blocks]
+        self.assertEqual(wrapper.segment_objects(np_blocks), single)
+        self.assertEqual(wrapper.segment_objects(np_blocks, batch_size=2), single)
+
+    def test_pool(self):
+        pool = SubComponentClassifierPool(make_model(), num_workers=2)
+        pool.start()
+        objects = make_objects()
+        pool.submit(objects[:1])
+        pool.cancel()
+        pool.submit(objects)
+        results = []
+        for _ in range(100):
+            results.extend(pool.get_results())
+            if results:
+                break
+            time.sleep(0.1)
+        # the cancelled batch never comes back
+        self.assertEqual([obj for _, obj in results], objects)
+        for loc2labels, obj in results:
+            self.assertLessEqual(set(loc2labels), {loc for loc, _ in obj})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -129,26 +129,37 @@ class SemSegWrapper:
         self.tags = [(c, self.classes["name2count"][c]) for c in i2n]
         assert self.classes["name2idx"]["none"] == 0
 
-    @torch.no_grad()
     def segment_object(self, blocks):
+        return self.segment_objects([blocks])[0]
+
+    @torch.no_grad()
+    def segment_objects(self, blocks_list, batch_size=64):
+        """segment_object for a list of objects, run through the model
+        batch_size objects at a time"""
         self.model.eval()
-        blocks = torch.from_numpy(blocks)[:, :, :, 0]
-        blocks, _, o = make_example_from_raw(blocks)
-        blocks = blocks.unsqueeze(0)
-        if self.cuda:
-            blocks = blocks.cuda()
-        y = self.model(blocks)
-        _, mids = y.squeeze().max(0)
-        locs = mids.nonzero()
-        locs = locs.tolist()
-        if self.blocks_only:
-            return {
-                tuple(np.subtract(l, o)): mids[l[0], l[1], l[2]].item()
-                for l in locs
-                if blocks[0, l[0], l[1], l[2]] > 0
-            }
-        else:
-            return {tuple(ll for ll in l): mids[l[0], l[1], l[2]].item() for l in locs}
+        examples = [make_example_from_raw(torch.as_tensor(b)[:, :, :, 0]) for b in blocks_list]
+        preds = []
+        for i in range(0, len(examples), batch_size):
+            blocks = torch.stack([e[0] for e in examples[i : i + batch_size]])
+            if self.cuda:
+                blocks = blocks.cuda()
+            y = self.model(blocks)
+            _, mids = y.max(1)
+            for j, (_, _, o) in enumerate(examples[i : i + batch_size]):
+                locs = mids[j].nonzero().tolist()
+                if self.blocks_only:
+                    preds.append(
+                        {
+                            tuple(np.subtract(l, o)): mids[j, l[0], l[1], l[2]].item()
+                            for l in locs
+                            if blocks[j, l[0], l[1], l[2]] > 0
+                        }
+                    )
+                else:
+                    preds.append(
+                        {tuple(ll for ll in l): mids[j, l[0], l[1], l[2]].item() for l in locs}
+                    )
+        return preds
 
 
 if __name__ == "__main__":
@@ -3,7 +3,8 @@ Copyright (c) Facebook, Inc. and its affiliates.
 """
 
 import logging
-from multiprocessing import Queue, Process
+import torch
+from torch import multiprocessing as mp
 from droidlet.perception.craftassist.heuristic_perception import all_nearby_objects
 from droidlet.shared_data_struct.craftassist_shared_utils import CraftAssistPerceptionData
 from .semantic_segmentation.semseg_models import SemSegWrapper
@@ -22,9 +23,13 @@ class SubcomponentClassifierWrapper:
         model_path (str): path to the segmentation model
         perceive_freq (int): if not forced, how many Agent steps between perception.
             If 0, does not run unless forced
+        num_workers (int): number of classifier processes
+        batch_size (int): most objects the model labels at once
     """
 
-    def __init__(self, agent, model_path, low_level_data, perceive_freq=0):
+    def __init__(
+        self, agent, model_path, low_level_data, perceive_freq=0, num_workers=1, batch_size=64
+    ):
         self.agent = agent
         # Note remove the following
         self.memory = self.agent.memory
@@ -32,7 +37,9 @@ class SubcomponentClassifierWrapper:
         self.boring_blocks = low_level_data["boring_blocks"]
         self.passable_blocks = low_level_data["passable_blocks"]
         if model_path is not None:
-            self.subcomponent_classifier = SubComponentClassifier(voxel_model_path=model_path)
+            self.subcomponent_classifier = SubComponentClassifierPool(
+                model_path, num_workers=num_workers, batch_size=batch_size
+            )
             self.subcomponent_classifier.start()
         else:
             self.subcomponent_classifier = None
@@ -57,6 +64,9 @@ class SubcomponentClassifierWrapper:
             return CraftAssistPerceptionData()
         if self.subcomponent_classifier is None:
             return CraftAssistPerceptionData()
+        # results for blocks that changed since they were sent are no longer wanted
+        if self.agent.areas_to_perceive:
+            self.subcomponent_classifier.cancel()
         # TODO don't all_nearby_objects again, search in memory instead
         to_label = []
         # add all blocks in marked areas
@@ -71,12 +81,10 @@ class SubcomponentClassifierWrapper:
         ):
             to_label.append(obj)
 
-        for obj in to_label:
-            self.subcomponent_classifier.block_objs_q.put(obj)
+        self.subcomponent_classifier.submit(to_label)
 
         # everytime we try to retrieve as many recognition results as possible
-        while not self.subcomponent_classifier.loc2labels_q.empty():
-            loc2labels, obj = self.subcomponent_classifier.loc2labels_q.get()
+        for loc2labels, obj in self.subcomponent_classifier.get_results():
             loc2ids = dict(obj)
             label2blocks = {}
 
@@ -108,12 +116,23 @@ class SubcomponentClassifierWrapper:
         return CraftAssistPerceptionData(labeled_blocks=perceive_info["labeled_blocks"])
 
 
-class SubComponentClassifier(Process):
+class SubComponentClassifier(mp.Process):
     """
     A classifier class that calls a voxel model to output object tags.
+
+    Takes batches of block objects from batch_q, as put there by
+    SubComponentClassifierPool.submit, and puts (batch_id, [loc2labels]) in
+    loc2labels_q.  Batches from before the last cancel are skipped.
     """
 
-    def __init__(self, voxel_model_path=None):
+    def __init__(
+        self,
+        voxel_model_path=None,
+        batch_q=None,
+        loc2labels_q=None,
+        generation=None,
+        batch_size=64,
+    ):
         super().__init__()
 
         if voxel_model_path is not None:
@@ -124,8 +143,13 @@ class SubComponentClassifier(Process):
         else:
             raise Exception("specify a segmentation model")
 
-        self.block_objs_q = Queue()  # store block objects to be recognized
-        self.loc2labels_q = Queue()  # store loc2labels dicts to be retrieved by the agent
+        # store batches of block objects to be recognized
+        self.batch_q = batch_q if batch_q is not None else mp.Queue()
+        # store loc2labels dicts to be retrieved by the agent
+        self.loc2labels_q = loc2labels_q if loc2labels_q is not None else mp.Queue()
+        # bumped to cancel the queued batches
+        self.generation = generation if generation is not None else mp.Value("i", 0)
+        self.batch_size = batch_size
         self.daemon = True
 
     def run(self):
@@ -133,15 +157,22 @@ class SubComponentClassifier(Process):
         The main recognition loop of the classifier
         """
         while True:  # run forever
-            tb = self.block_objs_q.get(block=True, timeout=None)
-            loc2labels = self._watch_single_object(tb)
-            self.loc2labels_q.put((loc2labels, tb))
+            batch_id, generation, blocks, shapes, offsets = self.batch_q.get(
+                block=True, timeout=None
+            )
+            if generation != self.generation.value:
+                continue
+            loc2labels = self._watch_objects(blocks, shapes, offsets)
+            # blocks may have changed while the model was running
+            if generation != self.generation.value:
+                continue
+            self.loc2labels_q.put((batch_id, loc2labels))
 
-    def _watch_single_object(self, tuple_blocks):
+    def _watch_objects(self, blocks, shapes, offsets):
         """
-        Input: a list of tuples, where each tuple is ((x, y, z), [bid, mid]). This list
-               represents a block object.
-        Output: a dict of (loc, [tag1, tag2, ..]) pairs for all non-air blocks.
+        Input: N x X x Y x Z x 2 zero padded block objects, the N x 3 unpadded
+               size of each, and the N x 3 world location of their origins.
+        Output: a list of N dicts of (loc, [tag1, tag2, ..]) pairs for all non-air blocks.
         """
 
         def get_tags(p):
@@ -156,18 +187,103 @@ class SubComponentClassifier(Process):
             """
             return (cube_loc[0] + offsets[0], cube_loc[1] + offsets[1], cube_loc[2] + offsets[2])
 
-        np_blocks, offsets = blocks_list_to_npy(blocks=tuple_blocks, xyz=True)
-
-        pred = self.model.segment_object(np_blocks)
+        np_blocks = [b[:x, :y, :z].numpy() for b, (x, y, z) in zip(blocks, shapes.tolist())]
+        preds = self.model.segment_objects(np_blocks, batch_size=self.batch_size)
 
         # convert prediction results to string tags
-        return dict([(apply_offsets(loc, offsets), get_tags([p])) for loc, p in pred.items()])
+        return [
+            dict([(apply_offsets(loc, o), get_tags([p])) for loc, p in pred.items()])
+            for pred, o in zip(preds, offsets.tolist())
+        ]
+
+    def _watch_single_object(self, tuple_blocks):
+        """
+        Input: a list of tuples, where each tuple is ((x, y, z), [bid, mid]). This list
+               represents a block object.
+        Output: a dict of (loc, [tag1, tag2, ..]) pairs for all non-air blocks.
+        """
+        blocks, shapes, offsets = pack_block_objects([tuple_blocks])
+        return self._watch_objects(blocks, shapes, offsets)[0]
 
     def recognize(self, list_of_tuple_blocks):
         """
-        Multiple calls to _watch_single_object
+        Labels all the objects with one batched call to the model
         """
         tags = dict()
-        for tb in list_of_tuple_blocks:
-            tags.update(self._watch_single_object(tb))
+        for loc2labels in self._watch_objects(*pack_block_objects(list_of_tuple_blocks)):
+            tags.update(loc2labels)
         return tags
+
+
+def pack_block_objects(block_objects):
+    """
+    Pad a list of block objects into one tensor in shared memory, so that
+    sending it to a SubComponentClassifier only sends a handle to it.
+
+    Returns:
+        blocks: N x X x Y x Z x 2 int32 tensor, the (id, meta) of each object's
+            blocks, zero padded to the largest object
+        shapes: N x 3 tensor, the unpadded size of each object
+        offsets: N x 3 tensor, the world location of each object's origin
+    """
+    npys, offsets = zip(*[blocks_list_to_npy(blocks=obj, xyz=True) for obj in block_objects])
+    shapes = torch.tensor([npy.shape[:3] for npy in npys])
+    blocks = torch.zeros(len(npys), *shapes.max(0)[0].tolist(), 2, dtype=torch.int32)
+    for b, npy in zip(blocks, npys):
+        x, y, z, _ = npy.shape
+        b[:x, :y, :z] = torch.from_numpy(npy)
+    return blocks.share_memory_(), shapes, torch.tensor(offsets)
+
+
+class SubComponentClassifierPool:
+    """
+    A pool of SubComponentClassifier processes, fed whole batches of block objects.
+
+    Args:
+        voxel_model_path (str): path to the segmentation model
+        num_workers (int): number of classifier processes
+        batch_size (int): most objects run through the model at once
+    """
+
+    def __init__(self, voxel_model_path, num_workers=1, batch_size=64):
+        self.batch_q = mp.Queue()
+        self.loc2labels_q = mp.Queue()
+        self.generation = mp.Value("i", 0)
+        self.workers = [
+            SubComponentClassifier(
+                voxel_model_path, self.batch_q, self.loc2labels_q, self.generation, batch_size
+            )
+            for _ in range(num_workers)
+        ]
+        self.pending = {}  # batch_id -> the block objects in the batch
+        self.batch_count = 0
+
+    def start(self):
+        for worker in self.workers:
+            worker.start()
+
+    def submit(self, block_objects):
+        """Queue the block objects to be labeled as one batch"""
+        if len(block_objects) == 0:
+            return
+        self.batch_count += 1
+        self.pending[self.batch_count] = block_objects
+        self.batch_q.put(
+            (self.batch_count, self.generation.value, *pack_block_objects(block_objects))
+        )
+
+    def cancel(self):
+        """Drop all queued and running batches, e.g. because blocks changed"""
+        with self.generation.get_lock():
+            self.generation.value += 1
+        self.pending.clear()
+
+    def get_results(self):
+        """All finished and not cancelled (loc2labels, block object) pairs"""
+        results = []
+        while not self.loc2labels_q.empty():
+            batch_id, loc2labels = self.loc2labels_q.get()
+            block_objects = self.pending.pop(batch_id, None)
+            if block_objects is not None:
+                results.extend(zip(loc2labels, block_objects))
+        return results
@@ -10,92 +10,231 @@ from torchvision import transforms
 from .core import AbstractHandler
 from droidlet.interpreter.robot.objects import AttributeDict
 
+# maximum number of crops run through the feature model at once
+MAX_BATCH_SIZE = 16
+
+
+class FeatureIndex:
+    """
+    The L2-normalized feature vectors and (x, y) positions of previously seen objects,
+    kept as matrices so that a whole frame of objects can be matched against them with
+    one matrix multiply.  Rows are keyed by eid and a hash of the feature values, and
+    are only (re)normalized when an object is added or its features change.
+
+    Args:
+        dim (int): the size of the feature vectors
+    """
+
+    def __init__(self, dim=512):
+        self.dim = dim
+        self.eids = []
+        self.rows = {}
+        # eid -> hash of the raw features the row was computed from
+        self.keys = {}
+        self.features = np.zeros((0, dim), dtype=np.float32)
+        self.xy = np.zeros((0, 2), dtype=np.float32)
+
+    def __len__(self):
+        return len(self.eids)
+
+    def sync(self, previous_objects):
+        """
+        make the index hold exactly the previous_objects that have a feature_repr.
+        previous objects are usually read fresh from memory, so a row is kept as long as
+        the values of its features are unchanged; positions are refreshed.
+        """
+        eids, xy, new_rows, keys, raw = [], [], {}, {}, []
+        for o in previous_objects:
+            if isinstance(o, dict):
+                o = AttributeDict(o)
+            if o.feature_repr is None or o.eid in new_rows:
+                continue
+            f = self.as_array(o.feature_repr)
+            new_rows[o.eid] = len(eids)
+            keys[o.eid] = hash(f.tobytes())
+            eids.append(o.eid)
+            xy.append(o.xyz[:2])
+            raw.append(f)
+        kept = [i for i, eid in enumerate(eids) if self.keys.get(eid) == keys[eid]]
+        changed = [i for i, eid in enumerate(eids) if self.keys.get(eid) != keys[eid]]
+        features = np.zeros((len(eids), self.dim), dtype=np.float32)
+        if kept:
+            features[kept] = self.features[[self.rows[eids[i]] for i in kept]]
+        if changed:
+            features[changed] = self.normalize_rows(np.stack([raw[i] for i in changed]))
+        self.eids = eids
+        self.rows = new_rows
+        self.keys = keys
+        self.features = features
+        self.xy = np.asarray(xy, dtype=np.float32).reshape(-1, 2)
+
+    def upsert(self, eid, feature_repr, xyz):
+        """
+        add or replace the entry for eid.  this is taken as the latest version of eid,
+        which later syncs keep as long as memory holds the same feature values
+        """
+        raw = self.as_array(feature_repr)
+        f = self.normalize_rows(raw[None])[0]
+        self.keys[eid] = hash(raw.tobytes())
+        r = self.rows.get(eid)
+        if r is None:
+            self.rows[eid] = len(self.eids)
+            self.eids.append(eid)
+            self.features = np.concatenate([self.features, f[None]])
+            self.xy = np.concatenate([self.xy, np.asarray([xyz[:2]], dtype=np.float32)])
+        else:
+            self.features[r] = f
+            self.xy[r] = xyz[:2]
+
+    def as_array(self, feature_repr):
+        if torch.is_tensor(feature_repr):
+            feature_repr = feature_repr.detach().cpu().numpy()
+        return np.asarray(feature_repr, dtype=np.float32).reshape(-1)
+
+    def normalize_rows(self, features):
+        # same eps as torch.nn.CosineSimilarity
+        norms = np.linalg.norm(features, axis=1, keepdims=True)
+        return features / np.maximum(norms, 1e-8)
+
+    def search(self, features, xyz, score_thresh, dist_thresh):
+        """
+        for each of the M query objects, find the indexed object with the highest cosine
+        similarity of features among those with score > score_thresh and
+        whose (x, y) distance < dist_thresh.
+
+        Args:
+            features (array): M x dim feature vectors
+            xyz (array): M x (2 or 3) positions
+
+        Returns:
+            a list of M eids, None where there is no match, and the M x N score
+            and distance matrices
+        """
+        m = len(features)
+        if m == 0 or len(self.eids) == 0:
+            return [None] * m, np.zeros((m, len(self.eids))), np.zeros((m, len(self.eids)))
+        q = self.normalize_rows(np.stack([self.as_array(f) for f in features]))
+        xy = np.asarray(xyz, dtype=np.float32)[:, :2]
+        dists = np.linalg.norm(xy[:, None, :] - self.xy[None, :, :], axis=-1)
+        scores = q @ self.features.T
+        candidates = (dists < dist_thresh) & (scores > score_thresh)
+        masked = np.where(candidates, scores, -np.inf)
+        best = masked.argmax(axis=1)
+        matched = candidates[np.arange(m), best]
+        eids = [self.eids[b] if ok else None for b, ok in zip(best, matched)]
+        return eids, scores, dists
+
 
 class ObjectDeduplicator(AbstractHandler):
-    """Class for deduplicating a given set of objects from a given set of existing objects"""
+    """Class for deduplicating a given set of objects from a given set of existing objects
+
+    Args:
+        device (str or torch.device): where to run the feature model.  defaults to
+            cuda if it is available and the cpu otherwise
+    """
 
-    def __init__(self):
+    def __init__(self, device=None):
         self.object_id_counter = 1
-        self.dedupe_model = models.resnet18(pretrained=True).cuda()
-        self.layer = self.dedupe_model._modules.get("avgpool")
+        if device is None:
+            device = "cuda" if torch.cuda.is_available() else "cpu"
+        self.device = torch.device(device)
+        resnet = models.resnet18(pretrained=True)
+        # everything up to (and including) the avgpool layer, giving N x 512 x 1 x 1
+        self.dedupe_model = torch.nn.Sequential(*list(resnet.children())[:-1]).to(self.device)
         self.dedupe_model.eval()
         self.transforms = [
             transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225]),
             transforms.ToTensor(),
         ]
-        self._temp_buffer = torch.zeros(512).pin_memory()
-
-        def copy_data(m, i, o):
-            self._temp_buffer.copy_(torch.flatten(o).data)
-
-        self.layer.register_forward_hook(copy_data)
+        self.index = FeatureIndex(512)
+        self.score_thresh = 0.95
+        self.dist_thresh = 0.6
 
     def get_feature_repr(self, img):
-        normalize, to_tensor = self.transforms
-        t_img = normalize(to_tensor(img)).unsqueeze(0).cuda()
+        return self.get_feature_reprs([img])[0]
 
+    def get_feature_reprs(self, imgs):
+        """
+        returns a list with the (cpu) feature vector of each image.  images of the
+        same size are run through the model together
+        """
+        normalize, to_tensor = self.transforms
+        out = [None] * len(imgs)
+        by_shape = {}
+        for i, img in enumerate(imgs):
+            by_shape.setdefault(np.shape(img), []).append(i)
         with torch.no_grad():
-            self.dedupe_model(t_img)
-        return self._temp_buffer.clone()
+            for idx in by_shape.values():
+                for s in range(0, len(idx), MAX_BATCH_SIZE):
+                    batch = idx[s : s + MAX_BATCH_SIZE]
+                    t_imgs = torch.stack([normalize(to_tensor(imgs[i])) for i in batch])
+                    feats = torch.flatten(self.dedupe_model(t_imgs.to(self.device)), 1).cpu()
+                    for i, f in zip(batch, feats):
+                        # clone so that pickling a feature doesn't pickle the whole batch
+                        out[i] = f.clone()
+        return out
 
     # Not accounting for moving objects
     def is_match(self, score, dist):
-        score_thresh = 0.95
-        dist_thresh = 0.6
-        if score > score_thresh and dist > dist_thresh:
+        if score > self.score_thresh and dist > self.dist_thresh:
             return False  # Similar object, different places.
-        elif score > score_thresh and dist < dist_thresh:
+        elif score > self.score_thresh and dist < self.dist_thresh:
             return True  # same object, same place
         else:
             return False
 
-    def is_novel(self, current_object, previous_objects):
+    def match(self, current_objects, previous_objects):
         """this is long-term tracking (not in-frame). it does some feature
-        matching to figure out if we've seen this exact instance of object
+        matching to figure out if we've seen these exact instances of objects
         before.
 
         It uses the cosine similarity of conv features and (separately),
-        distance between two previous_objects
+        distance between two objects.  Each current object is matched to the
+        previous object at the same place with the most similar features.
+        The eid of each matched current object is set to that of its match.
 
         Args:
-            current_object (WorldObject): current object to compare
+            current_objects (List[WorldObject]): objects to compare
             previous_objects (List[WorldObject]): all previous objects to compare to
 
-
+        Returns:
+            a list with a bool for each current object, True if it is novel
         """
-        current_object.feature_repr = self.get_feature_repr(current_object.get_masked_img())
-        cos = torch.nn.CosineSimilarity(dim=1)
-        is_novel = True
-
-        # Future = use all object features to calculate novelty
-        for previous_object in previous_objects:
-            if isinstance(previous_object, dict):
-                previous_object = AttributeDict(previous_object)
-            if (
-                previous_object.feature_repr is not None
-                and current_object.feature_repr is not None
-            ):
-                score = cos(
-                    previous_object.feature_repr.unsqueeze(0),
-                    current_object.feature_repr.unsqueeze(0),
+        feats = self.get_feature_reprs([o.get_masked_img() for o in current_objects])
+        for o, f in zip(current_objects, feats):
+            o.feature_repr = f
+        self.index.sync(previous_objects)
+        if not current_objects:
+            return []
+        xyz = [list(o.xyz[:2]) for o in current_objects]
+        eids, scores, dists = self.index.search(feats, xyz, self.score_thresh, self.dist_thresh)
+        novel = []
+        for i, (current_object, eid) in enumerate(zip(current_objects, eids)):
+            if self.verbose > 0 and len(self.index) > 0:
+                j = int(scores[i].argmax())
+                logging.debug(
+                    "Best similarity {}.{} = {}, {}".format(
+                        current_object.label, self.index.eids[j], scores[i, j], dists[i, j]
+                    )
                 )
-                dist = np.linalg.norm(
-                    np.asarray(current_object.xyz[:2]) - np.asarray(previous_object.xyz[:2])
+            if eid is not None:
+                current_object.eid = eid
+            novel.append(eid is None)
+            if self.verbose > 0:
+                logging.info(
+                    "world object {}, is_novel {}".format(current_object.label, eid is None)
                 )
-                if self.verbose > 0:
-                    logging.debug(
-                        "Similarity {}.{} = {}, {}".format(
-                            current_object.label, previous_object.label, score.item(), dist
-                        )
-                    )
-                # FIXME pick best match?
-                if self.is_match(score.item(), dist):
-                    is_novel = False
-                    current_object.eid = previous_object.eid
-                    break
-        if self.verbose > 0:
-            logging.info("world object {}, is_novel {}".format(current_object.label, is_novel))
-        return is_novel
+        return novel
+
+    def is_novel(self, current_object, previous_objects):
+        """
+        single object version of match()
+
+        Args:
+            current_object (WorldObject): current object to compare
+            previous_objects (List[WorldObject]): all previous objects to compare to
+        """
+        return self.match([current_object], previous_objects)[0]
 
     def __call__(self, current_objects, previous_objects):
         """run the deduplication for the current objects detected.
@@ -112,8 +251,10 @@ class ObjectDeduplicator(AbstractHandler):
         self.object_id_counter = self.object_id_counter + 1
         new_objects = []
         updated_objects = []
-        for current_object in current_objects:
-            if self.is_novel(current_object, previous_objects):
+        updated_eids = set()
+        novel = self.match(current_objects, previous_objects)
+        for current_object, is_novel in zip(current_objects, novel):
+            if is_novel:
                 current_object.eid = self.object_id_counter
                 self.object_id_counter = self.object_id_counter + 1
                 new_objects.append(current_object)
@@ -123,12 +264,11 @@ class ObjectDeduplicator(AbstractHandler):
                         f"({np.around(np.array(current_object.xyz), 2)}),"
                         f" Center:({current_object.center})"
                     )
-            else:
-                exists = False
-                for u in updated_objects:
-                    if u.eid == current_object.eid:
-                        exists = True
-                if exists == False:
-                    updated_objects.append(current_object)
+            elif current_object.eid not in updated_eids:
+                updated_eids.add(current_object.eid)
+                updated_objects.append(current_object)
+        # the memory is updated with these, keep the index in step with it
+        for o in new_objects + updated_objects:
+            self.index.upsert(o.eid, o.feature_repr, o.xyz)
 
         return new_objects, updated_objects
@@ -5,7 +5,7 @@ import os
 import unittest
 import logging
 from timeit import Timer
-from unittest.mock import MagicMock
+from unittest.mock import MagicMock, patch
 from droidlet.perception.robot import (
     ObjectDetection,
     FaceRecognition,
@@ -28,7 +28,9 @@ from droidlet.perception.robot.tests.utils import (
     get_fake_humanpose,
 )
 from droidlet.perception.robot.active_vision.candidate_selection import SampleGoodCandidates
+from droidlet.perception.robot.handlers.deduplicator import FeatureIndex
 import json
+import pickle
 import numpy as np
 import time
 
@@ -236,6 +238,17 @@ class MemoryStoringTest(unittest.TestCase):
         logging.getLogger().disabled = False
         logging.info("Number of detections {}".format(len(detections)))
 
+    def test_batched_feature_reprs(self):
+        rng = np.random.default_rng(0)
+        # two image sizes, more of one size than fit in a batch
+        imgs = [rng.integers(0, 256, (32, 48, 3), dtype=np.uint8) for _ in range(20)]
+        imgs += [rng.integers(0, 256, (40, 40, 3), dtype=np.uint8) for _ in range(3)]
+        imgs = imgs[::2] + imgs[1::2]
+        feats = self.deduplicator.get_feature_reprs(imgs)
+        self.assertEqual(len(feats), len(imgs))
+        for img, f in zip(imgs, feats):
+            self.assertTrue(torch.allclose(f, self.deduplicator.get_feature_repr(img), atol=1e-4))
+
 
 class TestFaceRecognition(unittest.TestCase):
     def setUp(self) -> None:
@@ -332,5 +345,50 @@ class TestCandidateSelection(unittest.TestCase):
         self._run_test(traj_path, good_candidates, bad_candidates, is_annot_validfn)
 
 
+class FeatureIndexTest(unittest.TestCase):
+    def test_best_match(self):
+        index = FeatureIndex(4)
+        previous_objects = [
+            {"eid": 1, "xyz": (0, 0, 0), "feature_repr": torch.tensor([1.0, 0, 0, 0])},
+            {"eid": 2, "xyz": (0.1, 0, 0), "feature_repr": torch.tensor([1.0, 0.1, 0, 0])},
+            {"eid": 3, "xyz": (5, 0, 0), "feature_repr": torch.tensor([1.0, 0.1, 0, 0])},
+            {"eid": 4, "xyz": (0, 0, 0), "feature_repr": None},
+        ]
+        index.sync(previous_objects)
+        self.assertEqual(index.eids, [1, 2, 3])
+        features = [torch.tensor([1.0, 0.1, 0, 0]), torch.tensor([0, 1.0, 0, 0])]
+        eids, _, _ = index.search(features, [[0.05, 0, 0], [0, 0, 0]], 0.95, 0.6)
+        # the most similar object nearby, not the first one above the thresholds
+        self.assertEqual(eids, [2, None])
+
+        index.upsert(5, torch.tensor([0, 1.0, 0, 0]), (0, 0, 0))
+        eids, _, _ = index.search(features[1:], [[0, 0, 0]], 0.95, 0.6)
+        self.assertEqual(eids, [5])
+
+        index.sync(previous_objects[:1])
+        self.assertEqual(index.eids, [1])
+        self.assertEqual(index.features.shape, (1, 4))
+
+    def test_sync_refreshes_changed_features(self):
+        index = FeatureIndex(2)
+        previous_objects = [{"eid": 1, "xyz": (0, 0, 0), "feature_repr": torch.tensor([1.0, 0])}]
+        index.sync(previous_objects)
+        previous_objects[0]["feature_repr"] = torch.tensor([0, 1.0])
+        index.sync(previous_objects)
+        eids, _, _ = index.search([torch.tensor([0, 1.0])], [[0, 0, 0]], 0.95, 0.6)
+        self.assertEqual(eids, [1])
+
+    def test_sync_keeps_rows_read_back_from_memory(self):
+        index = FeatureIndex(2)
+        index.upsert(1, torch.tensor([3.0, 4.0]), (0, 0, 0))
+        # memory hands back an unpickled copy of the same features
+        feature_repr = pickle.loads(pickle.dumps(torch.tensor([3.0, 4.0])))
+        with patch.object(index, "normalize_rows", wraps=index.normalize_rows) as normalize_rows:
+            index.sync([{"eid": 1, "xyz": (1, 0, 0), "feature_repr": feature_repr}])
+            normalize_rows.assert_not_called()
+        self.assertTrue(np.allclose(index.features, [[0.6, 0.8]]))
+        self.assertTrue(np.allclose(index.xy, [[1, 0]]))
+
+
 if __name__ == "__main__":
     unittest.main()
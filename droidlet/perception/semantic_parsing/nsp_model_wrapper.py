@@ -3,7 +3,7 @@ Copyright (c) Facebook, Inc. and its affiliates.
 """
 import logging
 import os
-from typing import Dict
+from typing import Dict, List
 from .nsp_transformer_model.query_model import NSPBertModel as Model
 
 
@@ -65,3 +65,20 @@ class DroidletSemanticParsingModel:
         logging.info("Querying the semantic parsing model")
         logical_form = self.model.parse(chat=chat)
         return logical_form
+
+    def query_for_logical_forms(self, chats: List[str]) -> List[Dict]:
+        """Get the logical forms of several chat commands, decoded as one batch.
+
+        Args:
+            chats (List[str]): Input chats provided by the users.
+
+        Return:
+            List[Dict]: the logical form of each chat, see query_for_logical_form
+        """
+        logging.info("Querying the semantic parsing model for {} chats".format(len(chats)))
+        return self.model.parse_batch(chats)
+
+    @property
+    def model_id(self) -> str:
+        """identifies the loaded checkpoint"""
+        return self.model.model_id
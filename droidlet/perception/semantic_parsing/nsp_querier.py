@@ -6,13 +6,15 @@ import logging
 import pkg_resources
 import re
 import time
-from typing import Dict, Tuple
+from collections import deque
+from typing import Dict, List, Tuple
 from .utils import preprocess
 from .load_and_check_datasets import get_ground_truth
 from .nsp_model_wrapper import DroidletSemanticParsingModel
 from droidlet.event import sio
 from .utils.nsp_logger import NSPLogger
-from .utils.validate_json import JSONValidator
+from .utils.parse_cache import ParseCache, DEFAULT_PARSE_CACHE_SIZE
+from .utils.validate_json import get_json_validator
 from droidlet.base_util import hash_user
 
 
@@ -22,6 +24,10 @@ class NSPQuerier(object):
         and converts it to logical form. It does so by first checking against
         ground truth text-logical form pairings and if not found, querying the
         neural semantic parsing model.
+
+        All the chats received in a tick are parsed together: chats not in the
+        ground truth or in the parse cache are decoded by the model as one batch.
+        The parses are queued, and perceive() returns one of them per call.
         """
         self.agent = agent
         self.opts = opts
@@ -51,6 +57,21 @@ class NSPQuerier(object):
         self.ground_truth_actions = get_ground_truth(
             self.opts.no_ground_truth, self.opts.ground_truth_data_dir
         )
+        # RefResolver initialization requires a base schema and URI.
+        # the schemas are loaded once, and the validator is shared by all NSPQueriers
+        schema_dir = "{}/".format(
+            pkg_resources.resource_filename("droidlet.documents", "json_schema")
+        )
+        self.json_validator = get_json_validator(schema_dir, span_type="all")
+        # model parses of previous chats, keyed by the preprocessed chat
+        self.parse_cache = ParseCache(
+            getattr(opts, "nsp_parse_cache_size", DEFAULT_PARSE_CACHE_SIZE),
+            path=getattr(opts, "nsp_parse_cache_path", ""),
+            model_id=self.parsing_model.model_id if self.parsing_model else "",
+        )
+        # parsed chats not yet returned by perceive:
+        # (speaker, chat, preprocessed_chat, chat_parse)
+        self.parsed_chats = deque()
 
         # Socket event listener
         # TODO(kavya): I might want to move this to SemanticParserWrapper
@@ -85,9 +106,9 @@ class NSPQuerier(object):
                 )
 
     def perceive(self, force=False):
-        """Get the incoming chats, preprocess the chat, run through the parser
-        and return
-        Process incoming chats and run through parser"""
+        """Get the incoming chats, preprocess the chats, run them through the parser
+        and queue the parses.  Returns the oldest parsed chat in the queue, if any.
+        """
         received_chats_flag = False
         speaker, chat, preprocessed_chat, chat_parse = "", "", "", {}
         raw_incoming_chats = self.agent.get_incoming_chats()
@@ -110,14 +131,20 @@ class NSPQuerier(object):
             incoming_chats.append((speaker, chat))
 
         if len(incoming_chats) > 0:
+            self.agent.last_chat_time = time.time()
+            # incoming_chats -> [speaker, chat]
+            parses = self.get_parses([chat for _, chat in incoming_chats])
+            for (speaker, chat), (preprocessed_chat, chat_parse) in zip(incoming_chats, parses):
+                self.parsed_chats.append((speaker, chat, preprocessed_chat, chat_parse))
+
+        if self.parsed_chats:
             # force to get objects, speaker info
             if self.agent.perceive_on_chat:
                 force = True
-            self.agent.last_chat_time = time.time()
-            # For now just process the first incoming chat, where chat -> [speaker, chat]
-            speaker, chat = incoming_chats[0]
             received_chats_flag = True
-            preprocessed_chat, chat_parse = self.get_parse(chat)
+            speaker, chat, preprocessed_chat, chat_parse = self.parsed_chats.popleft()
+        else:
+            speaker, chat, preprocessed_chat, chat_parse = "", "", "", {}
 
         return force, received_chats_flag, speaker, chat, preprocessed_chat, chat_parse
 
@@ -149,6 +176,20 @@ class NSPQuerier(object):
         logical_form = self.get_logical_form(chat=chat, parsing_model=self.parsing_model)
         return chat, logical_form
 
+    def get_parses(self, chatstrs: List[str]) -> List[Tuple[str, Dict]]:
+        """Same as get_parse, for several chats.  The chats that have to be parsed
+        by the model are parsed as one batch.
+
+        Args:
+            chatstrs (List[str]) : chats or commands that need to be parsed
+
+        Returns:
+            List[Tuple[str, Dict]]: the preprocessed chat and logical form of each chat
+        """
+        chats = [self.preprocess_chat(chatstr) for chatstr in chatstrs]
+        logical_forms = self.get_logical_forms(chats=chats, parsing_model=self.parsing_model)
+        return list(zip(chats, logical_forms))
+
     def validate_parse_tree(self, parse_tree: Dict, debug: bool = True) -> bool:
         """Validate the parse tree against current grammar.
 
@@ -159,12 +200,7 @@ class NSPQuerier(object):
         Returns:
             True if parse tree is valid, False if not.
         """
-        # RefResolver initialization requires a base schema and URI
-        schema_dir = "{}/".format(
-            pkg_resources.resource_filename("droidlet.documents", "json_schema")
-        )
-        json_validator = JSONValidator(schema_dir, span_type="all")
-        is_valid_json = json_validator.validate_instance(parse_tree, debug)
+        is_valid_json = self.json_validator.validate_instance(parse_tree, debug)
         return is_valid_json
 
     def get_logical_form(self, chat: str, parsing_model) -> Dict:
@@ -196,33 +232,70 @@ class NSPQuerier(object):
                 }]
             }
         """
-        logical_form_source = "ground_truth"
-        # Check if chat is in ground_truth otherwise query parsing model
-        if chat in self.ground_truth_actions:
-            logical_form = copy.deepcopy(self.ground_truth_actions[chat])
-            logging.info('Found ground truth action for "{}"'.format(chat))
-            # log the current UTC time
-            time_now = time.time()
-        elif self.parsing_model:
-            logical_form = parsing_model.query_for_logical_form(chat)
-            time_now = time.time()
-            logical_form_source = "NLU_model"
-        else:
-            logical_form = {"dialogue_type": "NOOP"}
-            logging.info("Not found in ground truth, no parsing model initiated. Returning NOOP.")
-            time_now = time.time()
-            logical_form_source = "not_found_in_gt_no_model"
-        # log the logical form and chat with source
-        self.NSPLogger.log_dialogue_outputs(
-            [chat, logical_form, logical_form_source, "craftassist", time_now]
-        )
-        # check if logical_form conforms to the grammar
-        is_valid_json = self.validate_parse_tree(logical_form)
-        if not is_valid_json:
-            # Send a NOOP
-            logging.error("Invalid parse tree for command %r \n" % (chat))
-            logging.error("Parse tree failed grammar validation: \n %r \n" % (logical_form))
-            logical_form = {"dialogue_type": "NOOP"}
-            logging.error("Returning NOOP")
-
-        return logical_form
+        return self.get_logical_forms([chat], parsing_model)[0]
+
+    def get_logical_forms(self, chats: List[str], parsing_model) -> List[Dict]:
+        """Get the logical form of each of a list of chats, see get_logical_form.
+        The logical forms are looked up in the ground truth, then in the parse cache,
+        and the remaining chats are parsed by the model as one batch.
+
+        Args:
+            chats (List[str]): Input chats provided by the users.
+            parsing_model (DroidletSemanticParsingModel): Semantic parsing model
+
+        Return:
+            List[Dict]: the logical form of each chat
+        """
+        logical_forms = [None] * len(chats)
+        sources = [None] * len(chats)
+        to_parse = {}
+        for i, chat in enumerate(chats):
+            # Check if chat is in ground_truth, then in the cache, otherwise query parsing model
+            if chat in self.ground_truth_actions:
+                logical_forms[i] = copy.deepcopy(self.ground_truth_actions[chat])
+                sources[i] = "ground_truth"
+                logging.info('Found ground truth action for "{}"'.format(chat))
+                continue
+            if parsing_model:
+                cached = self.parse_cache.get(chat)
+                if cached is not None:
+                    logical_forms[i] = cached
+                    sources[i] = "NLU_model"
+                    logging.info('Found cached parse for "{}"'.format(chat))
+                    continue
+                to_parse.setdefault(chat, []).append(i)
+            else:
+                logical_forms[i] = {"dialogue_type": "NOOP"}
+                sources[i] = "not_found_in_gt_no_model"
+                logging.info(
+                    "Not found in ground truth, no parsing model initiated. Returning NOOP."
+                )
+        if to_parse:
+            # repeated chats are only parsed once
+            unique_chats = list(to_parse.keys())
+            for chat, logical_form in zip(
+                unique_chats, parsing_model.query_for_logical_forms(unique_chats)
+            ):
+                self.parse_cache.put(chat, logical_form)
+                for n, i in enumerate(to_parse[chat]):
+                    logical_forms[i] = logical_form if n == 0 else copy.deepcopy(logical_form)
+                    sources[i] = "NLU_model"
+        # log the current UTC time
+        time_now = time.time()
+        for i, chat in enumerate(chats):
+            # log the logical form and chat with source
+            self.NSPLogger.log_dialogue_outputs(
+                [chat, logical_forms[i], sources[i], "craftassist", time_now]
+            )
+            # check if logical_form conforms to the grammar
+            is_valid_json = self.validate_parse_tree(logical_forms[i])
+            if not is_valid_json:
+                # Send a NOOP
+                logging.error("Invalid parse tree for command %r \n" % (chat))
+                logging.error(
+                    "Parse tree failed grammar validation: \n %r \n" % (logical_forms[i])
+                )
+                logical_forms[i] = {"dialogue_type": "NOOP"}
+                logging.error("Returning NOOP")
+
+        return logical_forms
@@ -85,29 +85,41 @@ class DecoderWithLoss(nn.Module):
         self.fixed_span_loss = torch.nn.CrossEntropyLoss(ignore_index=-1, reduction="none")
         self.tree_to_text = args.tree_to_text
 
-    def step(self, y, y_mask, x_reps, x_mask):
+    def step(self, y, y_mask, x_reps, x_mask, past_key_values=None, use_cache=False):
         """Without loss, used at prediction time.
 
-        TODO: add previously computed y_rep, currently y only has the node indices, not spans.
+        With use_cache, the key/value states of the decoder's attention layers are
+        returned in res["past_key_values"]. Passing them back in as past_key_values
+        with y extended by new tokens only runs the decoder on the new tokens, and the
+        returned scores are only for those.
 
         Args:
             y: targets
             y_mask: mask for targets
             x_reps: encoder hidden states
             x_mask: input mask
+            past_key_values: key/value states returned by a previous call, for a prefix of y
+            use_cache: if True, return the key/value states of y
 
         Returns:
             Dictionary containing scores from each output head
 
         """
-        y_rep = self.bert(
-            labels=y,
-            input_ids=y,
+        past_len = past_key_values[0][0].shape[2] if past_key_values is not None else 0
+        y_new = y[:, past_len:]
+        model_out = self.bert(
+            labels=y_new,
+            input_ids=y_new,
             attention_mask=y_mask,
             encoder_hidden_states=x_reps,
             encoder_attention_mask=x_mask,
-        )[0]
-        y_mask_target = y_mask
+            past_key_values=past_key_values,
+            # None uses the config's default
+            use_cache=True if use_cache or past_key_values is not None else None,
+            return_dict=True,
+        )
+        y_rep = model_out.last_hidden_state
+        y_mask_target = y_mask[:, past_len:]
         lm_scores = self.lm_head(y_rep)
         y_span_pre_b = y_rep
         for hw in self.span_b_proj:
@@ -154,6 +166,8 @@ class DecoderWithLoss(nn.Module):
             "text_span_end_scores": torch.log_softmax(text_span_end_scores, dim=-1).detach(),
             "fixed_value_scores": torch.log_softmax(fixed_value_scores, dim=-1).detach(),
         }
+        if use_cache or past_key_values is not None:
+            res["past_key_values"] = model_out.past_key_values
         return res
 
     def forward(self, labels, y, y_mask, x_reps, x_mask, is_eval=False):
@@ -591,6 +591,9 @@ class BertEncoder(nn.Module):
         )
 
         next_decoder_cache = () if use_cache else None
+        # the caches of the expert layers (if they are used) follow those of self.layer
+        expert_cache = () if use_cache else None
+        num_layers = len(self.layer)
         # NOTE: this is where the for loop iterating over layers is
         # Let's say layer 5 is where we branch off
         # condition on the hidden
@@ -607,17 +610,25 @@ class BertEncoder(nn.Module):
                 hidden_size = hidden_states.shape[-1]
                 sum_of_experts = torch.zeros(labels.size() + (hidden_size,)).to(labels.device)
                 for j, expert_layer_j in enumerate(self.expert_layers):
+                    expert_past_key_value = (
+                        past_key_values[num_layers + j]
+                        if past_key_values is not None and len(past_key_values) > num_layers
+                        else None
+                    )
                     # For token j
                     # B x V x H
-                    layer_outputs_j = self.expert_layers[j](
+                    expert_outputs_j = self.expert_layers[j](
                         hidden_states,
                         attention_mask,
                         layer_head_mask,
                         encoder_hidden_states,
                         encoder_attention_mask,
-                        past_key_value,
+                        expert_past_key_value,
                         output_attentions,
-                    )[0]
+                    )
+                    layer_outputs_j = expert_outputs_j[0]
+                    if use_cache:
+                        expert_cache += (expert_outputs_j[-1],)
                     # Mask the outputs for tokens that are assigned to this layer
                     # B x V
                     mask_token_j = torch.where(labels % 20 == j, 1, 0)
@@ -681,6 +692,8 @@ class BertEncoder(nn.Module):
 
         if output_hidden_states:
             all_hidden_states = all_hidden_states + (hidden_states,)
+        if use_cache:
+            next_decoder_cache += expert_cache
 
         if not return_dict:
             return tuple(
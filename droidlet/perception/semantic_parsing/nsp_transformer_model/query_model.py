@@ -9,7 +9,7 @@ import pickle
 import torch
 
 from .utils_model import build_model, load_model
-from .utils_parsing import beam_search
+from .utils_parsing import beam_search, beam_search_batch
 from .utils_parsing import *
 from .decoder_with_loss import *
 from .encoder_decoder import *
@@ -38,6 +38,12 @@ class NSPBertModel(object):
 
     def __init__(self, model_dir, data_dir, model_name="caip_test_model"):
         sd, tree_voc, tree_idxs, args, full_tree_voc = load_model(model_dir)
+        # identifies the checkpoint, e.g. to invalidate cached parses when it changes
+        model_path = os.path.join(model_dir, model_name + ".pth")
+        model_stat = os.stat(model_path)
+        self.model_id = "{}:{}:{}".format(
+            os.path.abspath(model_path), model_stat.st_size, int(model_stat.st_mtime)
+        )
         decoder_with_loss, encoder_decoder, tokenizer = build_model(args, full_tree_voc[1])
         args.data_dir = data_dir
         self.tokenizer = tokenizer
@@ -62,8 +68,27 @@ class NSPBertModel(object):
         btr = beam_search(
             chat, self.encoder_decoder, self.tokenizer, self.dataset, beam_size, well_formed_pen
         )
+        return self.select_tree(btr, noop_thres)
+
+    def parse_batch(self, chats, noop_thres=0.95, beam_size=5, well_formed_pen=1e2):
+        """Same as `parse`, for a list of chats, which are encoded and decoded as one batch.
+        See `beam_search_batch`
+
+        Args:
+            chats (list[str]): Preprocessed chat commands.
+
+        Returns:
+            list[dict]: the logical form of each chat.
+        """
+        if not chats:
+            return []
+        btrs = beam_search_batch(
+            chats, self.encoder_decoder, self.tokenizer, self.dataset, beam_size, well_formed_pen
+        )
+        return [self.select_tree(btr, noop_thres) for btr in btrs]
+
+    def select_tree(self, btr, noop_thres):
+        """pick a tree from the sorted beam search results, skipping an unconfident NOOP"""
         if btr[0][0].get("dialogue_type", "NONE") == "NOOP" and math.exp(btr[0][1]) < noop_thres:
-            tree = btr[1][0]
-        else:
-            tree = btr[0][0]
-        return tree
+            return btr[1][0]
+        return btr[0][0]
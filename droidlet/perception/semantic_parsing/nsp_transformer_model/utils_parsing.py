@@ -20,173 +20,203 @@ def beam_search(txt, model, tokenizer, dataset, beam_size=5, well_formed_pen=1e2
     Returns:
         logical form (dict)
 
+    """
+    return beam_search_batch([txt], model, tokenizer, dataset, beam_size, well_formed_pen)[0]
+
+
+def beam_search_batch(txts, model, tokenizer, dataset, beam_size=5, well_formed_pen=1e2):
+    """Beam search decoding of several chats at once.
+    The chats are padded to the same length and encoded together, and the beams of
+    all the chats are decoded as one batch of len(txts) * beam_size sequences.
+
+    Args:
+        txts (list[str]): chat inputs
+        model: model class with pretrained model
+        tokenizer: pretrained tokenizer
+        beam_size (int): Number of branches to keep in beam search
+        well_formed_pen (float): penalization for poorly formed trees
+
+    Returns:
+        a list with the beam search result of each chat, see beam_search
+
     """
     model_device = model.decoder.lm_head.predictions.decoder.weight.device
+    n_txts = len(txts)
     # prepare batch
-    text, idx_maps = tokenize_mapidx(txt, tokenizer)
-    idx_rev_map = [(0, 0)] * len(text.split())
-    for line_id, idx_map in enumerate(idx_maps):
-        for pre_id, (a, b) in enumerate(idx_map):
-            idx_rev_map[a] = (line_id, pre_id)
-            idx_rev_map[b] = (line_id, pre_id)
-    idx_rev_map[-1] = idx_rev_map[-2]
     tree = [("<S>", -1, -1, -1, -1, -1)]
-    text_idx_ls = dataset.tokenizer.convert_tokens_to_ids(text.split())
     tree_idx_ls = [
         [dataset.tree_idxs[w], bi, ei, text_span_bi, text_span_ei, fixed_val]
         for w, bi, ei, text_span_bi, text_span_ei, fixed_val in tree
     ]
-    pre_batch = [(text_idx_ls, tree_idx_ls, (text, txt, {}))]
+    pre_batch = []
+    idx_rev_maps = []
+    for txt in txts:
+        text, idx_maps = tokenize_mapidx(txt, tokenizer)
+        idx_rev_map = [(0, 0)] * len(text.split())
+        for line_id, idx_map in enumerate(idx_maps):
+            for pre_id, (a, b) in enumerate(idx_map):
+                idx_rev_map[a] = (line_id, pre_id)
+                idx_rev_map[b] = (line_id, pre_id)
+        idx_rev_map[-1] = idx_rev_map[-2]
+        idx_rev_maps.append(idx_rev_map)
+        text_idx_ls = dataset.tokenizer.convert_tokens_to_ids(text.split())
+        pre_batch.append((text_idx_ls, tree_idx_ls, (text, txt, {})))
     batch = caip_collate(pre_batch, tokenizer)
     batch = [t.to(model_device) for t in batch[:4]]
     x, x_mask, y, y_mask = batch
     x_reps = model.encoder(input_ids=x, attention_mask=x_mask)[0].detach()
-    x_mask = x_mask.expand(beam_size, -1)
-    x_reps = x_reps.expand(beam_size, -1, -1)
+    # row i * beam_size + b holds beam b of chat i
+    x_mask = x_mask.repeat_interleave(beam_size, dim=0)
+    x_reps = x_reps.repeat_interleave(beam_size, dim=0)
+    n_rows = n_txts * beam_size
     # start decoding
-    y = torch.LongTensor([[dataset.tree_idxs["<S>"]] for _ in range(beam_size)]).to(
+    y = torch.LongTensor([[dataset.tree_idxs["<S>"]] for _ in range(n_rows)]).to(
         model_device
-    )  # B x 1
-    beam_scores = torch.Tensor([-1e9 for _ in range(beam_size)]).to(model_device)  # B
-    beam_scores[0] = 0
-    beam_seqs = [[("<S>", -1, -1, -1, -1, -1)] for _ in range(beam_size)]
-    finished = [False for _ in range(beam_size)]
+    )  # NB x 1
+    y_mask = y_mask.repeat_interleave(beam_size, dim=0)
+    beam_scores = torch.Tensor([-1e9 for _ in range(n_rows)]).to(model_device)  # NB
+    beam_scores[::beam_size] = 0
+    # first row of each chat's beams, to map per-chat beam ids to rows
+    row_offsets = torch.arange(0, n_rows, beam_size, device=model_device)[:, None]  # N x 1
+    # the predictions of each beam are kept on-tensor, and only mapped to words at the end:
+    # node id, span beginning, span end, text span start, text span end, fixed value id
+    beam_preds = torch.full((n_rows, 1, 6), -1, dtype=torch.long, device=model_device)
+    beam_preds[:, 0, 0] = dataset.tree_idxs["<S>"]
+    finished = torch.zeros(n_rows, dtype=torch.bool, device=model_device)
+    eos_id = dataset.tree_idxs["</S>"]
     fixed_value_vocab_size = len(fixed_span_values_voc)
     pad_scores = torch.Tensor([-1e9] * (len(dataset.tree_voc) - fixed_value_vocab_size)).to(
         model_device
     )
     pad_scores[dataset.tree_idxs["[PAD]"]] = 0
-    for i in range(100):
-        outputs = model.decoder.step(y, y_mask, x_reps, x_mask)
+    # span scores are invalid if beginning > end
+    # Create triangular matrix with negative infinity for invalid combos
+    x_len = x_reps.shape[1]
+    invalid_span_scores = torch.tril(torch.ones(x_len, x_len), diagonal=-1) * -1e9
+    invalid_span_scores = invalid_span_scores.type_as(x_reps)
+    # spans can't start or end in the padding of shorter chats
+    x_pad_scores = (1 - x_mask).type_as(x_reps) * -1e9  # NB x T
+    past_key_values = None
+
+    def to_seq(preds):
+        return [("<S>", -1, -1, -1, -1, -1)] + [
+            (dataset.tree_voc[w], b, e, ts, te, fixed_span_values_voc[fv])
+            for w, b, e, ts, te, fv in preds[1:]
+        ]
+
+    def best_spans(start_scores, end_scores):
+        start_scores = start_scores + x_pad_scores
+        end_scores = end_scores + x_pad_scores
+        span_scores = start_scores[:, :, None] + end_scores[:, None, :]
+        return (span_scores + invalid_span_scores).view(n_rows, -1).argmax(dim=-1)
+
+    for _ in range(100):
+        # only the last token is run through the decoder, the states of the
+        # previous ones are cached
+        outputs = model.decoder.step(
+            y, y_mask, x_reps, x_mask, past_key_values=past_key_values, use_cache=True
+        )
         # next word, grab the final token
-        lm_scores = outputs["lm_scores"][:, -1, :]  # B x V
-        for i, fshed in enumerate(finished):
-            if fshed:
-                # set predictions to padding tokens
-                lm_scores[i] = pad_scores
-        beam_lm_scores = lm_scores + beam_scores[:, None]  # B x V
-        beam_lm_lin = beam_lm_scores.view(-1)
-        # get the highest probability tokens
-        s_scores, s_ids = beam_lm_lin.sort(dim=-1, descending=True)
-        s_beam_ids = s_ids // beam_lm_scores.shape[-1]
-        s_word_ids = s_ids % beam_lm_scores.shape[-1]
+        lm_scores = outputs["lm_scores"][:, -1, :]  # NB x V
+        # set predictions of finished beams to padding tokens
+        lm_scores = torch.where(finished[:, None], pad_scores[None, :], lm_scores)
+        beam_lm_scores = lm_scores + beam_scores[:, None]  # NB x V
+        vocab_size = beam_lm_scores.shape[-1]
+        beam_lm_lin = beam_lm_scores.view(n_txts, -1)  # N x BV
+        # get the highest probability tokens of each chat
+        beam_scores, s_ids = beam_lm_lin.topk(beam_size)
+        beam_scores = beam_scores.view(-1)
+        n_beam_ids = (torch.div(s_ids, vocab_size, rounding_mode="floor") + row_offsets).view(-1)
+        n_word_ids = (s_ids % vocab_size).view(-1)
         # re-order and add next token
-        beam_scores = s_scores[:beam_size]
-        n_beam_ids = s_beam_ids[:beam_size]
-        n_word_ids = s_word_ids[:beam_size]
-        # convert tokens to words
-        n_words = [dataset.tree_voc[nw_id.item()] for nw_id in n_word_ids]
         y = torch.cat([y[n_beam_ids], n_word_ids[:, None]], dim=1)
+        past_key_values = tuple(
+            # cross-attention states (the last two) are the same for all beams of a chat
+            tuple(t[n_beam_ids] for t in layer[:2]) + tuple(layer[2:])
+            for layer in outputs["past_key_values"]
+        )
         # find out which of the beams are finished
-        pre_finished = [finished[b_id.item()] for b_id in n_beam_ids]
-        new_finished = [w_id.item() == dataset.tree_idxs["</S>"] for w_id in n_word_ids]
-        finished = [p or n for p, n in zip(pre_finished, new_finished)]
-        n_mask = 1 - torch.Tensor(finished).type_as(y_mask)
+        new_finished = n_word_ids == eos_id
+        finished = finished[n_beam_ids] | new_finished
+        n_mask = (~finished).type_as(y_mask)
         y_mask = torch.cat([y_mask[n_beam_ids], n_mask[:, None]], dim=1)
-        # predicted span
-        span_b_scores = outputs["span_b_scores"][:, -1, :][n_beam_ids]  # B x T
-        span_e_scores = outputs["span_e_scores"][:, -1, :][n_beam_ids]  # B x T
-        span_be_scores = span_b_scores[:, :, None] + span_e_scores[:, None, :]
-        # scores are invalid if beginning > end
-        # Create triangular matrix with negative infinity for invalid combos
-        invalid_scores = torch.tril(torch.ones(span_be_scores.shape), diagonal=-1) * -1e9
-        # Make invalid scores very small
-        span_be_scores += invalid_scores.type_as(span_be_scores)
-        # Create linearized view
-        span_be_lin = span_be_scores.view(span_be_scores.shape[0], -1)
-        # Sort linearized scores by descending order
-        _, s_sbe_ids = span_be_lin.sort(dim=-1, descending=True)
-        # Grab token IDs for top scores
-        s_sb_ids = s_sbe_ids[:, 0] // span_b_scores.shape[-1]
-        s_se_ids = s_sbe_ids[:, 0] % span_b_scores.shape[-1]
-        beam_b_ids = [bb_id.item() for bb_id in s_sb_ids]
-        beam_e_ids = [be_id.item() for be_id in s_se_ids]
 
-        # predict text spans
-        text_span_start_scores = outputs["text_span_start_scores"][:, -1, :][n_beam_ids]  # B x T
-        text_span_end_scores = outputs["text_span_end_scores"][:, -1, :][n_beam_ids]  # B x T
-        text_span_scores = text_span_start_scores[:, :, None] + text_span_end_scores[:, None, :]
-        invalid_text_span_scores = (
-            torch.tril(torch.ones(text_span_scores.shape), diagonal=-1) * -1e9
+        # predicted span
+        span_be_ids = best_spans(
+            outputs["span_b_scores"][:, -1, :][n_beam_ids],
+            outputs["span_e_scores"][:, -1, :][n_beam_ids],
         )
-        text_span_scores += invalid_text_span_scores.type_as(text_span_scores)
-        text_span_lin_scores = text_span_scores.view(text_span_scores.shape[0], -1)
-        _, text_span_ids = text_span_lin_scores.sort(dim=-1, descending=True)
-        text_span_start_ids = text_span_ids[:, 0] // text_span_start_scores.shape[-1]
-        text_span_end_ids = text_span_ids[:, 0] % text_span_start_scores.shape[-1]
-        text_span_beam_start_ids = [bb_id.item() for bb_id in text_span_start_ids]
-        text_span_beam_end_ids = [be_id.item() for be_id in text_span_end_ids]
-
-        # predict fixed values
-        fixed_value_scores = outputs["fixed_value_scores"][:, -1, :][n_beam_ids]  # B x T
-        fixed_value_lin_scores = fixed_value_scores.view(-1)
-        # get the highest probability tokens
-        fixed_value_ranked_scores, fixed_value_ids = fixed_value_lin_scores.sort(
-            dim=-1, descending=True
+        # predict text spans
+        text_span_ids = best_spans(
+            outputs["text_span_start_scores"][:, -1, :][n_beam_ids],
+            outputs["text_span_end_scores"][:, -1, :][n_beam_ids],
         )
-        fixed_value_beam_ids = fixed_value_ids // fixed_value_scores.shape[-1]
-        # map back to which word in sequence, since
-        fixed_value_word_ids = fixed_value_ids % fixed_value_scores.shape[-1]
-        # re-order and add next token
-        fixed_value_beam_scores = fixed_value_ranked_scores[:beam_size]
-        fixed_value_beam_ids = fixed_value_beam_ids[:beam_size]
-        fixed_value_word_ids = fixed_value_word_ids[:beam_size]
-        # convert tokens to words
-        fixed_value_words = [fixed_span_values_voc[nw_id.item()] for nw_id in fixed_value_word_ids]
+        # predict fixed values: the highest scoring (beam, value) pairs over the beams of each chat
+        fixed_value_scores = outputs["fixed_value_scores"][:, -1, :][n_beam_ids]  # NB x F
+        _, fixed_value_ids = fixed_value_scores.reshape(n_txts, -1).topk(beam_size)
+        fixed_value_word_ids = (fixed_value_ids % fixed_value_scores.shape[-1]).view(-1)
 
-        # update beam_seq
-        beam_seqs = [
-            beam_seqs[n_beam_ids[i].item()]
-            + [
-                (
-                    n_words[i],
-                    beam_b_ids[i],
-                    beam_e_ids[i],
-                    text_span_beam_start_ids[i],
-                    text_span_beam_end_ids[i],
-                    fixed_value_words[i],
-                )
-            ]
-            for i in range(beam_size)
-        ]
+        # update beam predictions
+        n_preds = torch.stack(
+            [
+                n_word_ids,
+                torch.div(span_be_ids, x_len, rounding_mode="floor"),
+                span_be_ids % x_len,
+                torch.div(text_span_ids, x_len, rounding_mode="floor"),
+                text_span_ids % x_len,
+                fixed_value_word_ids,
+            ],
+            dim=1,
+        )
+        beam_preds = torch.cat([beam_preds[n_beam_ids], n_preds[:, None, :]], dim=1)
         # penalize poorly formed trees
-        for i, seq in enumerate(beam_seqs):
-            if seq[-1][0] == "</S>":
-                _, well_formed = select_spans(seq)
+        if new_finished.any():
+            for i in new_finished.nonzero()[:, 0].tolist():
+                _, well_formed = select_spans(to_seq(beam_preds[i].tolist()))
                 if not well_formed:
                     beam_scores[i] -= well_formed_pen
         # check whether all beams have reached EOS
-        if all(finished):
+        if finished.all():
             break
-    # only keep span predictions for span nodes, then map back to tree
-    beam_seqs = [
-        [
-            (w, b, e, -1, -1, -1)
-            if w.startswith("BE:")
-            else (w, -1, -1, text_span_start, text_span_end, fixed_val)
-            for w, b, e, text_span_start, text_span_end, fixed_val in res
-            if w != "[PAD]"
+    all_preds = beam_preds.tolist()
+    all_scores = beam_scores.tolist()
+    results = []
+    for n, idx_rev_map in enumerate(idx_rev_maps):
+        rows = range(n * beam_size, (n + 1) * beam_size)
+        beam_seqs = [to_seq(all_preds[r]) for r in rows]
+        # only keep span predictions for span nodes, then map back to tree
+        beam_seqs = [
+            [
+                (w, b, e, -1, -1, -1)
+                if w.startswith("BE:")
+                else (w, -1, -1, text_span_start, text_span_end, fixed_val)
+                for w, b, e, text_span_start, text_span_end, fixed_val in res
+                if w != "[PAD]"
+            ]
+            for res in beam_seqs
         ]
-        for res in beam_seqs
-    ]
-    beam_seqs = [
-        [
-            (w, -1, -1, text_span_start, text_span_end, -1)
-            if w.startswith("TBE:")
-            else (w, b, e, -1, -1, fixed_val)
-            for w, b, e, text_span_start, text_span_end, fixed_val in res
-            if w != "[PAD]"
+        beam_seqs = [
+            [
+                (w, -1, -1, text_span_start, text_span_end, -1)
+                if w.startswith("TBE:")
+                else (w, b, e, -1, -1, fixed_val)
+                for w, b, e, text_span_start, text_span_end, fixed_val in res
+                if w != "[PAD]"
+            ]
+            for res in beam_seqs
         ]
-        for res in beam_seqs
-    ]
-    # delinearize predicted sequences into tree
-    beam_trees = [seq_to_tree(dataset.full_tree, res[1:-1], idx_rev_map)[0] for res in beam_seqs]
-    pre_res = [
-        (tree, score.item(), seq) for tree, score, seq in zip(beam_trees, beam_scores, beam_seqs)
-    ]
-    # sort one last time to have well-formed trees on top
-    res = sorted(pre_res, key=lambda x: x[1], reverse=True)
-    return res
+        # delinearize predicted sequences into tree
+        beam_trees = [
+            seq_to_tree(dataset.full_tree, res[1:-1], idx_rev_map)[0] for res in beam_seqs
+        ]
+        beam_scores = [all_scores[r] for r in rows]
+        pre_res = [
+            (tree, score, seq) for tree, score, seq in zip(beam_trees, beam_scores, beam_seqs)
+        ]
+        # sort one last time to have well-formed trees on top
+        res = sorted(pre_res, key=lambda x: x[1], reverse=True)
+        results.append(res)
+    return results
 
 
 def compute_accuracy(outputs, y):
@@ -0,0 +1,54 @@
+import unittest
+from argparse import Namespace
+
+import torch
+from transformers import BertConfig
+
+from droidlet.perception.semantic_parsing.nsp_transformer_model.decoder_with_loss import (
+    DecoderWithLoss,
+)
+
+
+class TestDecoderCache(unittest.TestCase):
+    def setUp(self):
+        config = BertConfig(
+            vocab_size=40,
+            hidden_size=32,
+            num_hidden_layers=12,
+            num_attention_heads=2,
+            intermediate_size=64,
+        )
+        config.is_decoder = True
+        config.add_cross_attention = True
+        args = Namespace(
+            num_highway=2, node_label_smoothing=0, lambda_span_loss=0.5, tree_to_text=False
+        )
+        torch.manual_seed(0)
+        self.decoder = DecoderWithLoss(config, args, Namespace(pad_token_id=0)).eval()
+
+    def test_incremental_step(self):
+        """stepping one token at a time with cached states matches a full step"""
+        x_reps = torch.randn(3, 7, 32)
+        x_mask = torch.ones(3, 7, dtype=torch.long)
+        x_mask[1, 5:] = 0
+        y = torch.randint(1, 40, (3, 6))
+        y_mask = torch.ones(3, 6, dtype=torch.long)
+        y_mask[2, 4:] = 0
+        with torch.no_grad():
+            full = self.decoder.step(y, y_mask, x_reps, x_mask)
+            out = self.decoder.step(y[:, :1], y_mask[:, :1], x_reps, x_mask, use_cache=True)
+            for t in range(1, 6):
+                out = self.decoder.step(
+                    y[:, : t + 1],
+                    y_mask[:, : t + 1],
+                    x_reps,
+                    x_mask,
+                    past_key_values=out["past_key_values"],
+                )
+                for k in ["lm_scores", "span_b_scores", "text_span_end_scores"]:
+                    self.assertEqual(out[k].shape[1], 1)
+                    self.assertTrue(torch.allclose(out[k][:, 0], full[k][:, t], atol=1e-4))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,55 @@
+"""
+Copyright (c) Facebook, Inc. and its affiliates.
+"""
+import os
+import tempfile
+import unittest
+from droidlet.perception.semantic_parsing.utils.parse_cache import ParseCache
+
+COME_HERE = {
+    "dialogue_type": "HUMAN_GIVE_COMMAND",
+    "action_sequence": [{"action_type": "MOVE", "location": {"text_span": [0, [1, 1]]}}],
+}
+STOP = {"dialogue_type": "HUMAN_GIVE_COMMAND", "action_sequence": [{"action_type": "STOP"}]}
+
+
+class TestParseCache(unittest.TestCase):
+    def test_lru(self):
+        cache = ParseCache(maxsize=2)
+        cache.put("come here", COME_HERE)
+        cache.put("stop", STOP)
+        self.assertEqual(cache.get("come here"), COME_HERE)
+        # "stop" is now the least recently used
+        cache.put("dance", {"dialogue_type": "NOOP"})
+        self.assertIsNone(cache.get("stop"))
+        self.assertIn("come here", cache)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_returns_copies(self):
+        cache = ParseCache()
+        cache.put("come here", COME_HERE)
+        lf = cache.get("come here")
+        lf["action_sequence"][0]["action_type"] = "DANCE"
+        self.assertEqual(cache.get("come here"), COME_HERE)
+
+    def test_on_disk(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "parse_cache.jsonl")
+            cache = ParseCache(maxsize=2, path=path, model_id="model_a")
+            for i in range(5):
+                cache.put("stop {}".format(i), STOP)
+            cache.put("come here", COME_HERE)
+
+            reloaded = ParseCache(maxsize=2, path=path, model_id="model_a")
+            self.assertEqual(len(reloaded), 2)
+            self.assertEqual(reloaded.get("come here"), COME_HERE)
+            self.assertEqual(reloaded.get("stop 4"), STOP)
+
+            # parses of another model are discarded
+            other = ParseCache(maxsize=2, path=path, model_id="model_b")
+            self.assertEqual(len(other), 0)
+            self.assertEqual(len(ParseCache(maxsize=2, path=path, model_id="model_a")), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -76,6 +76,28 @@ class TestValidateParseTree(unittest.TestCase):
         is_valid_json = self.chat_parser.validate_parse_tree(action_dict)
         self.assertTrue(is_valid_json)
 
+    def test_precheck(self):
+        json_validator = self.chat_parser.json_validator
+        # the validator is loaded once per process
+        self.assertIs(NSPQuerier(opts=self.chat_parser.opts).json_validator, json_validator)
+        parse_trees = [
+            {},
+            [],
+            {"dialogue_type": "NOOP"},
+            {"dialogue_type": "OTHERACTION", "action_type": "DANCE"},
+            {"dialogue_type": "NOT_A_DIALOGUE_TYPE"},
+            {"dialogue_type": 5},
+            {"dialogue_type": "GET_CAPABILITIES", "action_type": "NOT_AN_ACTION_TYPE"},
+            {"dialogue_type": "HUMAN_GIVE_COMMAND", "event_sequence": "not a list"},
+        ]
+        # the fast path agrees with the full schema validation
+        for parse_tree in parse_trees:
+            is_valid = json_validator.validate_instance(parse_tree, debug=False)
+            self.assertEqual(is_valid, json_validator.validator.is_valid(parse_tree))
+        self.assertEqual(
+            json_validator.validate_instances(parse_trees), [False] * 2 + [True] * 2 + [False] * 4
+        )
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,112 @@
+"""
+Copyright (c) Facebook, Inc. and its affiliates.
+"""
+import copy
+import json
+import logging
+import os
+from collections import OrderedDict
+
+DEFAULT_PARSE_CACHE_SIZE = 1024
+
+
+class ParseCache:
+    """A least-recently-used cache of the logical forms output by the semantic parsing
+    model, keyed by the preprocessed chat.
+
+    If path is given, the cache is also kept on disk as a file of json lines and reloaded
+    by the next ParseCache with the same path, so it is shared across agent restarts.
+    The first line of the file records the model_id of the parser that produced the
+    parses; a file written with a different model is discarded.
+
+    Args:
+        maxsize (int): maximum number of cached parses, 0 disables the cache
+        path (str): the on-disk cache file, or "" to keep the cache in memory only
+        model_id (str): identifies the parsing model, see NSPBertModel.model_id
+
+    Attributes:
+        hits (int): number of lookups found in the cache
+        misses (int): number of lookups not found in the cache
+    """
+
+    def __init__(self, maxsize=DEFAULT_PARSE_CACHE_SIZE, path="", model_id=""):
+        self.maxsize = maxsize
+        self.path = path
+        self.model_id = model_id
+        self.data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self._num_lines = 0
+        if self.path and self.maxsize > 0:
+            self.load()
+
+    def get(self, chat):
+        """returns a copy of the cached logical form of chat, or None on a miss"""
+        try:
+            self.data.move_to_end(chat)
+        except KeyError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return copy.deepcopy(self.data[chat])
+
+    def put(self, chat, logical_form):
+        if self.maxsize <= 0:
+            return
+        self.data[chat] = copy.deepcopy(logical_form)
+        self.data.move_to_end(chat)
+        if len(self.data) > self.maxsize:
+            self.data.popitem(last=False)
+        if self.path:
+            # the file is compacted when it holds many more lines than the cache
+            if self._num_lines >= 2 * self.maxsize:
+                self.save()
+            else:
+                self._append(chat, logical_form)
+
+    def __contains__(self, chat):
+        return chat in self.data
+
+    def __len__(self):
+        return len(self.data)
+
+    def load(self):
+        """read the on-disk cache, discarding it if it was written by another model"""
+        if not os.path.isfile(self.path):
+            self.save()
+            return
+        try:
+            with open(self.path) as f:
+                header = json.loads(f.readline())
+                if header.get("model_id") != self.model_id:
+                    logging.info("Discarding parse cache {} of another model".format(self.path))
+                    self.save()
+                    return
+                num_lines = 1
+                for line in f:
+                    num_lines += 1
+                    chat, logical_form = json.loads(line)
+                    self.data[chat] = logical_form
+                    self.data.move_to_end(chat)
+                    if len(self.data) > self.maxsize:
+                        self.data.popitem(last=False)
+                self._num_lines = num_lines
+        except (ValueError, TypeError, AttributeError):
+            logging.warning("Ignoring unreadable parse cache {}".format(self.path))
+            self.data.clear()
+            self.save()
+
+    def save(self):
+        """rewrite the on-disk cache with the current entries"""
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            f.write(json.dumps({"model_id": self.model_id}) + "\n")
+            for chat, logical_form in self.data.items():
+                f.write(json.dumps([chat, logical_form]) + "\n")
+        os.replace(tmp_path, self.path)
+        self._num_lines = len(self.data) + 1
+
+    def _append(self, chat, logical_form):
+        with open(self.path, "a") as f:
+            f.write(json.dumps([chat, logical_form]) + "\n")
+        self._num_lines += 1
@@ -1,10 +1,14 @@
-from jsonschema import validate, exceptions, RefResolver, Draft7Validator
+from jsonschema import exceptions, RefResolver, Draft7Validator
 import json
+from functools import lru_cache
 from pprint import pprint
 import argparse
 import glob
 import re
 
+# keywords of the base schema that don't constrain an instance
+SCHEMA_ANNOTATIONS = ["$id", "$schema", "title", "description", "definitions"]
+
 
 class JSONValidator:
     def __init__(self, schema_dir, span_type):
@@ -52,6 +56,60 @@ class JSONValidator:
                 resolver.store[schema_name + ".schema.json"] = json_schema
         self.base_schema = base_schema
         self.resolver = resolver
+        # the schema is checked and compiled once, and the resolver caches the
+        # subschemas $refs resolve to across calls
+        Draft7Validator.check_schema(base_schema)
+        self.validator = Draft7Validator(base_schema, resolver=resolver)
+        self.dialogue_type_checks = self.get_dialogue_type_checks(base_schema)
+
+    @staticmethod
+    def get_dialogue_type_checks(base_schema):
+        """Maps each dialogue_type allowed by the base schema to whether a parse tree with
+        that dialogue_type is valid whatever its other keys are, i.e. the only branch of
+        the base schema's oneOf accepting it constrains nothing but the dialogue_type.
+        Returns None if the base schema doesn't have this shape.
+        """
+        branches = base_schema.get("oneOf")
+        if not branches or any(
+            k not in SCHEMA_ANNOTATIONS + ["type", "required", "oneOf"] for k in base_schema
+        ):
+            return None
+        if base_schema.get("type") != "object" or base_schema.get("required") != ["dialogue_type"]:
+            return None
+        checks = {}
+        for branch in branches:
+            if list(branch.keys()) != ["properties"]:
+                return None
+            dialogue_type = branch["properties"].get("dialogue_type", {})
+            if "const" in dialogue_type:
+                values = [dialogue_type["const"]]
+            elif "enum" in dialogue_type:
+                values = dialogue_type["enum"]
+            else:
+                return None
+            trivial = (
+                list(branch["properties"].keys()) == ["dialogue_type"] and len(dialogue_type) == 1
+            )
+            for v in values:
+                # values accepted by several branches need the full validation
+                checks[v] = trivial and v not in checks
+        return checks
+
+    def precheck(self, parse_tree):
+        """Fast structural check of the top level of a parse tree.
+
+        Returns:
+            True or False if that is enough to know whether the parse tree is valid,
+            None if it has to be validated against the full schema.
+        """
+        if self.dialogue_type_checks is None:
+            return None
+        if type(parse_tree) is not dict:
+            return False
+        dialogue_type = parse_tree.get("dialogue_type")
+        if type(dialogue_type) is not str or dialogue_type not in self.dialogue_type_checks:
+            return False
+        return True if self.dialogue_type_checks[dialogue_type] else None
 
     def validate_data(self, data_path, test_mode=False):
         """
@@ -72,12 +130,11 @@ class JSONValidator:
                 else:
                     command, action_dict = parts
                 parse_tree = json.loads(action_dict)
-                try:
-                    validate(instance=parse_tree, schema=self.base_schema, resolver=self.resolver)
-                except exceptions.ValidationError as e:
+                error = self.get_error(parse_tree)
+                if error is not None:
                     print(command)
                     pprint(parse_tree)
-                    print(e)
+                    print(error)
                     print("\n")
                     # If we're running data validation as a unit test, return False immediately on validation error.
                     if test_mode:
@@ -97,15 +154,40 @@ class JSONValidator:
         Returns:
             True if logical form passes the schema validation, else returns False.
         """
-        try:
-            validate(instance=parse_tree, schema=self.base_schema, resolver=self.resolver)
-        except exceptions.ValidationError as e:
-            # Option to print debug information
-            if debug:
-                print("Error validating:\n{}\n".format(parse_tree))
-                print(e)
-            return False
-        return True
+        is_valid = self.precheck(parse_tree)
+        if is_valid is None:
+            is_valid = self.validator.is_valid(parse_tree)
+        # Option to print debug information
+        if not is_valid and debug:
+            print("Error validating:\n{}\n".format(parse_tree))
+            print(self.get_error(parse_tree))
+        return is_valid
+
+    def validate_instances(self, parse_trees, debug=False):
+        """
+        Validates a list of parse trees.
+
+        Args:
+            parse_trees (list) -- dictionaries we want to validate
+            debug (bool) -- whether to print debug information
+
+        Returns:
+            list of bools, whether each logical form passes the schema validation
+        """
+        return [self.validate_instance(parse_tree, debug) for parse_tree in parse_trees]
+
+    def get_error(self, parse_tree):
+        """Returns the best ValidationError for an invalid parse tree, or None if it is valid"""
+        if self.precheck(parse_tree) is True:
+            return None
+        return exceptions.best_match(self.validator.iter_errors(parse_tree))
+
+
+@lru_cache(maxsize=None)
+def get_json_validator(schema_dir, span_type):
+    """Returns a JSONValidator shared by the whole process for this schema_dir and span_type.
+    The schemas are only loaded by the first call."""
+    return JSONValidator(schema_dir, span_type)
 
 
 if __name__ == "__main__":
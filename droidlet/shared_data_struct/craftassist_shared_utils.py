@@ -1,11 +1,12 @@
 import logging
 import time
+import weakref
 import numpy as np
-from collections import namedtuple
+from collections import namedtuple, OrderedDict
+from scipy import ndimage
 
 from droidlet.base_util import adjacent, get_bounds, manhat_dist
 from droidlet.lowlevel.minecraft.craftassist_cuberite_utils.block_data import PASSABLE_BLOCKS
-from droidlet.shared_data_structs import PriorityQueue
 
 CraftAssistPerceptionData = namedtuple(
     "perception_data",
@@ -58,6 +59,241 @@ MOBS_BY_ID = {
 }
 
 
+# blocks fetched around the start and targets of a path search
+PATH_WINDOW_MARGIN = 10
+# distance fields kept per planner, one per (target, approx)
+PATH_FIELD_CACHE_SIZE = 8
+UNREACHED = np.iinfo(np.int32).max // 2
+NEIGHBOURS = ndimage.generate_binary_structure(3, 1)
+
+
+def _relax(D, walkable):
+    """Lower D in place until it is the distance field over walkable cells.
+
+    D must be an upper bound on the true distances, e.g. 0 on the goal cells and
+    UNREACHED everywhere else, or a previous field with the cells whose distance
+    may have grown reset to UNREACHED.  Each pass is one breadth first layer, so
+    a repair after a small change only takes as many passes as the change reaches.
+    """
+    P = np.full(np.array(D.shape) + 2, UNREACHED, dtype=D.dtype)
+    while True:
+        P[1:-1, 1:-1, 1:-1] = D
+        best = np.minimum(P[:-2, 1:-1, 1:-1], P[2:, 1:-1, 1:-1])
+        np.minimum(best, P[1:-1, :-2, 1:-1], out=best)
+        np.minimum(best, P[1:-1, 2:, 1:-1], out=best)
+        np.minimum(best, P[1:-1, 1:-1, :-2], out=best)
+        np.minimum(best, P[1:-1, 1:-1, 2:], out=best)
+        best += 1
+        lower = walkable & (best < D)
+        if not lower.any():
+            return D
+        D[lower] = best[lower]
+
+
+class PathPlanner:
+    """Plans an agent's paths over a cached passability grid.
+
+    The blocks around the searched positions are fetched once and kept current
+    with on_blocks_changed, so searches in the same area don't fetch them again.
+    Paths are read off a distance field to the goal, kept per (target, approx)
+    and repaired in place when blocks change rather than searched again.
+
+    Positions are absolute (x, y, z); the grid is yzx-ordered like get_blocks.
+    A cell is walkable if it and the cell above it are passable.
+
+    Args:
+    - agent: the Agent object whose get_blocks is used
+    - margin: how many blocks to fetch around the start and targets
+    """
+
+    def __init__(self, agent, margin=PATH_WINDOW_MARGIN):
+        self.agent = agent
+        self.margin = margin
+        self.invalidate()
+
+    def invalidate(self):
+        """Forget the cached blocks; the next search fetches them again."""
+        self.lo = None
+        self.hi = None
+        self.passable = None
+        self.walkable = None
+        self.components = None
+        self.fields = OrderedDict()
+
+    def _ensure_window(self, points):
+        points = np.asarray(points).astype("int32").reshape(-1, 3)
+        if self.passable is not None:
+            # keep the window while the points stay half a margin from its edges,
+            # so walking a path doesn't fetch a new one every step
+            lo = points.min(axis=0) - self.margin // 2
+            hi = points.max(axis=0) + self.margin // 2
+            lo[1], hi[1] = max(lo[1], 0), min(hi[1], 255)
+            if (lo >= self.lo).all() and (hi <= self.hi).all():
+                return
+        self.invalidate()
+        lo = points.min(axis=0) - self.margin
+        hi = points.max(axis=0) + self.margin
+        lo[1], hi[1] = max(lo[1], 0), min(hi[1], 255)
+        mx, my, mz = lo
+        Mx, My, Mz = hi
+        blocks = self.agent.get_blocks(mx, Mx, my, My, mz, Mz)
+        self.lo, self.hi = lo, hi
+        self.passable = np.isin(blocks[:, :, :, 0], PASSABLE_BLOCKS)
+        self.walkable = self.passable[:-1, :, :] & self.passable[1:, :, :]  # head and feet
+
+    def _to_grid(self, points):
+        """yzx positions of points in the walkable grid, and which are inside it"""
+        rel = (np.asarray(points).astype("int32").reshape(-1, 3) - self.lo)[:, [1, 2, 0]]
+        inside = ((rel >= 0) & (rel < self.walkable.shape)).all(axis=1)
+        return rel, inside
+
+    def _in_grid(self, yzx):
+        return all(0 <= c < n for c, n in zip(yzx, self.walkable.shape))
+
+    def on_blocks_changed(self, blocks):
+        """Update the cached grid and distance fields from changed blocks.
+
+        Args:
+        - blocks: a list of ((x, y, z), (id, meta)), e.g. from get_changed_blocks
+        """
+        if self.passable is None or len(blocks) == 0:
+            return
+        xyzs = np.array([xyz for xyz, _ in blocks], dtype="int32")
+        passable = np.isin([idm[0] for _, idm in blocks], PASSABLE_BLOCKS)
+        rel = (xyzs - self.lo)[:, [1, 2, 0]]
+        inside = ((rel >= 0) & (rel < self.passable.shape)).all(axis=1)
+        if not inside.any():
+            return
+        y, z, x = rel[inside].T
+        self.passable[y, z, x] = passable[inside]
+
+        # a block is the feet of the cell it is in and the head of the one below
+        ys = np.concatenate([y, y - 1])
+        zs = np.concatenate([z, z])
+        xs = np.concatenate([x, x])
+        keep = (ys >= 0) & (ys < self.walkable.shape[0])
+        ys, zs, xs = ys[keep], zs[keep], xs[keep]
+        old = self.walkable[ys, zs, xs]
+        new = self.passable[ys, zs, xs] & self.passable[ys + 1, zs, xs]
+        if (old == new).all():
+            return
+        self.walkable[ys, zs, xs] = new
+        self.components = None
+
+        blocked = old & ~new
+        for (target, approx), D in self.fields.items():
+            if blocked.any():
+                # only cells farther than the nearest blocked one could have routed
+                # through it; those are searched again, the rest of D stays exact
+                cutoff = D[ys[blocked], zs[blocked], xs[blocked]].min()
+                D[D > cutoff] = UNREACHED
+            D[ys[blocked], zs[blocked], xs[blocked]] = UNREACHED
+            D[self._goal_mask(target, approx)] = 0
+            _relax(D, self.walkable)
+
+    def _goal_mask(self, target, approx):
+        ((ty, tz, tx),), _ = self._to_grid([target])
+        y, z, x = np.ogrid[
+            : self.walkable.shape[0], : self.walkable.shape[1], : self.walkable.shape[2]
+        ]
+        return self.walkable & (abs(y - ty) + abs(z - tz) + abs(x - tx) <= approx)
+
+    def _field(self, target, approx):
+        key = (tuple(int(c) for c in target), approx)
+        D = self.fields.get(key)
+        if D is None:
+            goal = self._goal_mask(target, approx)
+            D = np.full(self.walkable.shape, UNREACHED, dtype="int32")
+            D[goal] = 0
+            self.fields[key] = _relax(D, self.walkable)
+            if len(self.fields) > PATH_FIELD_CACHE_SIZE:
+                self.fields.popitem(last=False)
+        else:
+            self.fields.move_to_end(key)
+        return D
+
+    def path(self, target, approx=0, pos="agent"):
+        """Find a path from pos to within approx of target.
+
+        Args:
+        - target: an absolute (x, y, z)
+        - approx: proximity to target before search is complete (0 = exact)
+        - pos: (optional) checks path from specified tuple
+
+        Returns: a list of (x, y, z) positions from target to start, or None
+        """
+        if type(pos) is str and pos == "agent":
+            pos = self.agent.pos
+        pos = tuple(int(c) for c in pos)
+        self._ensure_window([pos, target])
+        D = self._field(target, approx)
+        (start,), _ = self._to_grid([pos])
+        (goal,), _ = self._to_grid([target])
+
+        p = tuple(start)
+        path = [p]
+        while manhat_dist(p, goal) > approx:
+            steps = [a for a in adjacent(p) if self._in_grid(a) and D[a] < UNREACHED]
+            if not steps:
+                return None
+            p = min(steps, key=lambda a: D[a])
+            path.append(p)
+        my, mz, mx = self.lo[[1, 2, 0]]
+        return [(x + mx, y + my, z + mz) for (y, z, x) in reversed(path)]
+
+    def reachable(self, targets, approx=0, pos="agent"):
+        """Which targets a path from pos can get within approx of.
+
+        All targets are answered from one labeling of the walkable cells, so
+        picking among many candidates costs about as much as checking one.
+
+        Args:
+        - targets: a list of absolute (x, y, z)
+        - approx: proximity to a target that counts as reaching it
+        - pos: (optional) checks paths from specified tuple
+
+        Returns: a boolean array, one entry per target
+        """
+        if type(pos) is str and pos == "agent":
+            pos = self.agent.pos
+        targets = np.asarray(targets).astype("int32").reshape(-1, 3)
+        if len(targets) == 0:
+            return np.zeros(0, dtype=bool)
+        pos = np.asarray(pos).astype("int32")
+        self._ensure_window(np.vstack([pos, targets]))
+        if self.components is None:
+            self.components, _ = ndimage.label(self.walkable, structure=NEIGHBOURS)
+
+        # searches expand from the start into walkable neighbours, whether or not
+        # the start itself is walkable
+        (start,), _ = self._to_grid([pos])
+        labels = {
+            self.components[a]
+            for a in adjacent(tuple(start)) + (tuple(start),)
+            if self._in_grid(a) and self.components[a] > 0
+        }
+        reached = np.isin(self.components, list(labels))
+        if approx > 0:
+            reached = ndimage.binary_dilation(reached, structure=NEIGHBOURS, iterations=approx)
+
+        out = np.abs(targets - pos).sum(axis=1) <= approx
+        rel, inside = self._to_grid(targets)
+        y, z, x = rel[inside].T
+        out[inside] |= reached[y, z, x]
+        return out
+
+
+_PATH_PLANNERS = weakref.WeakKeyDictionary()
+
+
+def path_planner(agent):
+    """The agent's PathPlanner, created on first use"""
+    planner = _PATH_PLANNERS.get(agent)
+    if planner is None:
+        planner = _PATH_PLANNERS[agent] = PathPlanner(agent)
+    return planner
+
+
 def astar(agent, target, approx=0, pos="agent"):
     """Find a path from the agent's pos to the target.
 
@@ -67,88 +303,20 @@ def astar(agent, target, approx=0, pos="agent"):
     - approx: proximity to target before search is complete (0 = exact)
     - pos: (optional) checks path from specified tuple
 
-    Returns: a list of (x, y, z) positions from start to target
+    Returns: a list of (x, y, z) positions from target to start
     """
     t_start = time.time()
     if type(pos) is str and pos == "agent":
         pos = agent.pos
     logging.debug("A* from {} -> {} ± {}".format(pos, target, approx))
 
-    corners = np.array([pos, target]).astype("int32")
-    mx, my, mz = corners.min(axis=0) - 10
-    Mx, My, Mz = corners.max(axis=0) + 10
-    my, My = max(my, 0), min(My, 255)
-    blocks = agent.get_blocks(mx, Mx, my, My, mz, Mz)
-    obstacles = np.isin(blocks[:, :, :, 0], PASSABLE_BLOCKS, invert=True)
-    obstacles = obstacles[:-1, :, :] | obstacles[1:, :, :]  # check head and feet
-    start, goal = (corners - [mx, my, mz])[:, [1, 2, 0]]
-    path = _astar(obstacles, start, goal, approx)
-    if path is not None:
-        path = [(p[2] + mx, p[0] + my, p[1] + mz) for p in reversed(path)]
+    path = path_planner(agent).path(target, approx, pos)
 
     t_elapsed = time.time() - t_start
     logging.debug("A* returned {}-len path in {}".format(len(path) if path else "None", t_elapsed))
     return path
 
 
-def _astar(X, start, goal, approx=0):
-    """Find a path through X from start to goal.
-
-    Args:
-    - X: a 3d array of obstacles, i.e. False -> passable, True -> not passable
-    - start/goal: relative positions in X
-    - approx: proximity to goal before search is complete (0 = exact)
-
-    Returns: a list of relative positions, from start to goal
-    """
-    start = tuple(start)
-    goal = tuple(goal)
-
-    visited = set()
-    came_from = {}
-    q = PriorityQueue()
-    q.push(start, manhat_dist(start, goal))
-    G = np.full_like(X, np.iinfo(np.uint32).max, "uint32")
-    G[start] = 0
-
-    while len(q) > 0:
-        _, p = q.pop()
-
-        if manhat_dist(p, goal) <= approx:
-            path = []
-            while p in came_from:
-                path.append(p)
-                p = came_from[p]
-            return [start] + list(reversed(path))
-
-        visited.add(p)
-        for a in adjacent(p):
-            if (
-                a in visited
-                or a[0] < 0
-                or a[0] >= X.shape[0]
-                or a[1] < 0
-                or a[1] >= X.shape[1]
-                or a[2] < 0
-                or a[2] >= X.shape[2]
-                or X[a]
-            ):
-                continue
-
-            g = G[p] + 1
-            if g >= G[a]:
-                continue
-            came_from[a] = p
-            G[a] = g
-            f = g + manhat_dist(a, goal)
-            if q.contains(a):
-                q.replace(a, f)
-            else:
-                q.push(a, f)
-
-    return None
-
-
 def arrange(arrangement, schematic=None, shapeparams={}):
     """This function arranges an Optional schematic in a given arrangement
     and returns the offsets"""
@@ -0,0 +1,94 @@
+"""
+Copyright (c) Facebook, Inc. and its affiliates.
+"""
+import unittest
+import numpy as np
+from droidlet.base_util import manhat_dist
+from droidlet.shared_data_struct.craftassist_shared_utils import PathPlanner
+
+STONE = (1, 0)
+AIR = (0, 0)
+
+
+class BlocksAgent:
+    """Just enough of an agent to plan over: a yzx block array walled in by stone,
+    and a count of fetches"""
+
+    def __init__(self, blocks, pos):
+        self.blocks = blocks
+        self.pos = pos
+        self.fetches = 0
+
+    def get_blocks(self, xa, xb, ya, yb, za, zb):
+        self.fetches += 1
+        out = np.zeros((yb - ya + 1, zb - za + 1, xb - xa + 1, 2), dtype="uint8")
+        out[:] = STONE
+        B = self.blocks
+        ys = slice(max(ya, 0), min(yb + 1, B.shape[0]))
+        zs = slice(max(za, 0), min(zb + 1, B.shape[1]))
+        xs = slice(max(xa, 0), min(xb + 1, B.shape[2]))
+        out[
+            ys.start - ya : ys.stop - ya,
+            zs.start - za : zs.stop - za,
+            xs.start - xa : xs.stop - xa,
+        ] = B[ys, zs, xs]
+        return out
+
+    def set_block(self, xyz, idm):
+        x, y, z = xyz
+        self.blocks[y, z, x] = idm
+
+
+class TestPathPlanner(unittest.TestCase):
+    def setUp(self):
+        # a floor, and a wall across x=5 with a one-block gap at z=2
+        blocks = np.zeros((6, 10, 10, 2), dtype="uint8")
+        blocks[0] = STONE
+        blocks[1:, :, 5] = STONE
+        blocks[1:3, 2, 5] = AIR
+        self.agent = BlocksAgent(blocks, (1, 1, 7))
+        self.planner = PathPlanner(self.agent)
+
+    def check_path(self, path, start, target, approx=0):
+        self.assertEqual(path[-1], start)
+        self.assertLessEqual(manhat_dist(path[0], target), approx)
+        for a, b in zip(path, path[1:]):
+            self.assertEqual(manhat_dist(a, b), 1)
+
+    def test_path_through_gap(self):
+        path = self.planner.path((8, 1, 7))
+        self.check_path(path, (1, 1, 7), (8, 1, 7))
+        self.assertIn((5, 1, 2), path)
+        # shortest is 9 steps to the gap and 8 from it
+        self.assertEqual(len(path), 18)
+
+    def test_window_reused(self):
+        self.planner.path((8, 1, 7))
+        self.planner.path((8, 1, 7), pos=(3, 1, 7))
+        self.planner.path((7, 1, 8), approx=1)
+        self.assertEqual(self.agent.fetches, 1)
+
+    def test_blocks_changed(self):
+        self.planner.path((8, 1, 7))
+        # close the gap, then open a shortcut
+        self.agent.set_block((5, 1, 2), STONE)
+        self.planner.on_blocks_changed([((5, 1, 2), STONE)])
+        self.assertIsNone(self.planner.path((8, 1, 7)))
+        self.planner.on_blocks_changed([((5, 1, 7), AIR), ((5, 2, 7), AIR)])
+        self.assertEqual(len(self.planner.path((8, 1, 7))), 8)
+        self.assertEqual(self.agent.fetches, 1)
+
+    def test_reachable(self):
+        targets = [(8, 1, 7), (5, 3, 7), (3, 1, 3), (9, 4, 9)]
+        reachable = self.planner.reachable(targets, approx=0)
+        self.assertEqual(reachable.tolist(), [True, False, True, True])
+        self.planner.on_blocks_changed([((5, 1, 2), STONE)])
+        reachable = self.planner.reachable(targets, approx=2)
+        # the wall top is in reach from the near side, the far side is not
+        self.assertEqual(reachable.tolist(), [False, True, True, False])
+        for target, r in zip(targets, reachable):
+            self.assertEqual(self.planner.path(target, approx=2) is not None, r)
+
+
+if __name__ == "__main__":
+    unittest.main()
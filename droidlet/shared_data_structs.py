@@ -118,6 +118,8 @@ class MockOpt:
         self.ground_truth_data_dir = ""
         self.semseg_model_path = ""
         self.no_ground_truth = True
+        self.nsp_parse_cache_size = 1024
+        self.nsp_parse_cache_path = ""
         self.mark_airtouching_blocks = False
         # test does not instantiate cpp client
         self.port = -1
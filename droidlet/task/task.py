@@ -117,19 +117,18 @@ class Task(object):
     @staticmethod
     def step_wrapper(stepfn):
         def modified_step(self):
+            # the agent's scheduler keeps TaskNodes of the live tasks, don't read
+            # (and unpickle) this one again if it has it
+            node = self.get_scheduler_node()
             if self.finished:
-                TaskNode(self.agent.memory, self.memid).get_update_status(
-                    {"prio": -2, "finished": True}
-                )
+                node = node or TaskNode(self.agent.memory, self.memid)
+                node.get_update_status({"prio": -2, "finished": True})
                 return
-            query = "SELECT MEMORY FROM Task WHERE ((prio>=1) AND (_has_parent_task=#={}))".format(
-                self.memid
-            )
-            _, child_task_mems = self.agent.memory.basic_search(query)
-            if child_task_mems:  # this task has active children, step them
+            if self.has_active_children(node):  # this task has active children, step them
                 return
             r = stepfn(self)
-            TaskNode(self.agent.memory, self.memid).update_task(task=self)
+            node = node or TaskNode(self.agent.memory, self.memid)
+            node.update_task(task=self)
             return
 
         return modified_step
@@ -138,6 +137,25 @@ class Task(object):
         """The actual execution of a single step of the task is defined here."""
         pass
 
+    def get_scheduler_node(self):
+        """The agent's scheduler's TaskNode for this task, or None"""
+        scheduler = getattr(self.agent, "scheduler", None)
+        if scheduler is None:
+            return None
+        return scheduler.get_node(self.memid)
+
+    def has_active_children(self, node=None):
+        """Check if this task has children with prio >= 1, i.e. children that will be stepped
+        instead of it.  node is the scheduler's TaskNode of this task, if it has one
+        """
+        if node is not None:
+            return self.agent.scheduler.has_active_children(self.memid)
+        query = "SELECT MEMORY FROM Task WHERE ((prio>=1) AND (_has_parent_task=#={}))".format(
+            self.memid
+        )
+        _, child_task_mems = self.agent.memory.basic_search(query)
+        return len(child_task_mems) > 0
+
     # FIXME remove all this its dead now...
     def interrupt(self):
         """Interrupt the task and set the flag"""
@@ -241,12 +259,8 @@ class ControlBlock(Task):
             for task_mem in self_mem.all_descendent_tasks(include_root=True):
                 task_mem.get_update_status({"finished": True})
             return
-        query = "SELECT MEMORY FROM Task WHERE ((prio>=1) AND (_has_parent_task=#={}))".format(
-            self.memid
-        )
-        _, child_task_mems = self.agent.memory.basic_search(query)
-        if (
-            child_task_mems
+        if self.has_active_children(
+            self.get_scheduler_node()
         ):  # this task has active children, don't step self, let agent step children
             return
 
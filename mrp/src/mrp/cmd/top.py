@@ -0,0 +1,111 @@
+from mrp import life_cycle
+from mrp import metrics
+from mrp.cmd import _autocomplete
+import a0
+import click
+import sys
+import threading
+import time
+
+
+def format_value(field, value):
+    if field in ["rss", "vms"]:
+        return f"{value / 2**20:.1f}M"
+    if field == "cpu_percent":
+        return f"{value:.1f}"
+    return f"{value:.0f}"
+
+
+def render(samples):
+    names = sorted(samples)
+    fields = []
+    for name in names:
+        fields.extend(field for field in samples[name] if field not in fields)
+
+    rows = [["name"] + fields]
+    for name in names:
+        rows.append(
+            [name]
+            + [
+                format_value(field, samples[name][field])
+                if field in samples[name]
+                else "-"
+                for field in fields
+            ]
+        )
+
+    widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]))]
+    return "\n".join(
+        "  ".join(
+            [row[0].ljust(widths[0])]
+            + [cell.rjust(width) for cell, width in zip(row[1:], widths[1:])]
+        )
+        for row in rows
+    )
+
+
+@click.command()
+@click.argument("procs", nargs=-1, shell_complete=_autocomplete.running_processes)
+@click.option(
+    "-d", "--delay", type=float, default=1.0, help="Seconds between refreshes."
+)
+@click.option(
+    "-n",
+    "--iterations",
+    type=int,
+    default=0,
+    help="Number of refreshes before exiting. 0 runs until interrupted.",
+)
+def cli(*cmd_procs, procs=None, delay=1.0, iterations=0):
+    procs = procs or []
+
+    # Support procs as *args when using cmd syntax.
+    procs += cmd_procs
+
+    state = life_cycle.system_state()
+    names = [
+        name
+        for name, info in state.procs.items()
+        if info.state != life_cycle.State.STOPPED
+    ]
+    if procs:
+        names = [name for name in names if name in procs]
+    if not names:
+        click.echo("No processes found.")
+        return
+
+    lock = threading.Lock()
+    samples = {}
+
+    def make_callback(name):
+        def callback(pkt):
+            sample = metrics.decode(pkt)
+            with lock:
+                samples[name] = sample
+
+        return callback
+
+    # Only the newest sample of each process is decoded.
+    subs = [  # noqa: F841
+        a0.Subscriber(
+            metrics.topic(name),
+            a0.INIT_MOST_RECENT,
+            a0.ITER_NEWEST,
+            make_callback(name),
+        )
+        for name in names
+    ]
+
+    interactive = sys.stdout.isatty()
+    iteration = 0
+    try:
+        while not iterations or iteration < iterations:
+            time.sleep(delay)
+            iteration += 1
+            with lock:
+                table = render(samples) if samples else "No metrics yet."
+            if interactive:
+                click.clear()
+            click.echo(table)
+    except KeyboardInterrupt:
+        pass
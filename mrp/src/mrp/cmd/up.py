@@ -5,9 +5,11 @@ from mrp.cmd import _autocomplete
 import a0
 import asyncio
 import click
+import concurrent.futures
 import contextlib
 import json
 import os
+import sys
 import threading
 import traceback
 import types
@@ -87,6 +89,235 @@ def down_existing(names: typing.List[str], force: bool):
         raise RuntimeError("Existing processes did not down in a timely manner.")
 
 
+def dependency_graph(names) -> typing.Dict[str, typing.List[str]]:
+    """Map each process to the processes it depends on, restricted to names.
+
+    Raises ValueError if the dependencies have a cycle.
+    """
+    deps = {
+        name: [dep for dep in process_def.defined_processes[name].deps if dep in names]
+        for name in names
+    }
+
+    # Kahn's algorithm, only to detect cycles.
+    num_deps = {name: len(set(name_deps)) for name, name_deps in deps.items()}
+    dependents = {name: set() for name in names}
+    for name, name_deps in deps.items():
+        for dep in name_deps:
+            dependents[dep].add(name)
+    fringe = [name for name, n in num_deps.items() if n == 0]
+    num_visited = 0
+    while fringe:
+        name = fringe.pop()
+        num_visited += 1
+        for dependent in dependents[name]:
+            num_deps[dependent] -= 1
+            if num_deps[dependent] == 0:
+                fringe.append(dependent)
+    if num_visited != len(names):
+        cycle = [name for name, n in num_deps.items() if n > 0]
+        raise ValueError(f"Dependency cycle between: {', '.join(sorted(cycle))}")
+
+    return deps
+
+
+class BuildOutput:
+    """Writes the output of each build thread prefixed with the name of its process.
+
+    Lines are written whole, under a lock, so concurrent builds don't interleave
+    within a line. Output from other threads is passed through.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    @contextlib.contextmanager
+    def prefixed(self, name):
+        self.local.name = name
+        self.local.partial = ""
+        try:
+            yield
+        finally:
+            if self.local.partial:
+                self.write("\n")
+            self.local.name = None
+
+    def write(self, text):
+        name = getattr(self.local, "name", None)
+        if name is None:
+            with self.lock:
+                return self.stream.write(text)
+        *lines, self.local.partial = (self.local.partial + text).split("\n")
+        if lines:
+            with self.lock:
+                for line in lines:
+                    self.stream.write(f"[{name}] {line}\n")
+        return len(text)
+
+    def flush(self):
+        self.stream.flush()
+
+    def __getattr__(self, attr):
+        return getattr(self.stream, attr)
+
+
+def build_procs(names, cache: bool, verbose: bool, jobs: int):
+    """Build the runtimes of the processes concurrently.
+
+    A process is built once the processes it depends on are built.
+    If a build fails, no new builds are started and the error is raised
+    once the running builds are done.
+    """
+    deps = dependency_graph(names)
+
+    output = BuildOutput(sys.stdout)
+
+    def build(name):
+        proc_def = process_def.defined_processes[name]
+        with output.prefixed(name):
+            click.echo(f"building {name}...")
+            proc_def.runtime._build(name, proc_def, cache, verbose)
+            click.echo(f"built {name}")
+
+    built = set()
+    running = {}
+    error = None
+    with contextlib.redirect_stdout(output), concurrent.futures.ThreadPoolExecutor(
+        jobs or len(names)
+    ) as pool:
+        while True:
+            if error is None:
+                for name in names:
+                    if (
+                        name not in built
+                        and name not in running.values()
+                        and all(dep in built for dep in deps[name])
+                    ):
+                        running[pool.submit(build, name)] = name
+            if not running:
+                break
+
+            done, _ = concurrent.futures.wait(
+                running, return_when=concurrent.futures.FIRST_COMPLETED
+            )
+            for future in done:
+                name = running.pop(future)
+                if future.exception() is not None:
+                    error = error or future.exception()
+                else:
+                    built.add(name)
+
+    if error is not None:
+        raise error
+
+
+def launch_proc(name):
+    """Fork a detached launcher for the process."""
+    click.echo(f"running {name}...")
+    life_cycle.set_ask(name, life_cycle.Ask.UP)
+    life_cycle.set_state(name, life_cycle.State.STARTING)
+
+    if os.fork() != 0:
+        return
+
+    os.chdir("/")
+    os.setsid()
+    os.umask(0)
+
+    if os.fork() != 0:
+        os._exit(0)  # use this instead of sys.exit in child process
+
+    proc_def = process_def.defined_processes[name]
+
+    # Set up configuration.
+    with util.common_env_context(proc_def):
+        a0.Cfg(a0.env.topic()).write(json.dumps(proc_def.cfg))
+
+        with open(f"/tmp/mrp_{name}.log", "w", buffering=1) as logfile:
+            with contextlib.redirect_stdout(logfile), contextlib.redirect_stderr(
+                logfile
+            ):
+                click.echo(f"-- Process start time {a0.TimeWall.now()}")
+                life_cycle.set_launcher_running(name, True)
+                try:
+                    asyncio.run(proc_def.runtime._launcher(name, proc_def).run())
+                except BaseException as e:
+                    click.echo(f"FATAL: {e}")
+                    traceback.print_exc()
+                life_cycle.set_launcher_running(name, False)
+                os._exit(0)  # use this instead of sys.exit in child process
+
+
+def wait_started(names, timeout: float):
+    """Wait until at least one of the processes has started.
+
+    A process that already stopped again counts as started.
+    Returns the set of started processes.
+    """
+
+    def find_started(system_state):
+        return {
+            name
+            for name in names
+            if name in system_state.procs
+            and system_state.procs[name].state != life_cycle.State.STARTING
+        }
+
+    ns = types.SimpleNamespace()
+    ns.cv = threading.Condition()
+    ns.started = set()
+
+    def callback(system_state):
+        started = find_started(system_state)
+        if started:
+            with ns.cv:
+                ns.started = started
+                ns.cv.notify()
+
+    watcher = life_cycle.system_state_watcher(callback)  # noqa: F841
+
+    with ns.cv:
+        success = ns.cv.wait_for(lambda: ns.started, timeout=timeout or None)
+    del watcher
+
+    if not success:
+        raise RuntimeError(
+            f"Timed out waiting for {', '.join(sorted(names))} to start."
+        )
+    return ns.started
+
+
+def launch_procs(names, timeout: float):
+    """Launch the processes in dependency order.
+
+    A process is launched once the processes it depends on have started.
+    """
+    deps = dependency_graph(names)
+
+    launched = set()
+    started = set()
+    while True:
+        # Note: the state watcher is not alive while forking.
+        for name in names:
+            if name not in launched and all(dep in started for dep in deps[name]):
+                launch_proc(name)
+                launched.add(name)
+        if len(launched) == len(names):
+            return
+
+        # Only wait for the processes others are waiting for.
+        blocking = {
+            dep
+            for name in names
+            if name not in launched
+            for dep in deps[name]
+            if dep not in started
+        }
+        started |= wait_started(blocking & launched, timeout)
+
+
 @click.command()
 @click.argument("procs", nargs=-1, shell_complete=_autocomplete.defined_processes)
 @click.option("-v/-q", "--verbose/--quiet", is_flag=True, default=True)
@@ -96,6 +327,14 @@ def down_existing(names: typing.List[str], force: bool):
 @click.option("--run/--norun", is_flag=True, default=True)
 @click.option("-f", "--force/--noforce", is_flag=True, default=False)
 @click.option("--reset_logs", is_flag=True, default=False)
+@click.option("-j", "--jobs", type=int, default=0, help="Max concurrent builds.")
+@click.option(
+    "-t",
+    "--timeout",
+    type=float,
+    default=60.0,
+    help="Max seconds to wait for a dependency to start.",
+)
 def cli(
     *cmd_procs,
     procs=None,
@@ -106,6 +345,8 @@ def cli(
     run=True,
     force=False,
     reset_logs=False,
+    jobs=0,
+    timeout=60.0,
 ):
     procs = procs or []
 
@@ -124,46 +365,7 @@ def cli(
             a0.File.remove(f"{name}.log.a0")
 
     if build:
-        for name in names:
-            proc_def = process_def.defined_processes[name]
-            click.echo(f"building {name}...")
-            proc_def.runtime._build(name, proc_def, cache, verbose)
-            click.echo(f"built {name}\n")
+        build_procs(names, cache, verbose, jobs)
 
     if run:
-        for name in names:
-            click.echo(f"running {name}...")
-            life_cycle.set_ask(name, life_cycle.Ask.UP)
-            life_cycle.set_state(name, life_cycle.State.STARTING)
-
-            if os.fork() != 0:
-                continue
-
-            os.chdir("/")
-            os.setsid()
-            os.umask(0)
-
-            if os.fork() != 0:
-                os._exit(0)  # use this instead of sys.exit in child process
-
-            proc_def = process_def.defined_processes[name]
-
-            # Set up configuration.
-            with util.common_env_context(proc_def):
-                a0.Cfg(a0.env.topic()).write(json.dumps(proc_def.cfg))
-
-                with open(f"/tmp/mrp_{name}.log", "w", buffering=1) as logfile:
-                    with contextlib.redirect_stdout(
-                        logfile
-                    ), contextlib.redirect_stderr(logfile):
-                        click.echo(f"-- Process start time {a0.TimeWall.now()}")
-                        life_cycle.set_launcher_running(name, True)
-                        try:
-                            asyncio.run(
-                                proc_def.runtime._launcher(name, proc_def).run()
-                            )
-                        except BaseException as e:
-                            click.echo(f"FATAL: {e}")
-                            traceback.print_exc()
-                        life_cycle.set_launcher_running(name, False)
-                        os._exit(0)  # use this instead of sys.exit in child process
+        launch_procs(names, timeout)
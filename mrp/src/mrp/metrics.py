@@ -0,0 +1,108 @@
+"""Process metrics, sampled by the launchers and published over alephzero.
+
+Each launcher samples the process tree of its process (the process and all of
+its descendants) and publishes the summed fields to the topic mrp/metrics/<name>.
+
+Sampling is configured by the environment of `mrp up`:
+    MRP_METRICS_INTERVAL: seconds between samples, default 1. 0 disables sampling.
+    MRP_METRICS_FIELDS: comma separated subset of FIELDS, default all of them.
+
+Packets hold the sample as little-endian doubles, in the order given by the
+"mrp-metrics-fields" header. Use decode to read them.
+"""
+
+from mrp import util
+import a0
+import os
+import psutil
+import struct
+import typing
+
+CONTENT_TYPE = "application/x-mrp-metrics"
+FIELDS_HEADER = "mrp-metrics-fields"
+
+DEFAULT_INTERVAL = 1.0
+
+# Cheap per-process fields, read from /proc/<pid>/stat and /proc/<pid>/statm.
+# Expensive ones, like open files and connections, are left out on purpose.
+FIELDS = {
+    "cpu_percent": lambda proc: proc.cpu_percent(),
+    "rss": lambda proc: proc.memory_info().rss,
+    "vms": lambda proc: proc.memory_info().vms,
+    "num_threads": lambda proc: proc.num_threads(),
+}
+
+
+def topic(name: str) -> str:
+    return f"mrp/metrics/{name}"
+
+
+def interval_from_env() -> float:
+    return float(os.environ.get("MRP_METRICS_INTERVAL", DEFAULT_INTERVAL))
+
+
+def fields_from_env() -> typing.List[str]:
+    fields = os.environ.get("MRP_METRICS_FIELDS")
+    if not fields:
+        return list(FIELDS)
+    fields = [field.strip() for field in fields.split(",")]
+    unknown = [field for field in fields if field not in FIELDS]
+    if unknown:
+        raise ValueError(f"Unknown metrics fields: {', '.join(unknown)}")
+    return fields
+
+
+def process_tree(pid: int) -> typing.List[int]:
+    """The pid and the pids of all its descendants."""
+    pids = [pid]
+    for parent in pids:
+        pids.extend(util.pid_children(parent))
+    return pids
+
+
+class Sampler:
+    """Samples the summed fields of a process tree.
+
+    psutil.Process objects are kept between samples, which cpu_percent needs
+    to measure the cpu time used since the previous sample.
+    """
+
+    def __init__(self, fields: typing.List[str]):
+        self.fields = fields
+        self.procs: typing.Dict[int, psutil.Process] = {}
+
+    def sample(self, pid: int) -> dict:
+        sample = {"num_procs": 0}
+        sample.update({field: 0 for field in self.fields})
+
+        procs = {}
+        for child_pid in process_tree(pid):
+            proc = self.procs.get(child_pid)
+            try:
+                if proc is None or not proc.is_running():
+                    proc = psutil.Process(child_pid)
+                with proc.oneshot():
+                    values = [FIELDS[field](proc) for field in self.fields]
+            except (psutil.NoSuchProcess, psutil.AccessDenied):
+                continue
+            procs[child_pid] = proc
+            sample["num_procs"] += 1
+            for field, value in zip(self.fields, values):
+                sample[field] += value
+
+        # Forget the processes that exited.
+        self.procs = procs
+        return sample
+
+
+def encode(sample: dict) -> a0.Packet:
+    names = list(sample)
+    return a0.Packet(
+        [("content-type", CONTENT_TYPE), (FIELDS_HEADER, ",".join(names))],
+        struct.pack(f"<{len(names)}d", *sample.values()),
+    )
+
+
+def decode(pkt: a0.Packet) -> dict:
+    names = dict(pkt.headers)[FIELDS_HEADER].split(",")
+    return dict(zip(names, struct.unpack(f"<{len(names)}d", pkt.payload)))
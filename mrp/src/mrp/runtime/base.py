@@ -1,34 +1,10 @@
 from mrp import life_cycle
+from mrp import metrics
 from mrp.process_def import ProcDef
 import a0
 import asyncio
 import contextlib
-import json
 import pathlib
-import psutil
-
-
-# psutil as_dict() does not produce a json-serializable dict.
-# https://github.com/giampaolo/psutil/issues/967
-#
-# When converted to a dict, fields like memory_info generate
-#     [11984896, 31031296, ...]
-# instead of
-#     {"rss": 11984896, "vms": 31031296, ...}
-# Losing field names.
-#
-# We cannot use a custom JSONEncoder, since psutil objects, like memory_info,
-# inherit from tuples.
-#
-# This is a workaround.
-def _walk_asdict(obj):
-    if hasattr(obj, "_asdict"):
-        return _walk_asdict(obj._asdict())
-    if isinstance(obj, dict):
-        return {k: _walk_asdict(v) for k, v in obj.items()}
-    if isinstance(obj, list):
-        return [_walk_asdict(v) for v in obj]
-    return obj
 
 
 class BaseLauncher:
@@ -48,6 +24,12 @@ class BaseLauncher:
                 break
 
     async def log_psutil(self):
+        """Publish the metrics of the process tree until down is requested."""
+        interval = metrics.interval_from_env()
+        if interval <= 0:
+            return
+        sampler = metrics.Sampler(metrics.fields_from_env())
+
         down_requested_event = asyncio.Event()
 
         async def ondown():
@@ -55,11 +37,10 @@ class BaseLauncher:
 
         asyncio.ensure_future(self.down_watcher(ondown))
 
-        out = a0.Publisher(f"mrp/psutil/{self.name}")
+        out = a0.Publisher(metrics.topic(self.name))
         while True:
             with contextlib.suppress(asyncio.TimeoutError):
-                # TODO(lshamis): Make polling interval configurable.
-                await asyncio.wait_for(down_requested_event.wait(), 1.0)
+                await asyncio.wait_for(down_requested_event.wait(), interval)
             if down_requested_event.is_set():
                 break
             pid = self.get_pid()
@@ -67,15 +48,9 @@ class BaseLauncher:
                 # Note: Likely being restarted.
                 continue
 
-            try:
-                proc = psutil.Process(pid)
-                pkt = a0.Packet(
-                    [("content-type", "application/json")],
-                    json.dumps(_walk_asdict(proc.as_dict())),
-                )
-                out.pub(pkt)
-            except psutil.NoSuchProcess:
-                pass
+            sample = sampler.sample(pid)
+            if sample["num_procs"]:
+                out.pub(metrics.encode(sample))
 
 
 class BaseRuntime:
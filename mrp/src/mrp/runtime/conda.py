@@ -11,6 +11,7 @@ import pathlib
 import shutil
 import signal
 import subprocess
+import threading
 import typing
 import yaml as pyyaml
 
@@ -79,6 +80,41 @@ class CondaEnv:
                 return
 
 
+# Variables that change with every shell, rather than with activation.
+SHELL_ENVVARS = ["_", "OLDPWD", "PWD", "SHLVL"]
+
+
+def activation_diff(base_env: dict, activated_env: dict) -> dict:
+    """The changes made to base_env by activating a conda env.
+
+    Variables whose activated value extends the base value, like PATH, are
+    recorded as a prefix so the diff can be applied to a different base env.
+    """
+    diff = {"set": {}, "prepend": {}, "unset": []}
+    for key, val in activated_env.items():
+        if key in SHELL_ENVVARS or base_env.get(key) == val:
+            continue
+        if base_env.get(key) and val.endswith(base_env[key]):
+            diff["prepend"][key] = val[: -len(base_env[key])]
+        else:
+            diff["set"][key] = val
+    for key in base_env:
+        if key not in activated_env and key not in SHELL_ENVVARS:
+            diff["unset"].append(key)
+    return diff
+
+
+def apply_activation_diff(env: dict, diff: dict) -> dict:
+    """Apply a diff from activation_diff to env, without running conda."""
+    env = dict(env)
+    for key in diff["unset"]:
+        env.pop(key, None)
+    for key, prefix in diff["prepend"].items():
+        env[key] = prefix + env.get(key, "")
+    env.update(diff["set"])
+    return env
+
+
 class Launcher(BaseLauncher):
     def __init__(
         self,
@@ -86,18 +122,27 @@ class Launcher(BaseLauncher):
         name: str,
         env_name: str,
         proc_def: ProcDef,
+        activation: typing.Optional[dict] = None,
     ):
         self.run_command = run_command
         self.name = name
         self.env_name = env_name
         self.proc_def = proc_def
+        self.activation = activation
 
     async def envvar_for_conda(self) -> dict:
-        """Detect the envvar set by conda for our env."""
-        # We grab the conda env variables separate from executing the run
-        # command to simplify detecting pid and removing some race conditions.
+        """Detect the envvar set by conda for our env.
+
+        Uses the activation captured at build time, if any. Otherwise, runs
+        conda activate in a shell, which takes a few seconds.
+        """
         subprocess_env = os.environ.copy()
         subprocess_env.update(self.proc_def.env)
+        if self.activation is not None:
+            return apply_activation_diff(subprocess_env, self.activation["diff"])
+
+        # We grab the conda env variables separate from executing the run
+        # command to simplify detecting pid and removing some race conditions.
         envvar_file = f"/tmp/mrp_conda_{self.name}.env"
         envvar_info = await asyncio.create_subprocess_shell(
             f"""
@@ -136,7 +181,7 @@ class Launcher(BaseLauncher):
 
         This includes:
         - piping stdout and stderr to the alephzero logger.
-        - logging the processes psutil stats.
+        - publishing the process metrics.
         - watching for process death.
         - watching for user down request.
         """
@@ -236,6 +281,8 @@ class Conda(BaseRuntime):
             )
             self.setup_commands = setup_commands
             self._built = False
+            # Processes sharing the env may be built concurrently.
+            self._build_lock = threading.Lock()
 
             if use_named_env:
                 self._validate_use_named_env()
@@ -298,14 +345,63 @@ class Conda(BaseRuntime):
         def _conda_history_snapshot_path(self):
             return os.path.join(self._config_path(), "history.snapshot")
 
-        def _conda_history_path(self):
+        def _activation_snapshot_path(self):
+            return os.path.join(self._config_path(), "activation.snapshot")
+
+        def _conda_prefix(self):
+            activation = self._load_activation()
+            if activation and activation.get("prefix"):
+                return activation["prefix"]
             info = json.loads(
                 subprocess.check_output(
                     ["conda", "env", "export", "--json", "-n", self._env_name()]
                 )
             )
+            return info["prefix"]
+
+        def _conda_history_path(self):
+            return os.path.join(self._conda_prefix(), "conda-meta/history")
+
+        def _capture_activation(self, root: pathlib.Path):
+            """Snapshot the changes conda activate makes to the environment."""
+            base_env = os.environ.copy()
+            result = subprocess.run(
+                f"""
+                    eval "$(conda shell.bash hook)"
+                    conda activate {self._env_name()}
+                    cat /proc/self/environ
+                """,
+                shell=True,
+                executable="/bin/bash",
+                cwd=root,
+                env=base_env,
+                capture_output=True,
+            )
+            if result.returncode:
+                raise RuntimeError(f"Failed to activate conda env: {result.stderr}")
 
-            return os.path.join(info["prefix"], "conda-meta/history")
+            lines = result.stdout.decode().split("\0")
+            activated_env = dict(line.split("=", 1) for line in lines if "=" in line)
+            json.dump(
+                {
+                    "prefix": activated_env.get("CONDA_PREFIX"),
+                    "diff": activation_diff(base_env, activated_env),
+                },
+                open(self._activation_snapshot_path(), "w"),
+            )
+
+        def _load_activation(self) -> typing.Optional[dict]:
+            """The activation captured by the last build, if any."""
+            try:
+                return json.load(open(self._activation_snapshot_path()))
+            except (OSError, ValueError):
+                return None
+
+        def _remove_activation(self):
+            try:
+                os.remove(self._activation_snapshot_path())
+            except FileNotFoundError:
+                pass
 
         def _cache_valid(self, env_content):
             try:
@@ -342,8 +438,13 @@ class Conda(BaseRuntime):
             env_content["name"] = self._env_name()
 
             if cache and self._cache_valid(env_content):
+                if self._load_activation() is None:
+                    self._capture_activation(root)
                 return
 
+            # The env is recreated, so is its activation.
+            self._remove_activation()
+
             with open(yaml_path, "w") as env_fp:
                 json.dump(env_content, env_fp, indent=2)
 
@@ -354,13 +455,11 @@ class Conda(BaseRuntime):
             update_bin = "mamba" if self.use_mamba else "conda"
             # https://github.com/conda/conda/issues/7279
             # Updating an existing environment does not remove old packages, even with --prune.
-            subprocess.run(
-                [update_bin, "env", "remove", "-n", self._env_name()],
-                capture_output=not verbose,
+            util.run_command(
+                [update_bin, "env", "remove", "-n", self._env_name()], verbose
             )
-            result = subprocess.run(
-                [update_bin, "env", "update", "--prune", "-f", yaml_path],
-                capture_output=not verbose,
+            result = util.run_command(
+                [update_bin, "env", "update", "--prune", "-f", yaml_path], verbose
             )
             if result.returncode:
                 raise RuntimeError(f"Failed to set up conda env: {result.stderr}")
@@ -370,16 +469,16 @@ class Conda(BaseRuntime):
             setup_command = "\n".join(
                 [util.shell_join(cmd) for cmd in self.setup_commands]
             )
-            result = subprocess.run(
+            result = util.run_command(
                 f"""
                     eval "$(conda shell.bash hook)"
                     conda activate {self._env_name()}
                     cd {root}
                     {setup_command}
                 """,
+                verbose,
                 shell=True,
                 executable="/bin/bash",
-                capture_output=not verbose,
             )
             if result.returncode:
                 raise RuntimeError(f"Failed to set up conda env: {result.stderr}")
@@ -391,13 +490,18 @@ class Conda(BaseRuntime):
             json.dump(
                 self.setup_commands, open(self._setup_commands_snapshot_path(), "w")
             )
+            self._capture_activation(root)
 
         def _build(self, root: pathlib.Path, cache: bool, verbose: bool):
-            if self._built:
-                return
-            if not self.use_named_env:
-                self._create_env(root, cache, verbose)
-            self._built = True
+            with self._build_lock:
+                if self._built:
+                    return
+                if self.use_named_env:
+                    # Named envs are managed outside of mrp and may have changed.
+                    self._capture_activation(root)
+                else:
+                    self._create_env(root, cache, verbose)
+                self._built = True
 
     def __init__(
         self,
@@ -466,7 +570,13 @@ class Conda(BaseRuntime):
     def _launcher(self, name: str, proc_def: ProcDef):
         if self._env.name == "__defer__":
             self._env.name = name
-        return Launcher(self.run_command, name, self._env._env_name(), proc_def)
+        return Launcher(
+            self.run_command,
+            name,
+            self._env._env_name(),
+            proc_def,
+            self._env._load_activation(),
+        )
 
 
 __all__ = ["Conda"]
@@ -6,7 +6,6 @@ import asyncio
 import os
 import pathlib
 import signal
-import subprocess
 import typing
 
 
@@ -117,11 +116,11 @@ class Host(BaseRuntime):
             build_command = "\n".join(
                 [util.shell_join(cmd) for cmd in self.build_commands]
             )
-            result = subprocess.run(
+            result = util.run_command(
                 build_command,
+                verbose,
                 shell=True,
                 executable="/bin/bash",
-                capture_output=not verbose,
             )
             if result.returncode:
                 raise RuntimeError(f"Failed to build: {result.stderr}")
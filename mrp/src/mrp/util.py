@@ -50,8 +50,9 @@ def stderr_logger():
 def pid_children(pid):
     for fname in glob.glob(f"/proc/{pid}/task/*/children"):
         with open(fname) as file:
-            for line in file:
-                yield int(line)
+            # Space separated, with a trailing space.
+            for child in file.read().split():
+                yield int(child)
 
 
 def is_ldap_user():
@@ -92,6 +93,26 @@ class NoEscape:
         self.value = val
 
 
+def run_command(args, verbose, **kwargs):
+    """subprocess.run, echoing the output line by line through sys.stdout if verbose.
+
+    The output of a quiet command is captured, as with capture_output=True.
+    """
+    if not verbose:
+        return subprocess.run(args, capture_output=True, **kwargs)
+    with subprocess.Popen(
+        args,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        text=True,
+        errors="replace",
+        **kwargs,
+    ) as proc:
+        for line in proc.stdout:
+            print(line, end="")
+    return subprocess.CompletedProcess(args, proc.returncode)
+
+
 def shell_join(items):
     """Modified version of shlex.join that allows for non-escaped segments."""
     return " ".join(
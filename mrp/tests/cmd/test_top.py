@@ -0,0 +1,39 @@
+import os
+import pytest
+
+import mrp
+
+
+@pytest.fixture
+def metrics_proc():
+    mrp.process_def.defined_processes.clear()
+    mrp.process(name="proc", runtime=mrp.Host(run_command=["sleep", "999"]))
+
+    # The launcher inherits the sampling configuration.
+    os.environ["MRP_METRICS_INTERVAL"] = "0.1"
+    os.environ["MRP_METRICS_FIELDS"] = "rss,num_threads"
+    try:
+        mrp.cmd.up("proc", reset_logs=True)
+    finally:
+        del os.environ["MRP_METRICS_INTERVAL"]
+        del os.environ["MRP_METRICS_FIELDS"]
+    yield
+    mrp.cmd.down(wait=True)
+    mrp.process_def.defined_processes.clear()
+
+
+def test_top(metrics_proc, capsys):
+    mrp.cmd.top("proc", delay=0.5, iterations=1)
+
+    header, row = capsys.readouterr().out.splitlines()
+    assert header.split() == ["name", "num_procs", "rss", "num_threads"]
+    name, num_procs, rss, num_threads = row.split()
+    assert name == "proc"
+    assert int(num_procs) >= 1
+    assert rss.endswith("M")
+    assert int(num_threads) >= 1
+
+
+def test_top_no_procs(capsys):
+    mrp.cmd.top("not_proc", iterations=1)
+    assert capsys.readouterr().out == "No processes found.\n"
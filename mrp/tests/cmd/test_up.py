@@ -0,0 +1,84 @@
+import pytest
+import sys
+import threading
+
+import mrp
+from mrp.life_cycle import State
+
+# mrp.cmd.up is the cli callback, the helpers live in the module it was loaded from.
+up = sys.modules[mrp.cmd.up.__module__]
+
+
+@pytest.fixture
+def reset():
+    # Reset defined processes.
+    mrp.process_def.defined_processes.clear()
+    yield
+    mrp.cmd.down(wait=True)
+    mrp.process_def.defined_processes.clear()
+
+
+class RecordingHost(mrp.Host):
+    lock = threading.Lock()
+    order = []
+
+    def _build(self, name, proc_def, cache, verbose):
+        with self.lock:
+            self.order.append(name)
+
+
+def test_dependency_cycle(reset):
+    mrp.process(name="a", runtime=mrp.Host(run_command=["true"]), deps=["b"])
+    mrp.process(name="b", runtime=mrp.Host(run_command=["true"]), deps=["a"])
+
+    with pytest.raises(ValueError):
+        up.dependency_graph(["a", "b"])
+
+
+def test_build_order(reset):
+    RecordingHost.order.clear()
+    mrp.process(name="base", runtime=RecordingHost(run_command=["true"]))
+    mrp.process(name="a", runtime=RecordingHost(run_command=["true"]), deps=["base"])
+    mrp.process(name="b", runtime=RecordingHost(run_command=["true"]), deps=["base"])
+    mrp.process(
+        name="top", runtime=RecordingHost(run_command=["true"]), deps=["a", "b"]
+    )
+
+    up.build_procs(["base", "a", "b", "top"], cache=True, verbose=False, jobs=2)
+
+    order = RecordingHost.order
+    assert sorted(order) == ["a", "b", "base", "top"]
+    assert order[0] == "base"
+    assert order[-1] == "top"
+
+
+def test_launch_order(reset):
+    mrp.process(name="first", runtime=mrp.Host(run_command=["sleep", "999"]))
+    mrp.process(
+        name="second",
+        runtime=mrp.Host(run_command=["sleep", "999"]),
+        deps=["first"],
+    )
+
+    mrp.cmd.up("second", reset_logs=True)
+
+    # first must have started before second was launched.
+    procs = mrp.life_cycle.system_state().procs
+    assert procs["first"].state != State.STARTING
+    assert procs["second"].state in [State.STARTING, State.STARTED]
+
+
+def test_build_output_prefix(reset, capsys):
+    mrp.process(
+        name="a", runtime=mrp.Host(run_command=["true"], build_commands=[["echo", "A"]])
+    )
+    mrp.process(
+        name="b", runtime=mrp.Host(run_command=["true"], build_commands=[["echo", "B"]])
+    )
+
+    up.build_procs(["a", "b"], cache=True, verbose=True, jobs=2)
+
+    lines = capsys.readouterr().out.splitlines()
+    assert "[a] A" in lines
+    assert "[b] B" in lines
+    assert all(line.startswith("[a] ") or line.startswith("[b] ") for line in lines)
@@ -0,0 +1,55 @@
+import asyncio
+import mrp
+import mrp.process_def
+from mrp.runtime import conda
+
+
+def test_activation_diff():
+    base_env = {"PATH": "/usr/bin", "KEEP": "1", "DROP": "1", "SHLVL": "1"}
+    activated_env = {
+        "PATH": "/env/bin:/usr/bin",
+        "KEEP": "1",
+        "CONDA_PREFIX": "/env",
+        "SHLVL": "2",
+    }
+    diff = conda.activation_diff(base_env, activated_env)
+
+    assert diff == {
+        "set": {"CONDA_PREFIX": "/env"},
+        "prepend": {"PATH": "/env/bin:"},
+        "unset": ["DROP"],
+    }
+    assert conda.apply_activation_diff({"PATH": "/bin", "DROP": "1"}, diff) == {
+        "PATH": "/env/bin:/bin",
+        "CONDA_PREFIX": "/env",
+    }
+
+
+def test_cached_activation():
+    mrp.process_def.defined_processes.clear()
+
+    proc_def = mrp.process(
+        name="proc",
+        runtime=mrp.Conda(use_named_env="base", run_command=["env"]),
+        env={"foo": "bar"},
+    )
+    runtime = proc_def.runtime
+
+    runtime._env._remove_activation()
+    runtime._build("proc", proc_def, cache=True, verbose=False)
+    activation = runtime._env._load_activation()
+    assert activation["prefix"]
+
+    # The cached activation matches a fresh conda activate.
+    cached = runtime._launcher("proc", proc_def)
+    assert cached.activation == activation
+    uncached = conda.Launcher(["env"], "proc", "base", proc_def)
+
+    cached_env = asyncio.run(cached.envvar_for_conda())
+    uncached_env = asyncio.run(uncached.envvar_for_conda())
+    for key in conda.SHELL_ENVVARS:
+        cached_env.pop(key, None)
+        uncached_env.pop(key, None)
+    assert cached_env == uncached_env
+    assert cached_env["foo"] == "bar"
+    assert cached_env["CONDA_PREFIX"] == activation["prefix"]
@@ -0,0 +1,27 @@
+import subprocess
+import time
+
+from mrp import metrics
+
+
+def test_sample_process_tree():
+    # A shell with two children.
+    proc = subprocess.Popen(["bash", "-c", "sleep 10 & sleep 10 & wait"])
+    try:
+        time.sleep(0.2)
+        sampler = metrics.Sampler(["rss", "num_threads"])
+        sample = sampler.sample(proc.pid)
+    finally:
+        proc.kill()
+        proc.wait()
+
+    assert sample["num_procs"] == 3
+    assert sample["num_threads"] >= 3
+    assert sample["rss"] > 0
+
+
+def test_encode_decode():
+    sample = {"num_procs": 2, "cpu_percent": 12.5, "rss": 2**30}
+    pkt = metrics.encode(sample)
+    assert len(pkt.payload) == 8 * len(sample)
+    assert metrics.decode(pkt) == sample
@@ -1,5 +1,5 @@
 from .camera import MarkerInfo, CameraIntrinsics
-from .camera import CameraModule
+from .camera import CameraModule, MultiCameraModule
 from .scene import Scene
 
 from . import utils
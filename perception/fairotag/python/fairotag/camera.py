@@ -1,12 +1,14 @@
-from typing import Dict
+from typing import Dict, List
 
 import copy
 import pickle
-from collections import namedtuple
+from collections import defaultdict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
 
 import numpy as np
 import sophus as sp
 import cv2
+from scipy.spatial.transform import Rotation as R
 
 # Default parameters
 GRID_WIDTH = 5
@@ -38,6 +40,11 @@ class CameraModule:
         self.intrinsics = None
         self.registered_markers = {}
 
+        # Intrinsics matrix & distortion coeffs, cached for the current intrinsics
+        self._cached_intrinsics = None
+        self._intrinsics_matrix = None
+        self._dist_coeffs = None
+
     def register_marker_size(self, marker_id, length):
         """ Enable pose estimation of given marker ID by registering length of marker """
         self.registered_markers[marker_id] = length
@@ -55,35 +62,30 @@ class CameraModule:
         # Estimate pose of detected markers
         num_markers = len(corners)
         ids = ids.squeeze(-1)
+        poses = [None] * num_markers
+        lengths = [None] * num_markers
         if self.intrinsics is None:
             print(
                 "Warning: Intrinsics not set in CameraModule. Pose estimation of markers unavailble."
             )
 
         else:
-            poses = []
-            lengths = []
-            for id, corner in zip(ids, corners):
-                # No pose estimation if marker id not registered
-                if id not in self.registered_markers:
-                    poses.append(None)
-                    lengths.append(None)
-                    continue
-
-                # Pose estimation using registered length
-                length = self.registered_markers[id]
+            # Group registered markers by length (no pose estimation if marker id not registered)
+            marker_groups = defaultdict(list)
+            for i, id in enumerate(ids):
+                if id in self.registered_markers:
+                    marker_groups[self.registered_markers[id]].append(i)
+
+            # Pose estimation of all markers of the same length in one call
+            matrix, coeffs = self._get_intrinsics_matrix()
+            for length, idxs in marker_groups.items():
                 rvecs, tvecs, _ = cv2.aruco.estimatePoseSingleMarkers(
-                    corner,
-                    length,
-                    self._intrinsics2matrix(self.intrinsics),
-                    self.intrinsics.coeffs,
+                    [corners[i] for i in idxs], length, matrix, coeffs
                 )
-                r = rvecs[0].squeeze()
-                t = tvecs[0].squeeze()
-                pose = sp.SE3(sp.SO3.exp(r).matrix(), t)
-
-                lengths.append(length)
-                poses.append(pose)
+                rot_matrices = R.from_rotvec(rvecs.reshape(-1, 3)).as_matrix()
+                for i, rot_matrix, t in zip(idxs, rot_matrices, tvecs.reshape(-1, 3)):
+                    poses[i] = sp.SE3(rot_matrix, t)
+                    lengths[i] = length
 
         # Output
         markers = []
@@ -126,10 +128,11 @@ class CameraModule:
                 tvec = m.pose.translation()[None, :]
                 rvec = m.pose.so3().log()[None, :]
                 length = m.length / 2.0
+                matrix, coeffs = self._get_intrinsics_matrix()
                 img_rend = cv2.aruco.drawAxis(
                     img_rend,
-                    self._intrinsics2matrix(self.intrinsics),
-                    self.intrinsics.coeffs,
+                    matrix,
+                    coeffs,
                     rvec,
                     tvec,
                     length,
@@ -213,6 +216,15 @@ class CameraModule:
 
         self.intrinsics = CameraIntrinsics(fx, fy, ppx, ppy, coeffs)
 
+    def _get_intrinsics_matrix(self):
+        """Intrinsics matrix & distortion coeffs, recomputed only when the intrinsics change"""
+        if self._cached_intrinsics is not self.intrinsics:
+            self._intrinsics_matrix = self._intrinsics2matrix(self.intrinsics)
+            self._dist_coeffs = np.asarray(self.intrinsics.coeffs, dtype=np.float64)
+            self._cached_intrinsics = self.intrinsics
+
+        return self._intrinsics_matrix, self._dist_coeffs
+
     @staticmethod
     def _intrinsics2matrix(intrinsics):
         matrix = np.eye(3)
@@ -222,3 +234,33 @@ class CameraModule:
         matrix[1, 2] = intrinsics.ppy
 
         return matrix
+
+
+class MultiCameraModule:
+    """Detects markers in the images of several cameras in parallel
+
+    Detection runs on a thread pool (OpenCV releases the GIL while detecting), and the
+    markers of all cameras are returned together, in the format expected by
+    Scene.update_pose_estimations
+    """
+
+    def __init__(self, cameras: Dict[str, CameraModule], max_workers=None):
+        self.cameras = cameras
+        self._executor = ThreadPoolExecutor(max_workers=max_workers or max(len(cameras), 1))
+
+    def detect_markers(self, imgs: Dict[str, np.ndarray]) -> Dict[str, List[MarkerInfo]]:
+        """Detect markers in a synchronized set of images: camera name => img"""
+        futures = {
+            name: self._executor.submit(self.cameras[name].detect_markers, img)
+            for name, img in imgs.items()
+        }
+        return {name: future.result() for name, future in futures.items()}
+
+    def close(self):
+        self._executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
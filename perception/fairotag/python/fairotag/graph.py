@@ -5,9 +5,15 @@ import numpy as np
 import sophus as sp
 import gtsam
 
+try:
+    from gtsam import IncrementalFixedLagSmoother, FixedLagSmootherKeyTimestampMap
+except ImportError:  # gtsam < 4.2
+    from gtsam_unstable import IncrementalFixedLagSmoother, FixedLagSmootherKeyTimestampMap
+
 
 DEFAULT_HUBER_C = 1.345
-USE_ANALYTICAL_JACOBIANS = False
+USE_ANALYTICAL_JACOBIANS = True
+DEFAULT_RELINEARIZE_THRESHOLD = 0.01
 
 
 # Factor graph object
@@ -28,10 +34,6 @@ class FactorGraph:
 
         self.n_variables = 0
 
-        # TODOs for incremental smoothing:
-        # - maintain active values
-        # - update/delete factors
-
     @staticmethod
     def _process_noise(noise):
         if noise is None:
@@ -127,6 +129,86 @@ class FactorGraph:
         return {name: gtsam2sophus(result_values.atPose3(var)) for name, var in self.vars.items()}
 
 
+class IncrementalFactorGraph(FactorGraph):
+    """FactorGraph that is kept alive across timesteps and solved incrementally (iSAM2):
+    - Factors and variables added since the last update() are added to the smoother,
+      and only the affected part of the problem is re-solved
+    - Variables older than the sliding window (lag, in timesteps) are marginalized out,
+      so the cost of an update doesn't grow with the number of timesteps
+    - Static variables (see mark_static) are never marginalized
+    """
+
+    def __init__(self, lag, relinearize_threshold=DEFAULT_RELINEARIZE_THRESHOLD):
+        super().__init__()
+        params = gtsam.ISAM2Params()
+        params.setRelinearizeThreshold(relinearize_threshold)
+        params.relinearizeSkip = 1
+        self.smoother = IncrementalFixedLagSmoother(lag, params)
+        self.estimate = gtsam.Values()
+
+        self.timestep = 0
+        self.static_vars = set()
+        self.new_vars = set()
+
+    def init_variable(self, name, pose=sp.SE3()):
+        # Variables already in the smoother keep their estimate
+        if name in self.vars and self.vars[name] not in self.new_vars:
+            return
+        super().init_variable(name, pose)
+        self.new_vars.add(self.vars[name])
+
+    def mark_static(self, var_name):
+        self.static_vars.add(self.vars[var_name])
+
+    def _initialize_new_variables(self):
+        """Propagate the current estimates to the new variables through the new factors"""
+        queue = [
+            (var, self.estimate.atPose3(var))
+            for var in self.vars.values()
+            if var not in self.new_vars
+        ]
+        visited = set(var for var, _ in queue)
+
+        while queue:
+            curr_var, pose = queue.pop(0)
+            for next_var, transform in self.factor_edges[curr_var]:
+                if next_var not in visited and next_var in self.new_vars:
+                    self.values.update(next_var, pose * transform)
+                    visited.add(next_var)
+                    queue.append((next_var, pose * transform))
+
+    def update(self, n_iterations=1):
+        """Add the new factors & variables to the smoother and move to the next timestep"""
+        self._initialize_new_variables()
+
+        timestamps = FixedLagSmootherKeyTimestampMap()
+        for var in self.new_vars | self.static_vars:
+            timestamps.insert((var, float(self.timestep)))
+        self.smoother.update(self.gtsam_graph, self.values, timestamps)
+        for _ in range(n_iterations - 1):
+            self.smoother.update()
+        self.estimate = self.smoother.calculateEstimate()
+
+        # Clear new factors & values
+        self.gtsam_graph = gtsam.NonlinearFactorGraph()
+        self.values = gtsam.Values()
+        self.new_vars = set()
+        self.timestep += 1
+
+        # Forget marginalized variables
+        for name, var in list(self.vars.items()):
+            if not self.estimate.exists(var):
+                del self.vars[name]
+                del self.factor_edges[var]
+        for edges in self.factor_edges.values():
+            edges[:] = [(v, transform) for v, transform in edges if v in self.factor_edges]
+
+    def optimize(self, verbosity=0, n_iterations=1):
+        self.update(n_iterations=n_iterations)
+
+        return {name: gtsam2sophus(self.estimate.atPose3(var)) for name, var in self.vars.items()}
+
+
 # Helper functions
 def sophus2gtsam(pose):
     return gtsam.Pose3(pose.matrix())
@@ -138,24 +220,30 @@ def gtsam2sophus(pose):
 
 # Custom factor for frames
 def pose_jacobian_numerical(f, x, delta=1e-5):
+    """Jacobian of f w.r.t. a perturbation of x in its tangent space (x * Exp(delta)),
+    matching the gtsam.Pose3 retraction"""
     jac = np.zeros([6, 6])
     for i in range(6):
         delta_arr = np.zeros(6)
         delta_arr[i] = delta
-        pose_offset_p = gtsam.Pose3.Expmap(delta_arr) * x
-        pose_offset_n = gtsam.Pose3.Expmap(-delta_arr) * x
+        pose_offset_p = x * gtsam.Pose3.Expmap(delta_arr)
+        pose_offset_n = x * gtsam.Pose3.Expmap(-delta_arr)
         jac[:, i] = (f(pose_offset_p) - f(pose_offset_n)) / (2 * delta)
 
     return jac
 
 
-def pose_jacobian_analytical(f, x):  # TODO: Debug
-    jac = np.zeros([6, 6])
-    jac_x = gtsam.Pose3.LogmapDerivative(x)
-    for i in range(6):
-        jac[:, i] = f(gtsam.Pose3.Expmap(jac_x[:, i]))
+def frame_error_jacobians_analytical(pose0, pose1, pose2, error):
+    """Jacobians of error = Log(pose2^-1 * pose0^-1 * pose1) w.r.t. the three poses"""
+    pose_01 = pose0.between(pose1)
+    error_pose = pose2.between(pose_01)
+    jac_log = gtsam.Pose3.LogmapDerivative(error)
 
-    return jac
+    return [
+        -jac_log @ pose_01.inverse().AdjointMap(),
+        jac_log,
+        -jac_log @ error_pose.inverse().AdjointMap(),
+    ]
 
 
 def frame_error_func(this: gtsam.CustomFactor, v, H: Optional[List[np.ndarray]]):
@@ -174,21 +262,19 @@ def frame_error_func(this: gtsam.CustomFactor, v, H: Optional[List[np.ndarray]])
     # Compute Jacobians
     if H is not None:
         if USE_ANALYTICAL_JACOBIANS:
-            jac_func = pose_jacobian_analytical
+            H[0], H[1], H[2] = frame_error_jacobians_analytical(pose0, pose1, pose2, error)
         else:
-            jac_func = pose_jacobian_numerical
-
-        H[0] = jac_func(
-            lambda x: pose_err(x, pose1, pose2),
-            x=pose0,
-        )
-        H[1] = jac_func(
-            lambda x: pose_err(pose0, x, pose2),
-            x=pose1,
-        )
-        H[2] = jac_func(
-            lambda x: pose_err(pose0, pose1, x),
-            x=pose2,
-        )
+            H[0] = pose_jacobian_numerical(
+                lambda x: pose_err(x, pose1, pose2),
+                x=pose0,
+            )
+            H[1] = pose_jacobian_numerical(
+                lambda x: pose_err(pose0, x, pose2),
+                x=pose1,
+            )
+            H[2] = pose_jacobian_numerical(
+                lambda x: pose_err(pose0, pose1, x),
+                x=pose2,
+            )
 
     return error
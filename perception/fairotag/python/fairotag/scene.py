@@ -6,7 +6,7 @@ import numpy as np
 import sophus as sp
 
 from .camera import MarkerInfo
-from .graph import FactorGraph
+from .graph import FactorGraph, IncrementalFactorGraph
 from .viz import SceneViz
 
 
@@ -15,6 +15,10 @@ DEFAULT_CAMERA_SIZE = 0.08
 
 DEFAULT_CAMERA_NOISE = [0.01, 0.01, 0.05, 0.1, 0.1, 0.1]  # more uncertainty in z direction
 DEFAULT_CALIB_NOISE = [0.002, 0.002, 0.002, 0.02, 0.02, 0.02]
+DEFAULT_MOTION_NOISE = [0.05, 0.05, 0.05, 0.2, 0.2, 0.2]  # frame motion between timesteps
+
+DEFAULT_TRACKING_WINDOW = 10
+DEFAULT_TRACKING_ITERATIONS = 2
 
 
 class ObjectType(Enum):
@@ -66,6 +70,11 @@ class Scene:
         f0 = Frame("world", sp.SE3())
         self._frames["world"] = f0
 
+        # Incremental tracking (see start_tracking)
+        self._tracking_graph = None
+        self._tracked_frames = {}
+        self._motion_noise = np.array(DEFAULT_MOTION_NOISE)
+
     # Scene construction
     def _add_object(self, name, obj_type, frame, pose_in_frame, size):
         # Parse input
@@ -201,16 +210,20 @@ class Scene:
         )
         graph.add_prior("f__world", sp.SE3())
 
-    def _add_detected_markers(self, graph, detected_markers, prefix, lock_frames):
-        updated_frames = set("world")
+    @staticmethod
+    def _node_prefix(frame, prefix):
+        # The world frame & its objects are shared by all snapshots
+        return "" if frame == "world" else prefix
+
+    def _add_detected_markers(
+        self, graph, detected_markers, prefix, lock_frames, updated_frames=None
+    ):
+        updated_frames = {"world"} if updated_frames is None else updated_frames
 
         for camera_name, markers in detected_markers.items():
             # Init camera
             c = self._objects[camera_name]
-            if c.frame == "world":
-                c_node = f"o__{camera_name}"
-            else:
-                c_node = f"o_{prefix}_{camera_name}"
+            c_node = f"o_{self._node_prefix(c.frame, prefix)}_{camera_name}"
             if c.frame not in updated_frames:
                 self._init_frame(graph, c.frame, prefix=prefix, lock_frames=lock_frames)
                 updated_frames.add(c.frame)
@@ -222,10 +235,7 @@ class Scene:
 
                 # Init marker
                 m = self._objects[marker_name]
-                if m.frame == "world":
-                    m_node = f"o__{marker_name}"
-                else:
-                    m_node = f"o_{prefix}_{marker_name}"
+                m_node = f"o_{self._node_prefix(m.frame, prefix)}_{marker_name}"
                 if m.frame not in updated_frames:
                     self._init_frame(graph, m.frame, prefix=prefix, lock_frames=lock_frames)
                     updated_frames.add(m.frame)
@@ -233,22 +243,33 @@ class Scene:
                 # Add observations
                 graph.add_observation(c_node, m_node, marker_obs.pose, self._camera_noise)
 
-    def _add_frame_transforms(self, graph, frame_transforms, prefix, lock_frames):
+        return updated_frames
+
+    def _add_frame_transforms(
+        self, graph, frame_transforms, prefix, lock_frames, updated_frames=None
+    ):
+        updated_frames = {"world"} if updated_frames is None else updated_frames
+
         for frame1_name, frame2_name, transform in frame_transforms:
-            f1 = self._frames[frame1_name]
-            f2 = self._frames[frame2_name]
-            f1_node = f"f_{prefix}_{frame1_name}"
-            f2_node = f"f_{prefix}_{frame2_name}"
+            f1_node = f"f_{self._node_prefix(frame1_name, prefix)}_{frame1_name}"
+            f2_node = f"f_{self._node_prefix(frame2_name, prefix)}_{frame2_name}"
 
-        self._init_frame(graph, frame1_name, prefix=prefix, lock_frames=lock_frames)
-        self._init_frame(graph, frame2_name, prefix=prefix, lock_frames=lock_frames)
-        graph.add_observation(f1_node, f2_node, transform, self._calib_noise)
+            for frame_name in [frame1_name, frame2_name]:
+                if frame_name not in updated_frames:
+                    self._init_frame(graph, frame_name, prefix=prefix, lock_frames=lock_frames)
+                    updated_frames.add(frame_name)
+            graph.add_observation(f1_node, f2_node, transform, self._calib_noise)
+
+        return updated_frames
 
     def _optimize_and_update(self, graph, verbosity=0):
         # Optimize graph
         results = graph.optimize(verbosity=verbosity)
 
         # Extract results
+        self._update_from_results(results)
+
+    def _update_from_results(self, results):
         for frame_name, frame in self._frames.items():
             f_node = f"f__{frame_name}"
             if f_node in results:
@@ -279,7 +300,14 @@ class Scene:
         Auxilliary observations between frames:
             frame_transform => (frame1_name, frame2_name, transform)
             frame_transforms => List[frame_transform] - all frame transforms in snapshot
+
+        If tracking was started (see start_tracking), the observations are added to the
+        live tracking graph instead of solving a new graph.
         """
+        if self._tracking_graph is not None:
+            self._track(detected_markers, frame_transforms)
+            return
+
         graph = FactorGraph()
 
         # Reset visibility
@@ -287,13 +315,89 @@ class Scene:
 
         # Add factors
         self._add_world_prior(graph, lock_frames=True)
-        self._add_detected_markers(graph, detected_markers, prefix="", lock_frames=True)
+        updated_frames = self._add_detected_markers(
+            graph, detected_markers, prefix="", lock_frames=True
+        )
         if frame_transforms is not None:
-            self._add_frame_transforms(graph, frame_transforms, prefix="", lock_frames=True)
+            self._add_frame_transforms(
+                graph, frame_transforms, prefix="", lock_frames=True, updated_frames=updated_frames
+            )
 
         # Optimize graph & update data
         self._optimize_and_update(graph, verbosity=verbosity)
 
+    def start_tracking(
+        self,
+        window_size=DEFAULT_TRACKING_WINDOW,
+        motion_noise=None,
+        n_iterations=DEFAULT_TRACKING_ITERATIONS,
+    ):
+        """Estimate poses incrementally in subsequent calls to update_pose_estimations
+
+        The factor graph is kept alive across calls (timesteps): each call only adds the
+        new observations, the poses of the moving frames at that timestep and a motion
+        factor linking them to their previous poses, and updates the solution with iSAM2.
+        Timesteps older than window_size are marginalized out, so the cost of a call stays
+        constant as tracking goes on.
+
+        Extrinsics (objects' poses in their frames) are fixed to their current values,
+        so calibrate_extrinsics should be run first.
+        """
+        if motion_noise is None:
+            self._motion_noise = np.array(DEFAULT_MOTION_NOISE)
+        else:
+            assert len(motion_noise) == 6, "Invalid noise vector dimensions."
+            self._motion_noise = np.array(motion_noise)
+        self._tracking_iterations = n_iterations
+
+        graph = IncrementalFactorGraph(lag=window_size)
+        self._tracking_graph = graph
+        self._tracked_frames = {}
+
+        # The world frame & its objects persist across timesteps
+        self._add_world_prior(graph, lock_frames=True)
+        for var_name in list(graph.vars.keys()):
+            graph.mark_static(var_name)
+        graph.update()
+
+    def stop_tracking(self):
+        self._tracking_graph = None
+        self._tracked_frames = {}
+
+    def _track(self, detected_markers, frame_transforms=None):
+        graph = self._tracking_graph
+        prefix = graph.timestep
+
+        # Reset visibility
+        self._reset_visibility()
+
+        # Add factors of the new observations
+        updated_frames = self._add_detected_markers(
+            graph, detected_markers, prefix=prefix, lock_frames=True
+        )
+        if frame_transforms is not None:
+            self._add_frame_transforms(
+                graph, frame_transforms, prefix, lock_frames=True, updated_frames=updated_frames
+            )
+
+        # Link the moving frames to their poses at the previous timesteps
+        for frame_name in updated_frames - {"world"}:
+            f_node = f"f_{prefix}_{frame_name}"
+            prev_f_node = self._tracked_frames.get(frame_name)
+            if prev_f_node in graph.vars:
+                graph.add_observation(prev_f_node, f_node, sp.SE3(), self._motion_noise)
+            self._tracked_frames[frame_name] = f_node
+
+        # Update the solution & data
+        results = graph.optimize(n_iterations=self._tracking_iterations)
+
+        current_results = {}
+        for node, pose in results.items():
+            node_type, node_prefix, name = node.split("_", 2)
+            if node_prefix == "" or node_prefix == str(prefix):
+                current_results[f"{node_type}__{name}"] = pose
+        self._update_from_results(current_results)
+
     def add_snapshot(
         self,
         detected_markers: Dict[str, List[MarkerInfo]],
@@ -329,9 +433,13 @@ class Scene:
         for i in range(n_samples):
             detected_markers, frame_transforms = self._snapshots[i]
 
-            self._add_detected_markers(graph, detected_markers, prefix=i, lock_frames=False)
+            updated_frames = self._add_detected_markers(
+                graph, detected_markers, prefix=i, lock_frames=False
+            )
             if frame_transforms is not None:
-                self._add_frame_transforms(graph, frame_transforms, prefix=i, lock_frames=False)
+                self._add_frame_transforms(
+                    graph, frame_transforms, i, lock_frames=False, updated_frames=updated_frames
+                )
 
         # Initialize variables using BFS
         graph.bfs_initialization(init_node or "f__world")
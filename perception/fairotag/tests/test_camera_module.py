@@ -71,3 +71,25 @@ def test_detected_markers(detected_markers):
         else:
             assert marker.length is None
             assert marker.pose is None
+
+
+def test_multi_camera_module(intrinsics, detected_markers):
+    cameras = {}
+    for name in ["0", "1", "2"]:
+        cameras[name] = frt.CameraModule()
+        cameras[name].set_intrinsics(intrinsics=intrinsics)
+        for marker_id in [0, 3, 4]:
+            cameras[name].register_marker_size(marker_id, MARKER_LENGTH)
+
+    img = cv2.imread(INPUT_IMGFILE)
+    with frt.MultiCameraModule(cameras) as multi_camera:
+        markers = multi_camera.detect_markers({name: img for name in cameras})
+
+    assert list(markers.keys()) == ["0", "1", "2"]
+    for camera_markers in markers.values():
+        assert [m.id for m in camera_markers] == [m.id for m in detected_markers]
+        for marker, expected in zip(camera_markers, detected_markers):
+            if expected.pose is None:
+                assert marker.pose is None
+            else:
+                assert np.allclose(marker.pose.matrix(), expected.pose.matrix())
@@ -142,3 +142,44 @@ def _test_scene_calibration2(setup_dict):
     print(t23_inferred.log() - t23_gt.log())
     assert np.allclose(t01_inferred.log(), t01_gt.log(), atol=1e-2)
     assert np.allclose(t23_inferred.log(), t23_gt.log(), atol=1e-2)
+
+
+def test_scene_tracking(setup_dict):
+    """
+    Tests incremental tracking of marker A (on a moving frame) seen by both cameras.
+    """
+    scene = frt.Scene()
+    scene.add_camera("0", pose_in_frame=sp.SE3())
+    scene.add_camera("1", pose_in_frame=setup_dict["t01"])
+
+    scene.add_frame("ee")
+    scene.add_marker(2, frame="ee", pose_in_frame=sp.SE3())
+
+    window_size = 5
+    scene.start_tracking(window_size=window_size)
+
+    # Track a marker moving smoothly from one of the sampled poses
+    t2_start = setup_dict["t02_samples"][0]
+    t2_end = setup_dict["t02_samples"][1]
+    t2_diff = (t2_start.inverse() * t2_end).log() * 0.2
+    n_steps = 4 * window_size
+    for i in range(n_steps):
+        t02 = t2_start * sp.SE3.exp(t2_diff * i / (n_steps - 1))
+        t12 = setup_dict["t01"].inverse() * t02
+        detected_markers = {
+            "0": [frt.MarkerInfo(id=2, pose=t02, corner=None, length=None)],
+            "1": [frt.MarkerInfo(id=2, pose=t12, corner=None, length=None)],
+        }
+        scene.update_pose_estimations(detected_markers)
+
+        t02_inferred = scene.get_marker_info(2)["pose"]
+        assert scene.get_marker_info(2)["is_visible"]
+        assert np.allclose(t02_inferred.log(), t02.log(), atol=1e-2)
+
+    # Old timesteps are marginalized
+    n_vars = len(scene._tracking_graph.vars)
+    assert n_vars <= 2 * (window_size + 1) + 3
+
+    # Tracking a frame that is not seen is not visible
+    scene.update_pose_estimations({"0": []})
+    assert not scene.get_marker_info(2)["is_visible"]
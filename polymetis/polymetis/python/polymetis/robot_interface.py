@@ -3,7 +3,9 @@
 # This source code is licensed under the MIT license found in the
 # LICENSE file in the root directory of this source tree.
 import io
-from typing import Dict, Generator, List, Tuple
+import hashlib
+from collections import OrderedDict
+from typing import Dict, Generator, List, Optional, Tuple, Union
 import time
 import tempfile
 import threading
@@ -24,8 +26,15 @@ from torchcontrol.transform import Transformation as T
 log = logging.getLogger(__name__)
 
 
-# Maximum bytes we send per message to server (so as not to overload it).
-MAX_BYTES_PER_MSG = 1024
+# Bounds on the bytes we send per message to server. Policies are split into
+# roughly TARGET_MSGS_PER_POLICY chunks within these bounds; the maximum is
+# well below gRPC's default 4MB message size limit.
+MIN_BYTES_PER_MSG = 1024
+MAX_BYTES_PER_MSG = 1024 * 1024
+TARGET_MSGS_PER_POLICY = 8
+
+# Number of serialized policies kept by the client-side policy cache
+POLICY_CACHE_SIZE = 16
 
 # Polling rate when waiting for episode to finish
 POLLING_RATE = 50
@@ -57,16 +66,132 @@ class ParamDictContainer(torch.nn.Module):
         return self.param_dict
 
 
+# Attributes every torch.nn.Module has (hooks, flags, ...), not part of a policy's content
+_MODULE_INTERNALS = set(torch.nn.Module().__dict__.keys())
+
+
+def _hash_value(h, value, opaque: list, values: bool = True) -> None:
+    """Feeds a description of value into the hash h. Objects whose contents can't
+    be described (e.g. C++ custom classes) are hashed by identity, and appended to
+    opaque so that they can be kept alive while the hash is in use. If not values,
+    only the dtypes and shapes of tensors are hashed."""
+    if isinstance(value, torch.Tensor):
+        t = value.detach().cpu().contiguous()
+        h.update(f"T{t.dtype}{tuple(t.shape)}".encode())
+        if not values:
+            return
+        if t.dtype == torch.bfloat16:
+            t = t.float()
+        h.update(t.numpy().tobytes())
+    elif value is None or isinstance(value, (bool, int, float, str, bytes)):
+        h.update(f"V{type(value).__name__}:{value!r}".encode())
+    elif isinstance(value, (list, tuple)):
+        h.update(f"L{type(value).__name__}{len(value)}".encode())
+        for v in value:
+            _hash_value(h, v, opaque, values)
+    elif isinstance(value, dict):
+        h.update(f"D{len(value)}".encode())
+        for k, v in value.items():
+            h.update(f"K{k!r}".encode())
+            _hash_value(h, v, opaque, values)
+    elif isinstance(value, torch.nn.Module) and not isinstance(
+        value, torch.jit.ScriptModule
+    ):
+        # submodules are hashed by policy_hash itself
+        h.update(f"M{type(value).__qualname__}".encode())
+    else:
+        h.update(f"O{type(value).__qualname__}{id(value)}".encode())
+        opaque.append(value)
+
+
+def policy_hash(torch_policy: torch.nn.Module) -> Tuple[str, str, list]:
+    """Computes content hashes of an (eager) policy: the types, parameters,
+    buffers and attributes of its modules, which determine its scripted form.
+
+    Args:
+        torch_policy: the policy to hash.
+
+    Returns:
+        The hex digest of the policy's content; the hex digest of its structure,
+        which leaves out the values (but not the names, dtypes and shapes) of the
+        parameters registered on the policy itself, the ones `update_current_policy`
+        can change; and the list of objects hashed by identity.
+    """
+    content = hashlib.sha1()
+    structure = hashlib.sha1()
+    opaque = []
+    for name, module in torch_policy.named_modules():
+        for h in (content, structure):
+            h.update(
+                f"N{name}:{type(module).__module__}.{type(module).__qualname__}".encode()
+            )
+        if isinstance(module, torch.jit.ScriptModule):
+            _hash_value(content, module, opaque)
+            _hash_value(structure, module, opaque)
+            continue
+        attrs = {k: v for k, v in module.__dict__.items() if k not in _MODULE_INTERNALS}
+        for h in (content, structure):
+            # ControlModule keeps its parameters in _param_dict too
+            values = h is content or module is not torch_policy
+            _hash_value(h, module._parameters, opaque, values)
+            _hash_value(h, module._buffers, opaque)
+            _hash_value(
+                h, {k: v for k, v in attrs.items() if k != "_param_dict"}, opaque
+            )
+            _hash_value(h, attrs.get("_param_dict"), opaque, values)
+    return content.hexdigest(), structure.hexdigest(), opaque
+
+
+class PolicyCache:
+    """A least-recently-used, content-addressed cache of serialized policies,
+    so that sending a policy whose content was sent before skips scripting and
+    serialization.
+
+    Args:
+        maxsize: Number of serialized policies to keep.
+    """
+
+    def __init__(self, maxsize: int = POLICY_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Optional[bytes]:
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+
+    def put(self, key: str, data: bytes, opaque: list) -> None:
+        # opaque objects are kept alive so that their ids aren't reused
+        self.entries[key] = (data, opaque)
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def clear(self) -> None:
+        self.entries.clear()
+
+
 class BaseRobotInterface:
     """Base robot interface class to initialize a connection to a gRPC controller manager server.
 
     Args:
         ip_address: IP address of the gRPC-based controller manager server.
         port: Port to connect to on the IP address.
+        policy_cache_size: Number of serialized policies kept by the client-side policy cache.
     """
 
     def __init__(
-        self, ip_address: str = "localhost", port: int = 50051, enforce_version=True
+        self,
+        ip_address: str = "localhost",
+        port: int = 50051,
+        enforce_version=True,
+        policy_cache_size: int = POLICY_CACHE_SIZE,
     ):
         # Create connection
         self.channel = grpc.insecure_channel(f"{ip_address}:{port}")
@@ -83,32 +208,112 @@ class BaseRobotInterface:
                 client_ver == server_ver
             ), "Version mismatch between client & server detected! Set enforce_version=False to bypass this error."
 
+        # Serialized policies, and the policy last sent (see `send_torch_policy`)
+        self.policy_cache = PolicyCache(policy_cache_size)
+        self._sent_policy_params = None
+        self._sent_policy_structure = None
+        self._sent_policy_interval = None
+
     def __del__(self):
         # Close connection in destructor
         self.channel.close()
 
     @staticmethod
-    def _get_msg_generator(scripted_module) -> Generator:
-        """Given a scripted module, return a generator of its serialized bits
-        as byte chunks of max size MAX_BYTES_PER_MSG."""
-        # Write into bytes buffer
+    def _get_chunk_size(num_bytes: int) -> int:
+        """Chunk size for streaming num_bytes: large enough to keep the number of
+        messages small, but bounded so that no single message gets too large."""
+        chunk_size = -(-num_bytes // TARGET_MSGS_PER_POLICY)
+        return max(MIN_BYTES_PER_MSG, min(MAX_BYTES_PER_MSG, chunk_size))
+
+    @staticmethod
+    def _serialize(scripted_module) -> bytes:
         buffer = io.BytesIO()
         torch.jit.save(scripted_module, buffer)
-        buffer.seek(0)
+        return buffer.getvalue()
+
+    @staticmethod
+    def _get_msg_generator(
+        scripted_module: Union[torch.jit.ScriptModule, bytes]
+    ) -> Generator:
+        """Given a scripted module (or its serialized bytes), return a generator of
+        its serialized bits as byte chunks of adaptive size (see `_get_chunk_size`)."""
+        if isinstance(scripted_module, bytes):
+            data = scripted_module
+        else:
+            data = BaseRobotInterface._serialize(scripted_module)
+        chunk_size = BaseRobotInterface._get_chunk_size(len(data))
+        view = memoryview(data)
 
         # Create policy generator
         def msg_generator():
-            # A generator which chunks a scripted module into messages of
-            # size MAX_BYTES_PER_MSG and send these messages to the server.
-            while True:
-                chunk = buffer.read(MAX_BYTES_PER_MSG)
-                if not chunk:  # end of buffer
-                    break
-                msg = ControllerChunk(torchscript_binary_chunk=chunk)
-                yield msg
+            # A generator which chunks a serialized module into messages of
+            # size chunk_size and send these messages to the server.
+            for start in range(0, len(data), chunk_size):
+                chunk = view[start : start + chunk_size].tobytes()
+                yield ControllerChunk(torchscript_binary_chunk=chunk)
 
         return msg_generator
 
+    def _get_serialized_policy(
+        self, torch_policy: toco.PolicyModule, key: str, opaque: list
+    ) -> bytes:
+        """Scripts & serializes the policy, or returns the cached result for a
+        policy with the same content hash (key, from `policy_hash`)."""
+        data = self.policy_cache.get(key)
+        if data is None:
+            data = self._serialize(torch.jit.script(torch_policy))
+            self.policy_cache.put(key, data, opaque)
+        return data
+
+    def _try_update_running_policy(
+        self, torch_policy: toco.PolicyModule, structure: str
+    ) -> bool:
+        """If the policy last sent by this interface is still running and has the same
+        structure (see `policy_hash`) as torch_policy, i.e. only the values of its
+        parameters differ, re-parameterize it with `update_current_policy` instead of
+        sending a new policy.
+
+        Returns:
+            True if the running policy was updated.
+        """
+        if self._sent_policy_structure is None:
+            return False
+        if structure != self._sent_policy_structure:
+            return False
+        episode_interval = self.grpc_connection.GetEpisodeInterval(EMPTY)
+        if (
+            episode_interval.end != -1
+            or episode_interval.start != self._sent_policy_interval.start
+        ):
+            # finished, or replaced by another client
+            return False
+        param_dict = {
+            name: param.detach()
+            for name, param in torch_policy._parameters.items()
+            if param is not None
+            and not torch.equal(param, self._sent_policy_params[name])
+        }
+        if param_dict:
+            try:
+                self.update_current_policy(param_dict)
+            except grpc.RpcError:
+                return False
+            self._sent_policy_params.update(
+                {name: param.clone() for name, param in param_dict.items()}
+            )
+        return True
+
+    def _record_sent_policy(
+        self, torch_policy: toco.PolicyModule, structure: str, log_interval: LogInterval
+    ) -> None:
+        self._sent_policy_structure = structure
+        self._sent_policy_params = {
+            name: param.detach().clone()
+            for name, param in torch_policy._parameters.items()
+            if param is not None
+        }
+        self._sent_policy_interval = log_interval
+
     def _get_robot_state_log(
         self, log_interval: LogInterval, timeout: float = None
     ) -> List[RobotState]:
@@ -178,13 +383,21 @@ class BaseRobotInterface:
         torch_policy: toco.PolicyModule,
         blocking: bool = True,
         timeout: float = None,
+        reuse_running: bool = False,
     ) -> List[RobotState]:
         """Sends the ScriptableTorchPolicy to the server.
 
+        Policies are scripted & serialized once per content (see `PolicyCache`),
+        so sending the same policy again only uploads it.
+
         Args:
             torch_policy: An instance of ScriptableTorchPolicy to control the robot.
             blocking: If True, blocks until the policy is finished executing, then returns the list of RobotStates.
             timeout: Amount of time (in seconds) to wait before throwing a TimeoutError.
+            reuse_running: If True and not `blocking`, and the policy last sent is still running
+                           and only differs from torch_policy in the values of its parameters,
+                           the running policy is updated with `update_current_policy` instead
+                           of being replaced (its episode, and any other state, continue).
 
         Returns:
             If `blocking`, returns a list of RobotState objects. Otherwise, returns None.
@@ -192,15 +405,22 @@ class BaseRobotInterface:
         """
         start_time = time.time()
 
+        content, structure, opaque = policy_hash(torch_policy)
+        if reuse_running and not blocking:
+            if self._try_update_running_policy(torch_policy, structure):
+                return None
+
         # Script & chunk policy
-        scripted_policy = torch.jit.script(torch_policy)
-        msg_generator = self._get_msg_generator(scripted_policy)
+        msg_generator = self._get_msg_generator(
+            self._get_serialized_policy(torch_policy, content, opaque)
+        )
 
         # Send policy as stream
         try:
             log_interval = self.grpc_connection.SetController(msg_generator())
         except grpc.RpcError as e:
             raise grpc.RpcError(f"POLYMETIS SERVER ERROR --\n{e.details()}") from None
+        self._record_sent_policy(torch_policy, structure, log_interval)
 
         if blocking:
             # Check policy termination
@@ -520,10 +740,14 @@ class RobotInterface(BaseRobotInterface):
     Continuous control methods
     """
 
-    def start_joint_impedance(self, Kq=None, Kqd=None, **kwargs):
+    def start_joint_impedance(self, Kq=None, Kqd=None, reuse_running=False, **kwargs):
         """Starts joint position control mode.
         Runs an non-blocking joint impedance controller.
         The desired joint positions can be updated using `update_desired_joint_positions`
+
+        If reuse_running, and the controller started last by this interface is still
+        running with the same gains, its desired state is reset to the current one
+        instead of a new controller being started (see `send_torch_policy`).
         """
         torch_policy = toco.policies.JointImpedanceControl(
             joint_pos_current=self.get_joint_positions(),
@@ -533,12 +757,20 @@ class RobotInterface(BaseRobotInterface):
             ignore_gravity=self.use_grav_comp,
         )
 
-        return self.send_torch_policy(torch_policy=torch_policy, blocking=False)
+        return self.send_torch_policy(
+            torch_policy=torch_policy, blocking=False, reuse_running=reuse_running
+        )
 
-    def start_cartesian_impedance(self, Kx=None, Kxd=None, **kwargs):
+    def start_cartesian_impedance(
+        self, Kx=None, Kxd=None, reuse_running=False, **kwargs
+    ):
         """Starts Cartesian position control mode.
         Runs an non-blocking Cartesian impedance controller.
         The desired EE pose can be updated using `update_desired_ee_pose`
+
+        If reuse_running, and the controller started last by this interface is still
+        running with the same gains, its desired state is reset to the current one
+        instead of a new controller being started (see `send_torch_policy`).
         """
         torch_policy = toco.policies.CartesianImpedanceControl(
             joint_pos_current=self.get_joint_positions(),
@@ -548,7 +780,9 @@ class RobotInterface(BaseRobotInterface):
             ignore_gravity=self.use_grav_comp,
         )
 
-        return self.send_torch_policy(torch_policy=torch_policy, blocking=False)
+        return self.send_torch_policy(
+            torch_policy=torch_policy, blocking=False, reuse_running=reuse_running
+        )
 
     def update_desired_joint_positions(self, positions: torch.Tensor):
         """Update the desired joint positions used by the joint position control mode.
@@ -232,10 +232,9 @@ Status PolymetisControllerServerImpl::SetController(
   controller_model_buffer_.clear();
   ControllerChunk chunk;
   while (stream->Read(&chunk)) {
-    std::string binary_blob = chunk.torchscript_binary_chunk();
-    for (int i = 0; i < binary_blob.size(); i++) {
-      controller_model_buffer_.push_back(binary_blob[i]);
-    }
+    const std::string &binary_blob = chunk.torchscript_binary_chunk();
+    controller_model_buffer_.insert(controller_model_buffer_.end(),
+                                    binary_blob.begin(), binary_blob.end());
   }
 
   try {
@@ -283,10 +282,9 @@ Status PolymetisControllerServerImpl::UpdateController(
   updates_model_buffer_.clear();
   ControllerChunk chunk;
   while (stream->Read(&chunk)) {
-    std::string binary_blob = chunk.torchscript_binary_chunk();
-    for (int i = 0; i < binary_blob.size(); i++) {
-      updates_model_buffer_.push_back(binary_blob[i]);
-    }
+    const std::string &binary_blob = chunk.torchscript_binary_chunk();
+    updates_model_buffer_.insert(updates_model_buffer_.end(),
+                                 binary_blob.begin(), binary_blob.end());
   }
 
   // Load param container
@@ -0,0 +1,74 @@
+# Copyright (c) Facebook, Inc. and its affiliates.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+import torch
+
+from polymetis.robot_interface import (
+    BaseRobotInterface,
+    PolicyCache,
+    policy_hash,
+    MIN_BYTES_PER_MSG,
+    MAX_BYTES_PER_MSG,
+)
+import torchcontrol as toco
+
+
+def make_policy(joint_pos, Kp):
+    return toco.policies.JointImpedanceControl(
+        joint_pos_current=torch.tensor(joint_pos),
+        Kp=torch.tensor(Kp),
+        Kd=torch.ones(2),
+        robot_model=robot_model,
+    )
+
+
+class FakeRobotModel(torch.nn.Module):
+    pass
+
+
+robot_model = FakeRobotModel()
+
+
+def test_policy_hash():
+    policy = make_policy([0.0, 1.0], [1.0, 1.0])
+    same = make_policy([0.0, 1.0], [1.0, 1.0])
+    moved = make_policy([0.5, 1.0], [1.0, 1.0])
+    stiffer = make_policy([0.0, 1.0], [2.0, 2.0])
+
+    content, structure, _ = policy_hash(policy)
+    assert policy_hash(same)[:2] == (content, structure)
+    assert policy_hash(moved)[0] != content
+    # the desired joint positions are a parameter of the policy itself...
+    assert policy_hash(moved)[1] == structure
+    # ...the gains are not
+    assert policy_hash(stiffer)[1] != structure
+    # and so are the names and shapes of its parameters
+    policy.register_parameter("extra", torch.nn.Parameter(torch.zeros(2)))
+    extended = policy_hash(policy)[1]
+    assert extended != structure
+    policy.register_parameter("extra", torch.nn.Parameter(torch.zeros(3)))
+    assert policy_hash(policy)[1] not in (structure, extended)
+
+
+def test_policy_cache():
+    cache = PolicyCache(maxsize=2)
+    assert cache.get("a") is None
+    cache.put("a", b"1", [])
+    cache.put("b", b"2", [])
+    assert cache.get("a") == b"1"
+    cache.put("c", b"3", [])
+    assert cache.get("b") is None
+    assert cache.get("a") == b"1"
+    assert cache.hits == 2
+    assert cache.misses == 2
+
+
+def test_msg_generator():
+    for num_bytes in [0, 10, 5000, 3 * MAX_BYTES_PER_MSG]:
+        data = bytes(i % 256 for i in range(num_bytes))
+        msgs = list(BaseRobotInterface._get_msg_generator(data)())
+        assert b"".join(m.torchscript_binary_chunk for m in msgs) == data
+        assert all(len(m.torchscript_binary_chunk) <= MAX_BYTES_PER_MSG for m in msgs)
+        if num_bytes > MIN_BYTES_PER_MSG:
+            assert len(msgs) > 1